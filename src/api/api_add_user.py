@@ -1,20 +1,26 @@
 import requests
 import json
 import logging
-from typing import Dict, Any, Optional
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional
 from src.models.user import VpnUser
+from src.api.http_session import get_session
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
 class VpnApiClient:
-    def __init__(self, base_url: str, api_key: Optional[str] = None):
+    def __init__(self, base_url: str, api_key: Optional[str] = None, session: Optional[requests.Session] = None):
         """
         Initialize the VPN API client.
         
         Args:
             base_url: Base URL of the API
             api_key: API key or token for authentication
+            session: Session to send requests with; defaults to the shared 'vpn-api' pool
         """
         # Ensure base URL ends with a slash
         if not base_url.endswith('/'):
@@ -22,6 +28,8 @@ class VpnApiClient:
             
         self.base_url = base_url
         self.api_key = api_key
+        # Creating a user is not idempotent, so only requests that never reached the API are retried
+        self.session = session or get_session('vpn-api')
         
         # Define API endpoints
         self.users_endpoint = f"{self.base_url}api/v1/users/"
@@ -62,7 +70,7 @@ class VpnApiClient:
         
         try:
             # Send the POST request
-            response = requests.post(
+            response = self.session.post(
                 self.users_endpoint,
                 headers=self.headers,
                 json=data
@@ -96,3 +104,63 @@ class VpnApiClient:
                 error_msg = f"Connection error: {str(e)}"
             
             raise Exception(f"Failed to add user: {error_msg}")
+
+    def iter_add_users(self, users: Iterable[VpnUser], concurrency: int = 8) -> Iterator[Dict[str, Any]]:
+        """
+        Add many users, yielding one result per user in input order.
+        
+        At most `concurrency` requests are in flight and only a few more
+        users are read ahead, so `users` can be a generator over a large
+        file. A failed user does not stop the others.
+        
+        Args:
+            users: VpnUser objects to add
+            concurrency: Parallel requests; keep it within HTTP_POOL_SIZE
+            
+        Yields:
+            {"username", "ok", "response"} on success or {"username", "ok", "error"} on failure
+        """
+        def add(user: VpnUser) -> Dict[str, Any]:
+            try:
+                return {"username": user.username, "ok": True, "response": self.add_user(user)}
+            except Exception as e:
+                return {"username": user.username, "ok": False, "error": str(e)}
+        
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='vpn-api') as pool:
+            pending = deque()
+            for user in users:
+                pending.append(pool.submit(add, user))
+                if len(pending) >= concurrency * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    
+    def add_users(self, users: Iterable[VpnUser], concurrency: int = 8) -> List[Dict[str, Any]]:
+        """
+        Add many users with bounded concurrency; see iter_add_users.
+        
+        Returns:
+            One result dict per user, in input order
+        """
+        return list(self.iter_add_users(users, concurrency))
+
+
+_client: Optional[VpnApiClient] = None
+_client_lock = threading.Lock()
+
+
+def get_vpn_api_client() -> VpnApiClient:
+    """
+    Return the shared client for the API configured by VPN_API_URL and API_KEY.
+    
+    Raises:
+        ValueError: If VPN_API_URL is not set
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            base_url = os.getenv('VPN_API_URL')
+            if not base_url:
+                raise ValueError("VPN_API_URL is not configured")
+            _client = VpnApiClient(base_url, os.getenv('API_KEY'))
+        return _client
@@ -4,6 +4,7 @@ import json
 import random
 import string
 from dotenv import load_dotenv
+from src.api.http_session import get_session
 
 class APIClient:
     def __init__(self):
@@ -21,10 +22,11 @@ class APIClient:
             'accept': 'application/json',
             'Authorization': self.token
         }
+        self.session = get_session('vpn-api')
     
     def get_users(self):
         try:
-            response = requests.get(self.users_endpoint, headers=self.headers)
+            response = self.session.get(self.users_endpoint, headers=self.headers)
             response.raise_for_status()
             print(f"API Response: {response.text[:200]}...")
             try:
@@ -47,7 +49,7 @@ class APIClient:
         
         try:
             print(f"Sending request to {self.users_endpoint} with data: {data}")
-            response = requests.post(
+            response = self.session.post(
                 self.users_endpoint, 
                 headers=post_headers, 
                 json=data
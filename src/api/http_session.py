@@ -0,0 +1,85 @@
+import os
+import random
+import threading
+from typing import Dict, Iterable, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeout in seconds for every request made through these sessions
+HTTP_TIMEOUT: Tuple[float, float] = (
+    float(os.getenv('HTTP_CONNECT_TIMEOUT', '5')),
+    float(os.getenv('HTTP_READ_TIMEOUT', '30'))
+)
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', '0.5'))
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '16'))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'})
+
+
+class JitteredRetry(Retry):
+    """Retry whose backoff is drawn uniformly from [0, exponential backoff] ("full jitter")"""
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+class TimeoutSession(requests.Session):
+    """Session that applies HTTP_TIMEOUT to requests made without an explicit timeout"""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+        return super().request(method, url, **kwargs)
+
+
+def create_session(retry_methods: Iterable[str] = IDEMPOTENT_METHODS) -> requests.Session:
+    """
+    Create a session with a connection pool, timeouts and a retry policy.
+
+    Args:
+        retry_methods: HTTP methods retried after read errors and retryable
+            statuses. Requests that never reached the server (connect errors)
+            are retried for every method.
+
+    Returns:
+        A requests.Session; it is safe to share between threads
+    """
+    retry = JitteredRetry(
+        total=HTTP_RETRIES,
+        connect=HTTP_RETRIES,
+        read=HTTP_RETRIES,
+        status=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(method.upper() for method in retry_methods),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = TimeoutSession()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+_sessions: Dict[str, requests.Session] = {}
+_lock = threading.Lock()
+
+
+def get_session(name: str, retry_methods: Iterable[str] = IDEMPOTENT_METHODS) -> requests.Session:
+    """
+    Return the process-wide session registered under name, creating it on first use.
+
+    Args:
+        name: Pool name, e.g. 'vpn-api' or 'cryptomus'
+        retry_methods: Used when the session is created, see create_session
+    """
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = create_session(retry_methods)
+        return session
@@ -16,6 +16,12 @@ source $INSTALL_DIR/venv/bin/activate
 # Set Python path to include project root
 export PYTHONPATH=$INSTALL_DIR:$PYTHONPATH
 
+# Optional first argument picks how updates arrive: polling (default) or webhook;
+# without it BOT_MODE from the .env file applies
+if [ -n "$1" ]; then
+    export BOT_MODE="$1"
+fi
+
 # Run the wrapper script which handles errors and logging
 python $INSTALL_DIR/src/bot/wrapper.py 2>> $LOG_DIR/error.log
 
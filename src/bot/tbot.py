@@ -1,6 +1,12 @@
+# Fork the QR render workers while this process has no other threads yet;
+# the imports below construct the TeleBot, which starts its worker threads
+from utils.qr_render import qr_render_service
+qr_render_service.start()
+
 from telebot import types
 from utils.common import create_main_markup
 from utils.adduser import *
+from utils.bulkadd import *
 from utils.backup import *
 from utils.command import *
 from utils.deleteuser import *
@@ -14,6 +20,10 @@ from utils.admin_test_mode import *
 from utils.admin_support import *
 from utils.admin_broadcast import *
 from utils.client_welcome import handle_start, register_handlers
+from utils.client import start_payment_webhook
+from utils.payment_reconcile import start_payment_reconciler
+from utils.admin_broadcast import resume_broadcasts
+from utils.webhook_server import TelegramWebhookServer, webhook_secret
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
@@ -26,5 +36,35 @@ def send_welcome(message):
 # Register client handlers
 register_handlers()
 
+def main(mode=BOT_MODE, engine=BOT_ENGINE):
+    """Start the background services and serve updates until stopped"""
+    if engine == 'async' and mode == 'webhook':
+        raise ValueError("The async engine only supports BOT_MODE=polling")
+    if engine == 'async':
+        # Imported here so the sync engine does not need aiohttp; importing it
+        # also hands invoice polling to its tasks before reconciliation starts
+        from utils.async_engine import run_async
+    start_cli_workers()
+    start_payment_webhook()
+    start_payment_reconciler()
+    resume_broadcasts()
+    if engine == 'async':
+        run_async()
+    elif mode == 'webhook':
+        server = TelegramWebhookServer(
+            bot,
+            BOT_WEBHOOK_URL,
+            BOT_WEBHOOK_HOST,
+            BOT_WEBHOOK_PORT,
+            BOT_WEBHOOK_SECRET or webhook_secret(API_TOKEN),
+            BOT_WORKERS,
+            BOT_QUEUE_SIZE
+        )
+        server.start()
+        server.serve_forever()
+    else:
+        bot.remove_webhook()
+        bot.polling(none_stop=True)
+
 if __name__ == '__main__':
-    bot.polling(none_stop=True)
+    main()
@@ -1,29 +1,32 @@
-import qrcode
-import io
 import os
 import sys
 from telebot import types
 from utils.command import *
 from utils.common import create_main_markup
+from utils.qr import send_qr_photo
 from dotenv import load_dotenv
 
 # Modify this import to use a more direct approach
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
 
 try:
-    from src.api.api_add_user import VpnApiClient
+    from src.api.api_add_user import get_vpn_api_client
     from src.models.user import VpnUser
 except ImportError:
     # Try relative import if absolute import fails
     import subprocess
     subprocess.run(['pip', 'install', '-e', '/etc/dijiq2'])
-    from src.api.api_add_user import VpnApiClient
+    from src.api.api_add_user import get_vpn_api_client
     from src.models.user import VpnUser
 
-# Load environment variables for SUB_URL only (API handles its own credentials)
+# Load environment variables for SUB_URL (the API client reads VPN_API_URL and API_KEY)
 load_dotenv()
 SUB_URL = os.getenv('SUB_URL')
 
+def subscription_url(username):
+    """Normal-SUB subscription link of a user on SUB_URL"""
+    return f"https://{SUB_URL.replace('https://', '').replace('http://', '').rstrip('/')}/sub/normal/{username}#Hysteria2"
+
 def create_cancel_markup(back_step=None):
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     if back_step:
@@ -31,7 +34,7 @@ def create_cancel_markup(back_step=None):
     markup.row(types.KeyboardButton("❌ Cancel"))
     return markup
 
-@bot.message_handler(func=lambda message: is_admin(message.from_user.id) and message.text == '➕ Add User')
+@router.text('➕ Add User', role=ADMIN)
 def add_user(message):
     msg = bot.reply_to(message, "Enter username:", reply_markup=create_cancel_markup())
     bot.register_next_step_handler(msg, process_add_user_step1)
@@ -86,8 +89,8 @@ def process_add_user_step3(message, username, traffic_limit):
         bot.reply_to(message, f"Adding user {username}... Please wait.", reply_markup=types.ReplyKeyboardRemove())
         
         try:
-            # Initialize API client - no credentials needed, API handles them internally
-            api_client = VpnApiClient()
+            # Shared client for VPN_API_URL/API_KEY, reusing its pooled connections
+            api_client = get_vpn_api_client()
             
             # Create VpnUser object without password (API will generate it)
             # Username is already lowercase from process_add_user_step1
@@ -95,15 +98,10 @@ def process_add_user_step3(message, username, traffic_limit):
             
             # Add user through API
             response = api_client.add_user(user)
+            notify_user_write(['add-user', '-u', username, '-t', str(traffic_limit), '-e', str(expiration_days)])
             
             # Generate subscription URL using SUB_URL from environment
-            sub_url = f"https://{SUB_URL.replace('https://', '').replace('http://', '').rstrip('/')}/sub/normal/{username}#Hysteria2"
-            
-            # Generate QR code for the URL
-            qr = qrcode.make(sub_url)
-            bio = io.BytesIO()
-            qr.save(bio, 'PNG')
-            bio.seek(0)
+            sub_url = subscription_url(username)
             
             # Create response message
             result_message = f"User {username} added successfully!\n\n"
@@ -112,7 +110,7 @@ def process_add_user_step3(message, username, traffic_limit):
             result_message += f"`{sub_url}`"
             
             # Send response with QR code
-            bot.send_photo(message.chat.id, photo=bio, caption=result_message, parse_mode="Markdown", 
+            send_qr_photo(message.chat.id, sub_url, owner=username, caption=result_message, parse_mode="Markdown",
                           reply_markup=create_main_markup())
             
         except Exception as e:
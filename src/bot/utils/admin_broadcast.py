@@ -1,8 +1,12 @@
 from telebot import types
 from utils.command import *
 from utils.common import create_main_markup
+from utils.user_directory import user_directory
+from utils.broadcast_jobs import BroadcastManager, get_job, get_unfinished_jobs
 import json
 
+broadcast_manager = BroadcastManager(bot)
+
 def create_broadcast_markup():
     markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
     markup.row('👥 All Users', '✅ Active Users')
@@ -10,37 +14,32 @@ def create_broadcast_markup():
     return markup
 
 def get_user_ids(filter_type):
-    command = f"python3 {CLI_PATH} list-users"
-    result = run_cli_command(command)
-    
     try:
-        users = json.loads(result)
-        user_ids = set()
-        
-        for username, details in users.items():
-            if username.startswith('id'):  # Skip if not a user config
-                continue
-                
-            # Extract telegram_id from username (format: {telegram_id}d{timestamp})
-            telegram_id = username.split('d')[0]
-            
-            if filter_type == 'all':
-                user_ids.add(telegram_id)
-            elif filter_type == 'active' and not details.get('blocked', False):
-                user_ids.add(telegram_id)
-            elif filter_type == 'expired' and details.get('blocked', True):
-                user_ids.add(telegram_id)
-                
-        return list(user_ids)
+        # Segments are kept up to date as configs and bot users change
+        return list(user_directory.audience(filter_type))
     except Exception as e:
         print(f"Error getting user IDs: {str(e)}")
         return []
 
-@bot.message_handler(func=lambda message: is_admin(message.from_user.id) and message.text == '📢 Broadcast Message')
+@router.text('📢 Broadcast Message', role=ADMIN)
 def start_broadcast(message):
+    # Unfinished broadcasts get a fresh status message with their controls
+    for job in get_unfinished_jobs():
+        broadcast_manager.show_status(job['job_id'], new_message=True)
+
+    try:
+        sizes = user_directory.audience_sizes()
+        counts = (
+            f"\n\n👥 All Users: {sizes['all']}\n"
+            f"✅ Active Users: {sizes['active']}\n"
+            f"⛔️ Expired Users: {sizes['expired']}"
+        )
+    except Exception as e:
+        print(f"Error counting broadcast audiences: {str(e)}")
+        counts = ""
     msg = bot.reply_to(
         message,
-        "Select the target users for your broadcast:",
+        f"Select the target users for your broadcast:{counts}",
         reply_markup=create_broadcast_markup()
     )
     bot.register_next_step_handler(msg, process_broadcast_target)
@@ -67,7 +66,7 @@ def process_broadcast_target(message):
     target = target_map[message.text]
     msg = bot.reply_to(
         message,
-        "Enter the message you want to broadcast:",
+        "Send the message you want to broadcast (text, photo or document):",
         reply_markup=types.ReplyKeyboardMarkup(resize_keyboard=True).add(types.KeyboardButton("❌ Cancel"))
     )
     bot.register_next_step_handler(msg, send_broadcast, target)
@@ -77,8 +76,7 @@ def send_broadcast(message, target):
         bot.reply_to(message, "Broadcast canceled.", reply_markup=create_main_markup(is_admin=True))
         return
         
-    broadcast_text = message.text.strip()
-    if not broadcast_text:
+    if message.content_type == 'text' and not message.text.strip():
         bot.reply_to(
             message,
             "Message cannot be empty. Please try again:",
@@ -95,37 +93,41 @@ def send_broadcast(message, target):
             reply_markup=create_main_markup(is_admin=True)
         )
         return
-        
-    success_count = 0
-    fail_count = 0
-    
-    status_msg = bot.reply_to(message, f"Broadcasting message to {len(user_ids)} users...")
-    
-    for user_id in user_ids:
-        try:
-            bot.send_message(int(user_id), broadcast_text)
-            success_count += 1
-        except Exception as e:
-            print(f"Failed to send broadcast to {user_id}: {str(e)}")
-            fail_count += 1
-            
-        # Update status every 10 users
-        if (success_count + fail_count) % 10 == 0:
-            try:
-                bot.edit_message_text(
-                    f"Broadcasting: {success_count + fail_count}/{len(user_ids)} completed...",
-                    chat_id=status_msg.chat.id,
-                    message_id=status_msg.message_id
-                )
-            except:
-                pass
-    
-    final_report = (
-        "📢 Broadcast Completed\n\n"
-        f"Target: {message.text}\n"
-        f"Total Users: {len(user_ids)}\n"
-        f"✅ Successful: {success_count}\n"
-        f"❌ Failed: {fail_count}"
+
+    # The message itself is copied to every user, so photos and documents are uploaded once
+    bot.reply_to(
+        message,
+        f"Broadcasting to {len(user_ids)} users in the background.",
+        reply_markup=create_main_markup(is_admin=True)
     )
-    
-    bot.reply_to(message, final_report, reply_markup=create_main_markup(is_admin=True)) 
+    broadcast_manager.start(target, message.chat.id, message, user_ids)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('broadcast:'))
+def handle_broadcast_control(call):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id)
+        return
+    try:
+        _, action, job_id = call.data.split(':')
+        job_id = int(job_id)
+    except ValueError:
+        bot.answer_callback_query(call.id, "Invalid broadcast.")
+        return
+
+    actions = {
+        'pause': broadcast_manager.pause,
+        'resume': broadcast_manager.resume,
+        'cancel': broadcast_manager.cancel
+    }
+    if action not in actions or get_job(job_id) is None:
+        bot.answer_callback_query(call.id, "Invalid broadcast.")
+        return
+    if not actions[action](job_id):
+        bot.answer_callback_query(call.id, "The broadcast has already finished or changed state.")
+    else:
+        bot.answer_callback_query(call.id)
+    broadcast_manager.show_status(job_id)
+
+def resume_broadcasts():
+    """Carry on with the broadcasts that were running when the bot stopped"""
+    broadcast_manager.resume_unfinished()
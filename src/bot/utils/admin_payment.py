@@ -9,7 +9,7 @@ def create_cancel_markup():
     markup.row(types.KeyboardButton("❌ Cancel"))
     return markup
 
-@bot.message_handler(func=lambda message: is_admin(message.from_user.id) and message.text == '💳 Payment Settings')
+@router.text('💳 Payment Settings', role=ADMIN)
 def payment_settings(message):
     # Show current status
     current_merchant_id = os.getenv('CRYPTOMUS_MERCHANT_ID')
@@ -1,28 +1,21 @@
 from telebot import types
 from utils.command import *
 from utils.common import create_main_markup
-import json
-import os
+from utils.settings_store import json_document
 
 PLANS_FILE = '/etc/hysteria/core/scripts/telegrambot/plans.json'
 
+_plans = json_document(PLANS_FILE, default={
+    "30": {"price": 1.80, "days": 30},
+    "60": {"price": 3.00, "days": 30},
+    "100": {"price": 4.20, "days": 30}
+}, indent=4)
+
 def load_plans():
-    try:
-        if os.path.exists(PLANS_FILE):
-            with open(PLANS_FILE, 'r') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {
-        "30": {"price": 1.80, "days": 30},
-        "60": {"price": 3.00, "days": 30},
-        "100": {"price": 4.20, "days": 30}
-    }
+    return _plans.load()
 
 def save_plans(plans):
-    os.makedirs(os.path.dirname(PLANS_FILE), exist_ok=True)
-    with open(PLANS_FILE, 'w') as f:
-        json.dump(plans, f, indent=4)
+    _plans.save(plans)
 
 def create_plans_markup():
     markup = types.InlineKeyboardMarkup(row_width=3)
@@ -48,7 +41,7 @@ def create_plans_markup():
     
     return markup, plans_text, sorted_plans
 
-@bot.message_handler(func=lambda message: is_admin(message.from_user.id) and message.text == '📝 Edit Plans')
+@router.text('📝 Edit Plans', role=ADMIN)
 def edit_plans(message):
     markup, plans_text, _ = create_plans_markup()
     plans_text += "\nSelect a plan number to edit:"
@@ -1,35 +1,27 @@
-import json
-import os
 from telebot import types
 from utils.command import *
 from utils.common import create_main_markup
+from utils.settings_store import json_document
 
 SUPPORT_FILE = '/etc/hysteria/core/scripts/telegrambot/support_info.json'
 
+_support_info = json_document(SUPPORT_FILE, default={
+    "text": "Need help? Contact our support:\n\n"
+           "📱 Telegram: @your_support_username\n"
+           "📧 Email: support@yourdomain.com\n"
+           "⏰ Working hours: 24/7"
+}, indent=4)
+
 def load_support_info():
-    try:
-        if os.path.exists(SUPPORT_FILE):
-            with open(SUPPORT_FILE, 'r') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {
-        "text": "Need help? Contact our support:\n\n"
-               "📱 Telegram: @your_support_username\n"
-               "📧 Email: support@yourdomain.com\n"
-               "⏰ Working hours: 24/7"
-    }
+    return _support_info.load()
 
 def save_support_info(text):
-    os.makedirs(os.path.dirname(SUPPORT_FILE), exist_ok=True)
-    with open(SUPPORT_FILE, 'w') as f:
-        json.dump({"text": text}, f, indent=4)
+    _support_info.save({"text": text})
 
 def get_support_text():
-    info = load_support_info()
-    return info['text']
+    return _support_info.read(lambda info: info['text'])
 
-@bot.message_handler(func=lambda message: is_admin(message.from_user.id) and message.text == '📞 Edit Support')
+@router.text('📞 Edit Support', role=ADMIN)
 def edit_support(message):
     current_text = get_support_text()
     msg = bot.reply_to(
@@ -0,0 +1,78 @@
+"""
+CLI calls for the asyncio engine.
+
+Same commands, timeouts, output format and write notifications as
+run_cli_command, but awaited instead of holding a thread: the request goes
+to the warm worker pool over its unix socket, or, when the pool is down,
+to a child started with asyncio.create_subprocess_exec.
+"""
+import asyncio
+import json
+import shlex
+from utils.cli_worker import WorkerUnavailable
+from utils.command import (
+    CLI_WORKERS, CLI_WORKER_SOCKET, CLI_MAX_CONCURRENCY, _cli_timeout, _is_cli, _notify_if_write, _format_response
+)
+
+_slots = None
+
+
+def _cli_slots():
+    # Created lazily so it belongs to the running loop
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(CLI_MAX_CONCURRENCY)
+    return _slots
+
+
+async def _call_worker(args, timeout):
+    try:
+        reader, writer = await asyncio.open_unix_connection(CLI_WORKER_SOCKET, limit=16 * 1024 * 1024)
+    except OSError as e:
+        raise WorkerUnavailable(str(e)) from e
+    try:
+        writer.write(json.dumps({'args': args, 'timeout': timeout}).encode('utf-8') + b'\n')
+        await writer.drain()
+        line = await asyncio.wait_for(reader.readline(), timeout + 5)
+    finally:
+        writer.close()
+    if not line:
+        raise ConnectionError("CLI worker closed the connection")
+    return json.loads(line)
+
+
+async def _spawn_cli(args, timeout):
+    if CLI_WORKERS > 0 and _is_cli(args):
+        try:
+            return _format_response(await _call_worker(args[2:], timeout), timeout)
+        except WorkerUnavailable:
+            pass  # Pool is down, spawn the CLI directly below
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            # The worker may already have run it; spawning it again could apply a write twice
+            return f'Error: CLI worker failed: {str(e) or type(e).__name__}'
+
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return f'Error: Command timed out after {timeout} seconds'
+    if process.returncode != 0:
+        return f'Error: {output.decode("utf-8")}'
+    return output.decode('utf-8').strip()
+
+
+async def run_cli_command_async(command, timeout=None):
+    """Awaitable run_cli_command"""
+    args = shlex.split(command)
+    timeout = timeout or _cli_timeout(args)
+    async with _cli_slots():
+        output = None
+        try:
+            output = await _spawn_cli(args, timeout)
+            return output
+        finally:
+            _notify_if_write(args, output)
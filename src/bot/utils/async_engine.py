@@ -0,0 +1,389 @@
+"""
+asyncio runtime built on AsyncTeleBot (BOT_ENGINE=async).
+
+Client traffic (the start and language screens, the menu buttons, configs,
+purchases and payment polling) runs as coroutines on one event loop. CLI
+calls go through async_cli, Cryptomus through aiohttp, and each open invoice
+is a task rather than a scheduler thread, so a waiting client costs a few
+objects instead of a thread.
+
+The admin screens are conversations built on register_next_step_handler,
+which AsyncTeleBot has no equivalent for. Updates that no coroutine claims
+(admin messages, admin callbacks, inline search) are handed to the
+synchronous bot on BOT_WORKERS threads, one update per chat at a time, so
+those handlers and their next-step chains behave exactly as in the
+threaded engine.
+"""
+import asyncio
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from utils.command import bot, is_admin, outbound_limiter, API_TOKEN, BOT_WORKERS
+from utils.outbound import AsyncRateLimitedBot
+from utils.common import create_main_markup, create_purchase_markup, create_downloads_markup
+from utils.async_cli import run_cli_command_async
+from utils.async_payments import AsyncCryptomusPayment
+from utils.payments import PAYMENT_LIFETIME
+from utils.payment_scheduler import (
+    PAYMENT_POLL_CONCURRENCY, PAYMENT_POLL_INTERVAL, PAYMENT_POLL_BACKOFF, PAYMENT_POLL_MAX_INTERVAL,
+    PAYMENT_POLL_MAX_ERRORS, PAYMENT_FALLBACK_POLL_INTERVAL, PAYMENT_SESSION_GRACE
+)
+from utils.payment_webhook import PAYMENT_WEBHOOK_URL
+from utils.payment_records import add_payment_record, update_payment_status
+from utils.admin_plans import load_plans
+from utils.test_mode import load_test_mode
+from utils.test_config import has_used_test_config, mark_test_config_used
+from utils.admin_support import get_support_text
+from utils.languages import LANGUAGES
+from utils.user_directory import get_users
+from utils.uris import get_user_uri_async
+from utils.qr import send_qr_photo_async, edit_qr_photo_async
+from utils.client import (
+    get_active_configs, format_config_page, clamp_page, handle_payment_status, handle_payment_expired, set_payment_poller,
+    new_config_username, add_user_command, format_new_config, test_payment_record, format_test_purchase,
+    payment_error_text, pending_payment_record, format_invoice, TEST_CONFIG_GB, TEST_CONFIG_DAYS,
+    TEST_CONFIG_USED_TEXT, CONFIG_ERROR_TEXT, CONFIGS_ERROR_TEXT, NO_CONFIGS_TEXT, NO_CONFIGS_SHORT_TEXT,
+    INVALID_PLAN_TEXT, PURCHASE_TEXT, DOWNLOADS_TEXT
+)
+from utils.client_welcome import MENU_DISPATCH, start_screen, select_language, menu_action
+
+async_bot = AsyncRateLimitedBot(AsyncTeleBot(API_TOKEN), outbound_limiter)
+cryptomus = AsyncCryptomusPayment()
+_sync_pool = ThreadPoolExecutor(BOT_WORKERS, thread_name_prefix='sync-handler')
+_chat_locks = weakref.WeakValueDictionary()  # chat id -> asyncio.Lock, dropped once unused
+_poll_slots = None
+
+
+def _is_client(message):
+    return not is_admin(message.from_user.id)
+
+
+async def handle_start(message):
+    text, markup = start_screen(message.from_user.id)
+    await async_bot.reply_to(message, text, reply_markup=markup)
+
+
+async def handle_language_selection(message):
+    confirmation, markup, welcome = select_language(message.from_user.id, LANGUAGES[message.text])
+    await async_bot.reply_to(message, confirmation, reply_markup=markup)
+    await async_bot.send_message(message.chat.id, welcome)
+
+
+async def handle_test_config(message):
+    if await asyncio.to_thread(has_used_test_config, message.from_user.id):
+        await async_bot.reply_to(message, TEST_CONFIG_USED_TEXT, reply_markup=create_main_markup(is_admin=False))
+        return
+
+    username = new_config_username(message.from_user.id)
+    await run_cli_command_async(add_user_command(username, TEST_CONFIG_GB, TEST_CONFIG_DAYS))
+
+    config_v4 = (await get_user_uri_async(username))['uri']
+    if not config_v4:
+        await async_bot.reply_to(message, CONFIG_ERROR_TEXT)
+        return
+
+    await asyncio.to_thread(mark_test_config_used, message.from_user.id)
+    await send_qr_photo_async(
+        async_bot, message.chat.id, config_v4, owner=username,
+        caption=format_new_config(username, TEST_CONFIG_GB, TEST_CONFIG_DAYS, config_v4),
+        parse_mode="Markdown", reply_markup=create_main_markup(is_admin=False)
+    )
+
+
+async def _config_page(telegram_id, page):
+    """(username, uri, caption, markup) of the My Configs carousel; uri is None without configs, '' when it failed"""
+    usernames = await asyncio.to_thread(get_active_configs, telegram_id)
+    if not usernames:
+        return None, None, None, None
+    page = clamp_page(usernames, page)
+    config_v4 = (await get_user_uri_async(usernames[page]))['uri']
+    if not config_v4:
+        return usernames[page], '', None, None
+    users = await asyncio.to_thread(get_users)
+    caption, markup = format_config_page(usernames, users, page, config_v4)
+    return usernames[page], config_v4, caption, markup
+
+
+async def show_my_configs(message):
+    username, config_v4, caption, markup = await _config_page(message.from_user.id, 0)
+    if config_v4 is None:
+        await async_bot.reply_to(message, NO_CONFIGS_TEXT)
+        return
+    if not config_v4:
+        await async_bot.reply_to(message, CONFIG_ERROR_TEXT)
+        return
+    await send_qr_photo_async(
+        async_bot, message.chat.id, config_v4, owner=username,
+        caption=caption, parse_mode="Markdown", reply_markup=markup
+    )
+
+
+async def handle_my_configs_page(call):
+    try:
+        username, config_v4, caption, markup = await _config_page(call.from_user.id, int(call.data.split(':')[1]))
+    except ValueError:
+        await async_bot.answer_callback_query(call.id, CONFIGS_ERROR_TEXT)
+        return
+    if config_v4 is None:
+        await async_bot.answer_callback_query(call.id, NO_CONFIGS_SHORT_TEXT)
+        return
+    if not config_v4:
+        await async_bot.answer_callback_query(call.id, CONFIG_ERROR_TEXT)
+        return
+
+    try:
+        await edit_qr_photo_async(
+            async_bot, call.message.chat.id, call.message.message_id, config_v4,
+            caption=caption, parse_mode="Markdown", reply_markup=markup, owner=username
+        )
+    except ApiTelegramException as e:
+        # Double taps land on the page already shown
+        if 'not modified' not in e.description:
+            raise
+    await async_bot.answer_callback_query(call.id)
+
+
+async def show_purchase_options(message):
+    await async_bot.reply_to(message, PURCHASE_TEXT, reply_markup=create_purchase_markup())
+
+
+async def show_downloads(message):
+    await async_bot.reply_to(message, DOWNLOADS_TEXT, reply_markup=create_downloads_markup())
+
+
+async def show_support(message):
+    await async_bot.reply_to(message, get_support_text())
+
+
+MENU_ACTIONS = {
+    'my_configs': show_my_configs,
+    'purchase_plan': show_purchase_options,
+    'downloads': show_downloads,
+    'support': show_support,
+    'test_config': handle_test_config
+}
+
+
+async def handle_client_menu(message):
+    await MENU_ACTIONS[menu_action(message)](message)
+
+
+def _payment_poll_slots():
+    # Created lazily so it belongs to the running loop
+    global _poll_slots
+    if _poll_slots is None:
+        _poll_slots = asyncio.Semaphore(PAYMENT_POLL_CONCURRENCY)
+    return _poll_slots
+
+
+async def poll_payment(payment_id, chat_id, plan_gb, lifetime=PAYMENT_LIFETIME):
+    """
+    Check an invoice with a growing interval until it settles or its lifetime passes.
+
+    Returns False when it stopped after PAYMENT_POLL_MAX_ERRORS errors.
+    """
+    session = {'chat_id': chat_id, 'plan_gb': plan_gb}
+    if PAYMENT_WEBHOOK_URL:
+        interval = max_interval = PAYMENT_FALLBACK_POLL_INTERVAL
+    else:
+        interval, max_interval = PAYMENT_POLL_INTERVAL, PAYMENT_POLL_MAX_INTERVAL
+    expires_at = time.monotonic() + lifetime
+    errors = 0
+
+    while True:
+        await asyncio.sleep(max(0.0, min(interval, expires_at - time.monotonic())))
+        try:
+            async with _payment_poll_slots():
+                status = await cryptomus.check_payment_status(payment_id)
+            # Settling a payment creates the config through the synchronous helpers
+            if await asyncio.to_thread(handle_payment_status, payment_id, session, status):
+                return True
+        except Exception as e:
+            print(f"Error polling payment {payment_id}: {str(e)}")
+            errors += 1
+            if errors >= PAYMENT_POLL_MAX_ERRORS or time.monotonic() >= expires_at:
+                # Same as PaymentScheduler: reconciliation settles or expires it
+                print(f"Stopped polling payment {payment_id} after {errors} errors")
+                return False
+            interval = min(interval * PAYMENT_POLL_BACKOFF, max_interval)
+            continue
+        if time.monotonic() >= expires_at:
+            await asyncio.to_thread(handle_payment_expired, payment_id, session)
+            return True
+        interval = min(interval * PAYMENT_POLL_BACKOFF, max_interval)
+
+
+class AsyncPaymentPoller:
+    """
+    PaymentScheduler's add, cancel and is_polling over one task per invoice.
+
+    The webhook and the reconciler call it from their own threads, so work
+    is handed to the event loop; invoices added before the loop runs are
+    started once it does.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._queued = []
+        self._tasks = {}  # payment_id -> task; also keeps the tasks alive, the loop only holds weak references
+        self._stopped = {}  # payment_id -> monotonic time until which it counts as polled, after too many errors
+
+    def bind(self, loop):
+        with self._lock:
+            self._loop = loop
+            queued, self._queued = self._queued, []
+        for args in queued:
+            loop.call_soon_threadsafe(self.start, *args)
+
+    def add(self, payment_id, chat_id, plan_gb, lifetime=None):
+        args = (payment_id, chat_id, plan_gb, PAYMENT_LIFETIME if lifetime is None else lifetime)
+        with self._lock:
+            if self._loop is None:
+                self._queued.append(args)
+                return
+        self._loop.call_soon_threadsafe(self.start, *args)
+
+    def start(self, payment_id, chat_id, plan_gb, lifetime=PAYMENT_LIFETIME):
+        """Start polling on the running loop"""
+        if payment_id in self._tasks:
+            return
+        self._stopped.pop(payment_id, None)
+        task = asyncio.create_task(self._poll(payment_id, chat_id, plan_gb, lifetime))
+        self._tasks[payment_id] = task
+
+    async def _poll(self, payment_id, chat_id, plan_gb, lifetime):
+        stopped_until = time.monotonic() + lifetime + PAYMENT_SESSION_GRACE
+        try:
+            if not await poll_payment(payment_id, chat_id, plan_gb, lifetime):
+                # Keep reporting it as polled so reconciliation settles it instead of restarting the loop
+                self._stopped[payment_id] = stopped_until
+        finally:
+            self._tasks.pop(payment_id, None)
+
+    def cancel(self, payment_id):
+        self._stopped.pop(payment_id, None)
+        task = self._tasks.get(payment_id)
+        if task is not None and self._loop is not None:
+            self._loop.call_soon_threadsafe(task.cancel)
+
+    def is_polling(self, payment_id):
+        if payment_id in self._tasks:
+            return True
+        stopped_until = self._stopped.get(payment_id)
+        if stopped_until is not None and stopped_until <= time.monotonic():
+            self._stopped.pop(payment_id, None)
+            return False
+        return stopped_until is not None
+
+
+payment_poller = AsyncPaymentPoller()
+set_payment_poller(payment_poller)
+
+
+async def handle_purchase(call):
+    plan_gb = int(call.data.split(':')[1])
+    plans = await asyncio.to_thread(load_plans)
+    if str(plan_gb) not in plans:
+        await async_bot.answer_callback_query(call.id, INVALID_PLAN_TEXT)
+        return
+
+    chat_id = call.message.chat.id
+    amount = plans[str(plan_gb)]['price']
+
+    if await asyncio.to_thread(load_test_mode):
+        payment_id, payment_record = test_payment_record(chat_id, plan_gb, amount)
+        await asyncio.to_thread(add_payment_record, payment_id, payment_record)
+
+        plan_days = plans[str(plan_gb)]['days']
+        username = new_config_username(chat_id)
+        result = await run_cli_command_async(add_user_command(username, plan_gb, plan_days))
+        await asyncio.to_thread(update_payment_status, payment_id, 'completed')
+
+        await async_bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=call.message.message_id,
+            text=format_test_purchase(username, plan_gb, plan_days, result)
+        )
+        return
+
+    payment = await cryptomus.create_payment(amount, plan_gb)
+    error_text = payment_error_text(payment)
+    if error_text:
+        await async_bot.reply_to(call.message, error_text, reply_markup=create_main_markup(is_admin=False))
+        return
+
+    payment_id = payment['result']['uuid']
+    payment_url = payment['result']['url']
+    await asyncio.to_thread(add_payment_record, payment_id, pending_payment_record(chat_id, plan_gb, amount, payment_url))
+    payment_poller.start(payment_id, chat_id, plan_gb)
+
+    text, markup = format_invoice(plan_gb, amount, payment_id, payment_url)
+    await async_bot.edit_message_text(
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        text=text,
+        reply_markup=markup
+    )
+
+
+async def _run_sync(chat_id, process, update):
+    """Hand an update to the synchronous bot, keeping each chat's updates in order"""
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = _chat_locks[chat_id] = asyncio.Lock()
+    async with lock:
+        try:
+            await asyncio.get_running_loop().run_in_executor(_sync_pool, process, [update])
+        except Exception as e:
+            print(f"Error in synchronous handler: {str(e)}")
+
+
+async def forward_message(message):
+    await _run_sync(message.chat.id, bot.process_new_messages, message)
+
+
+async def forward_callback_query(call):
+    chat_id = call.message.chat.id if call.message is not None else call.from_user.id
+    await _run_sync(chat_id, bot.process_new_callback_query, call)
+
+
+async def forward_inline_query(query):
+    await _run_sync(query.from_user.id, bot.process_new_inline_query, query)
+
+
+def register_async_handlers():
+    """Client handlers first; AsyncTeleBot runs the first handler that matches"""
+    async_bot.register_message_handler(handle_start, commands=['start'], func=_is_client)
+    async_bot.register_message_handler(
+        handle_language_selection, func=lambda message: message.text in LANGUAGES and _is_client(message)
+    )
+    async_bot.register_message_handler(
+        handle_client_menu, func=lambda message: message.text in MENU_DISPATCH and _is_client(message)
+    )
+    async_bot.register_callback_query_handler(handle_my_configs_page, func=lambda call: call.data.startswith('myconfigs:'))
+    async_bot.register_callback_query_handler(handle_purchase, func=lambda call: call.data.startswith('purchase:'))
+
+    async_bot.register_message_handler(forward_message, func=lambda message: True)
+    async_bot.register_callback_query_handler(forward_callback_query, func=lambda call: True)
+    async_bot.register_inline_handler(forward_inline_query, func=lambda query: True)
+
+
+register_async_handlers()
+
+
+async def serve():
+    payment_poller.bind(asyncio.get_running_loop())
+    await async_bot.remove_webhook()
+    try:
+        await async_bot.infinity_polling()
+    finally:
+        await cryptomus.close()
+
+
+def run_async():
+    """Poll for updates on the event loop until stopped"""
+    asyncio.run(serve())
@@ -0,0 +1,55 @@
+"""
+Cryptomus client for the asyncio engine.
+
+Same requests and signatures as CryptomusPayment, sent through one pooled
+aiohttp session. The body is serialized here and signed from the same
+string, so the signature matches what the server receives.
+"""
+import json
+import aiohttp
+from utils.payments import CryptomusPayment
+
+CRYPTOMUS_TIMEOUT = 30
+
+
+class AsyncCryptomusPayment(CryptomusPayment):
+    def __init__(self):
+        super().__init__()
+        self._session = None
+
+    def _get_session(self):
+        # Created on first use so it belongs to the running loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=CRYPTOMUS_TIMEOUT))
+        return self._session
+
+    async def _post(self, endpoint, payload):
+        body = json.dumps(payload)
+        headers = {
+            "merchant": self.merchant_id,
+            "sign": self._sign_text(body),
+            "Content-Type": "application/json"
+        }
+        try:
+            async with self._get_session().post(f"{self.base_url}{endpoint}", data=body, headers=headers) as response:
+                text = await response.text()
+                if response.status == 200:
+                    return json.loads(text)
+                return {"error": f"API Error: {text}"}
+        except Exception as e:
+            return {"error": f"Request Error: {str(e)}"}
+
+    async def create_payment(self, amount, plan_gb):
+        if not self._check_credentials():
+            return {"error": "Payment credentials not configured"}
+        return await self._post("/payment", self._invoice_payload(amount, plan_gb))
+
+    async def check_payment_status(self, payment_id):
+        if not self._check_credentials():
+            return {"error": "Payment credentials not configured"}
+        return await self._post("/payment/info", {"uuid": payment_id})
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
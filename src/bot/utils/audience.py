@@ -0,0 +1,87 @@
+"""
+Broadcast audiences kept as precomputed sets of Telegram IDs.
+
+"all" is everyone who owns a config or has picked a language in the bot,
+"active" owns at least one config that is not blocked, and "expired" at
+least one that is. The user directory reports each owner's configs when
+its index is rebuilt and after every bot-made change, and the language
+store reports new bot users, so only the IDs involved are re-evaluated.
+Fetching a segment returns a frozen snapshot that is rebuilt only after
+the segment changed.
+"""
+import threading
+
+SEGMENTS = ('all', 'active', 'expired')
+
+
+def _owner_segments(configs):
+    segments = set()
+    for status in configs.values():
+        segments.add('all')
+        segments.add('expired' if status['blocked'] else 'active')
+    return segments
+
+
+class AudienceSegments:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owners = {}  # telegram_id -> segments its configs put it in
+        self._bot_users = set()
+        self._members = {segment: set() for segment in SEGMENTS}
+        self._snapshots = {}  # segment -> frozenset, dropped when the segment changes
+
+    def _place(self, telegram_id):
+        # Called with the lock held; moves one ID into the segments it belongs to now
+        segments = set(self._owners.get(telegram_id, ()))
+        if telegram_id in self._bot_users:
+            segments.add('all')
+        for segment, members in self._members.items():
+            if (segment in segments) != (telegram_id in members):
+                if segment in segments:
+                    members.add(telegram_id)
+                else:
+                    members.discard(telegram_id)
+                self._snapshots.pop(segment, None)
+
+    def load_owners(self, index):
+        """Replace every owner from a {telegram_id: {username: {'blocked': bool}}} index"""
+        with self._lock:
+            previous = self._owners
+            self._owners = {telegram_id: _owner_segments(configs) for telegram_id, configs in index.items()}
+            for telegram_id in previous.keys() | self._owners.keys():
+                if previous.get(telegram_id) != self._owners.get(telegram_id):
+                    self._place(telegram_id)
+
+    def update_owner(self, telegram_id, configs):
+        """Re-evaluate one owner after its configs changed; empty configs removes it"""
+        telegram_id = str(telegram_id)
+        with self._lock:
+            segments = _owner_segments(configs or {})
+            if segments:
+                self._owners[telegram_id] = segments
+            else:
+                self._owners.pop(telegram_id, None)
+            self._place(telegram_id)
+
+    def add_bot_users(self, telegram_ids):
+        with self._lock:
+            for telegram_id in telegram_ids:
+                telegram_id = str(telegram_id)
+                if telegram_id not in self._bot_users:
+                    self._bot_users.add(telegram_id)
+                    self._place(telegram_id)
+
+    def members(self, segment):
+        """frozenset of the Telegram IDs (as strings) in a segment"""
+        with self._lock:
+            snapshot = self._snapshots.get(segment)
+            if snapshot is None:
+                snapshot = self._snapshots[segment] = frozenset(self._members[segment])
+            return snapshot
+
+    def sizes(self):
+        with self._lock:
+            return {segment: len(members) for segment, members in self._members.items()}
+
+
+audience_segments = AudienceSegments()
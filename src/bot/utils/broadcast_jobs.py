@@ -0,0 +1,339 @@
+"""
+Background broadcast jobs.
+
+A broadcast is a job in an SQLite database: the admin's source message, the
+deduplicated recipient list and each recipient's result. Recipients are
+sent in position order by a small pool of threads, paced by the outbound
+limiter. Results are committed in batches and the job's cursor advances
+with them, so after a restart a running job carries on from where it was
+stopped instead of starting over.
+
+Messages are sent with copy_message, so a photo or document is uploaded
+once by the admin and reused for every recipient. Progress is shown by
+editing one status message at most every BROADCAST_STATUS_INTERVAL
+seconds; its buttons pause, resume and cancel the job.
+"""
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+
+BROADCASTS_DB = '/etc/hysteria/core/scripts/telegrambot/broadcasts.db'
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '8'))
+BROADCAST_STATUS_INTERVAL = float(os.getenv('BROADCAST_STATUS_INTERVAL', '5'))
+BROADCAST_BATCH = 200
+
+RUNNING = 'running'
+PAUSED = 'paused'
+CANCELLED = 'cancelled'
+DONE = 'done'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcast_jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    target TEXT,
+    admin_chat_id INTEGER NOT NULL,
+    status_message_id INTEGER,
+    from_chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    cursor INTEGER NOT NULL DEFAULT -1,
+    created_at TEXT,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS broadcast_jobs_state ON broadcast_jobs (state);
+CREATE TABLE IF NOT EXISTS broadcast_recipients (
+    job_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    error TEXT,
+    PRIMARY KEY (job_id, position),
+    UNIQUE (job_id, chat_id)
+);
+"""
+
+_lock = threading.RLock()
+_conn = None
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _db():
+    global _conn
+    with _lock:
+        if _conn is None:
+            os.makedirs(os.path.dirname(BROADCASTS_DB), exist_ok=True)
+            conn = sqlite3.connect(BROADCASTS_DB, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            _conn = conn
+        return _conn
+
+
+@contextmanager
+def _transaction(conn, mode=''):
+    conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def create_job(target, admin_chat_id, from_chat_id, message_id, recipients):
+    """Store a new running job and return its id; recipients are deduplicated keeping their order"""
+    recipients = list(dict.fromkeys(int(chat_id) for chat_id in recipients))
+    now = _now()
+    with _lock, _transaction(_db(), 'IMMEDIATE') as conn:
+        job_id = conn.execute(
+            "INSERT INTO broadcast_jobs (target, admin_chat_id, from_chat_id, message_id, state, total, "
+            "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (target, admin_chat_id, from_chat_id, message_id, RUNNING, len(recipients), now, now)
+        ).lastrowid
+        conn.executemany(
+            "INSERT INTO broadcast_recipients (job_id, position, chat_id) VALUES (?, ?, ?)",
+            [(job_id, position, chat_id) for position, chat_id in enumerate(recipients)]
+        )
+    return job_id
+
+
+def get_job(job_id):
+    with _lock:
+        row = _db().execute("SELECT * FROM broadcast_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+
+def get_unfinished_jobs():
+    with _lock:
+        rows = _db().execute(
+            "SELECT * FROM broadcast_jobs WHERE state IN (?, ?) ORDER BY job_id", (RUNNING, PAUSED)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def set_job_state(job_id, state, expected=None):
+    """Change a job's state, optionally only from one of the expected states; True when changed"""
+    with _lock, _transaction(_db(), 'IMMEDIATE') as conn:
+        row = conn.execute("SELECT state FROM broadcast_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or (expected is not None and row['state'] not in expected):
+            return False
+        conn.execute(
+            "UPDATE broadcast_jobs SET state = ?, updated_at = ? WHERE job_id = ?", (state, _now(), job_id)
+        )
+        return True
+
+
+def set_status_message(job_id, message_id):
+    with _lock:
+        _db().execute("UPDATE broadcast_jobs SET status_message_id = ? WHERE job_id = ?", (message_id, job_id))
+
+
+def next_recipients(job_id, cursor, limit=BROADCAST_BATCH):
+    """[(position, chat_id)] still to be sent after the cursor position"""
+    with _lock:
+        return [
+            (row['position'], row['chat_id'])
+            for row in _db().execute(
+                "SELECT position, chat_id FROM broadcast_recipients WHERE job_id = ? AND position > ? "
+                "AND status = 'pending' ORDER BY position LIMIT ?",
+                (job_id, cursor, limit)
+            )
+        ]
+
+
+def record_results(job_id, results, cursor):
+    """Store [(position, error or None)] for sent recipients and move the cursor in one transaction"""
+    sent = sum(1 for _, error in results if error is None)
+    with _lock, _transaction(_db(), 'IMMEDIATE') as conn:
+        conn.executemany(
+            "UPDATE broadcast_recipients SET status = ?, error = ? WHERE job_id = ? AND position = ?",
+            [('sent' if error is None else 'failed', error, job_id, position) for position, error in results]
+        )
+        conn.execute(
+            "UPDATE broadcast_jobs SET sent = sent + ?, failed = failed + ?, cursor = MAX(cursor, ?), "
+            "updated_at = ? WHERE job_id = ?",
+            (sent, len(results) - sent, cursor, _now(), job_id)
+        )
+
+
+class BroadcastManager:
+    def __init__(self, bot, concurrency=BROADCAST_CONCURRENCY, status_interval=BROADCAST_STATUS_INTERVAL):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.status_interval = status_interval
+        self._lock = threading.Lock()
+        self._workers = {}  # job_id -> thread
+
+    def start(self, target, admin_chat_id, source_message, recipients):
+        """Create a job copying source_message to recipients, show its status message and run it"""
+        job_id = create_job(target, admin_chat_id, source_message.chat.id, source_message.message_id, recipients)
+        self.show_status(job_id)
+        self._spawn(job_id)
+        return job_id
+
+    def resume_unfinished(self):
+        """Restart the running jobs a previous process was stopped in"""
+        for job in get_unfinished_jobs():
+            if job['state'] == RUNNING:
+                self._spawn(job['job_id'])
+
+    def pause(self, job_id):
+        return set_job_state(job_id, PAUSED, expected=(RUNNING,))
+
+    def resume(self, job_id):
+        if not set_job_state(job_id, RUNNING, expected=(PAUSED,)):
+            return False
+        self._spawn(job_id)
+        return True
+
+    def cancel(self, job_id):
+        return set_job_state(job_id, CANCELLED, expected=(RUNNING, PAUSED))
+
+    def _spawn(self, job_id):
+        with self._lock:
+            if job_id in self._workers:
+                return  # Resumed before its worker noticed the pause; the worker checks again on exit
+            worker = threading.Thread(target=self._run, args=(job_id,), name=f'broadcast-{job_id}', daemon=True)
+            self._workers[job_id] = worker
+            worker.start()
+
+    def _run(self, job_id):
+        failed = paused = False
+        try:
+            self._send_job(job_id)
+        except Exception as e:
+            failed = True
+            print(f"Error running broadcast {job_id}: {str(e)}")
+            # Respawning would hit a persistent error again in a tight loop, so
+            # pause instead and let the admin resume from the status message
+            try:
+                paused = set_job_state(job_id, PAUSED, expected=(RUNNING,))
+                if paused:
+                    self.show_status(job_id)
+            except Exception as e:
+                print(f"Error pausing broadcast {job_id}: {str(e)}")
+        with self._lock:
+            del self._workers[job_id]
+            try:
+                # Still running after a clean exit, or resumed since the failure paused it
+                resumed = get_job(job_id)['state'] == RUNNING and (not failed or paused)
+            except Exception as e:
+                print(f"Error reading broadcast {job_id}: {str(e)}")
+                resumed = False
+        if resumed:
+            self._spawn(job_id)
+
+    def _send(self, job, chat_id):
+        """None when delivered, otherwise why it was not"""
+        try:
+            self.bot.copy_message(chat_id, job['from_chat_id'], job['message_id'])
+            return None
+        except ApiTelegramException as e:
+            return e.description
+        except Exception as e:
+            return str(e)
+
+    def _send_job(self, job_id):
+        job = get_job(job_id)
+        cursor = job['cursor']
+        last_status = time.monotonic()
+        started, sent_at_start = time.monotonic(), job['sent'] + job['failed']
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix=f'broadcast-{job_id}') as pool:
+            while True:
+                job = get_job(job_id)
+                if job['state'] != RUNNING:
+                    break
+                batch = next_recipients(job_id, cursor)
+                if not batch:
+                    set_job_state(job_id, DONE, expected=(RUNNING,))
+                    break
+                # Send the batch in chunks so a pause or cancel takes effect within a few seconds
+                for offset in range(0, len(batch), self.concurrency * 4):
+                    chunk = batch[offset:offset + self.concurrency * 4]
+                    errors = pool.map(lambda recipient: self._send(job, recipient[1]), chunk)
+                    results = [(position, error) for (position, _), error in zip(chunk, errors)]
+                    cursor = chunk[-1][0]
+                    record_results(job_id, results, cursor)
+                    if time.monotonic() - last_status >= self.status_interval:
+                        last_status = time.monotonic()
+                        self.show_status(job_id, rate=self._rate(job_id, started, sent_at_start))
+                    if get_job(job_id)['state'] != RUNNING:
+                        break
+        self.show_status(job_id)
+        if get_job(job_id)['state'] in (DONE, CANCELLED):
+            self._report(job_id)
+
+    def _rate(self, job_id, started, done_at_start):
+        job = get_job(job_id)
+        elapsed = time.monotonic() - started
+        return (job['sent'] + job['failed'] - done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def status_text(self, job, rate=None):
+        done = job['sent'] + job['failed']
+        text = (
+            f"📢 Broadcast #{job['job_id']} ({job['target']})\n"
+            f"State: {job['state']}\n"
+            f"Progress: {done}/{job['total']}\n"
+            f"✅ Successful: {job['sent']}\n"
+            f"❌ Failed: {job['failed']}"
+        )
+        if rate:
+            text += f"\n⚡️ {rate:.1f} messages/s"
+        return text
+
+    def status_markup(self, job):
+        """Pause or resume and cancel buttons; None once the job has finished"""
+        if job['state'] not in (RUNNING, PAUSED):
+            return None
+        if job['state'] == RUNNING:
+            toggle = types.InlineKeyboardButton("⏸ Pause", callback_data=f"broadcast:pause:{job['job_id']}")
+        else:
+            toggle = types.InlineKeyboardButton("▶️ Resume", callback_data=f"broadcast:resume:{job['job_id']}")
+        markup = types.InlineKeyboardMarkup()
+        markup.row(toggle, types.InlineKeyboardButton("✖️ Cancel", callback_data=f"broadcast:cancel:{job['job_id']}"))
+        return markup
+
+    def show_status(self, job_id, rate=None, new_message=False):
+        """Edit the job's status message, or send one when there is none yet or new_message is set"""
+        job = get_job(job_id)
+        text, markup = self.status_text(job, rate), self.status_markup(job)
+        try:
+            if job['status_message_id'] and not new_message:
+                self.bot.edit_message_text(
+                    text, chat_id=job['admin_chat_id'], message_id=job['status_message_id'], reply_markup=markup
+                )
+            else:
+                message = self.bot.send_message(job['admin_chat_id'], text, reply_markup=markup)
+                set_status_message(job_id, message.message_id)
+        except ApiTelegramException as e:
+            if 'not modified' not in e.description:
+                print(f"Error updating broadcast {job_id} status: {str(e)}")
+
+    def _report(self, job_id):
+        job = get_job(job_id)
+        title = "📢 Broadcast Completed" if job['state'] == DONE else "📢 Broadcast Cancelled"
+        try:
+            self.bot.send_message(
+                job['admin_chat_id'],
+                f"{title}\n\n"
+                f"Target: {job['target']}\n"
+                f"Total Users: {job['total']}\n"
+                f"✅ Successful: {job['sent']}\n"
+                f"❌ Failed: {job['failed']}"
+            )
+        except Exception as e:
+            print(f"Error sending broadcast {job_id} report: {str(e)}")
@@ -0,0 +1,249 @@
+"""
+Bulk user import from a CSV file.
+
+The admin uploads a CSV with username, traffic_limit and expiration_days
+columns (password optional). Valid rows are added through the VPN API with
+bounded concurrency in a background thread. The admin then gets a results
+CSV with one line per input row, a zip of subscription QR codes for the
+users that were added, and the import's throughput.
+"""
+import csv
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from telebot import types
+from utils.command import *
+from utils.common import create_main_markup
+from utils.adduser import create_cancel_markup, subscription_url, SUB_URL
+from src.api.api_add_user import get_vpn_api_client
+from src.models.user import VpnUser
+from utils.qr_render import qr_render_service
+
+BULK_ADD_CONCURRENCY = int(os.getenv('BULK_ADD_CONCURRENCY', '8'))
+BULK_ADD_MAX_ROWS = int(os.getenv('BULK_ADD_MAX_ROWS', '5000'))
+BULK_ADD_MAX_FILE_SIZE = 5 * 1024 * 1024
+CSV_COLUMNS = ['username', 'traffic_limit', 'expiration_days', 'password']
+RESULT_COLUMNS = ['row', 'username', 'traffic_limit', 'expiration_days', 'status', 'detail', 'subscription_url']
+USERNAME_PATTERN = re.compile(r'^[a-z0-9_.-]+$')
+QR_ZIP_WORKERS = 4
+# Results that could not be sent to the admin are kept here
+IMPORT_RESULTS_DIR = '/etc/hysteria/core/scripts/telegrambot/imports'
+
+
+def parse_import_csv(text):
+    """
+    Return (rows, rejected) for the text of an import file.
+
+    rows are dicts with row, username, traffic_limit, expiration_days and
+    password; rejected are result dicts for the lines that cannot be
+    imported. The header line is optional.
+    """
+    sample = next(csv.reader(io.StringIO(text)), [])
+    has_header = 'username' in [column.strip().lower() for column in sample]
+    reader = csv.DictReader(io.StringIO(text), fieldnames=None if has_header else CSV_COLUMNS)
+    if has_header:
+        reader.fieldnames = [column.strip().lower() for column in reader.fieldnames]
+
+    rows, rejected, seen = [], [], set()
+    for number, line in enumerate(reader, start=2 if has_header else 1):
+        username = (line.get('username') or '').strip().lower()
+        row = {'row': number, 'username': username, 'traffic_limit': line.get('traffic_limit'),
+               'expiration_days': line.get('expiration_days'), 'password': (line.get('password') or '').strip() or None}
+        error = None
+        try:
+            row['traffic_limit'] = int(str(row['traffic_limit']).strip())
+            row['expiration_days'] = int(str(row['expiration_days']).strip())
+            if row['traffic_limit'] <= 0 or row['expiration_days'] <= 0:
+                error = "traffic_limit and expiration_days must be positive"
+        except ValueError:
+            error = "traffic_limit and expiration_days must be numbers"
+        if not USERNAME_PATTERN.match(username):
+            error = "invalid username"
+        elif username in seen:
+            error = "duplicate username in file"
+        seen.add(username)
+
+        if error:
+            rejected.append(dict(row, status='invalid', detail=error))
+        else:
+            rows.append(row)
+    return rows, rejected
+
+
+def _added_result(row):
+    notify_user_write([
+        'add-user', '-u', row['username'], '-t', str(row['traffic_limit']), '-e', str(row['expiration_days'])
+    ])
+    try:
+        return dict(row, status='added', detail='', subscription_url=subscription_url(row['username']))
+    except Exception as e:
+        return dict(row, status='added', detail=f"no subscription link: {str(e)}", subscription_url='')
+
+
+def import_users(rows, concurrency=BULK_ADD_CONCURRENCY):
+    """
+    Add rows through the VPN API; returns (result dicts in row order, seconds taken).
+
+    Never raises once users are being created: every row gets a result, so
+    the admin always learns which accounts exist.
+    """
+    started = time.monotonic()
+    users = (VpnUser(row['username'], row['traffic_limit'], row['expiration_days'], row['password']) for row in rows)
+    results = []
+    try:
+        for row, result in zip(rows, get_vpn_api_client().iter_add_users(users, concurrency)):
+            if result['ok']:
+                results.append(_added_result(row))
+            else:
+                results.append(dict(row, status='failed', detail=result['error']))
+    except Exception as e:
+        print(f"Error importing users: {str(e)}")
+        # Rows in flight may or may not have been created
+        for row in rows[len(results):]:
+            results.append(dict(row, status='unknown', detail=f"import stopped: {str(e)}"))
+    return results, time.monotonic() - started
+
+
+def build_results_csv(results):
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=RESULT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    for result in sorted(results, key=lambda result: result['row']):
+        writer.writerow(result)
+    return output.getvalue().encode('utf-8')
+
+
+def build_qr_zip(results):
+    added = [result for result in results if result['status'] == 'added' and result.get('subscription_url')]
+    bio = io.BytesIO()
+    # PNGs are already compressed; the render pool draws several codes at once
+    with ThreadPoolExecutor(QR_ZIP_WORKERS) as pool, zipfile.ZipFile(bio, 'w', zipfile.ZIP_STORED) as archive:
+        for result, png in zip(added, pool.map(lambda r: qr_render_service.render(r['subscription_url']), added)):
+            archive.writestr(f"{result['username']}.png", png)
+    return bio.getvalue()
+
+
+def _named_file(data, name):
+    bio = io.BytesIO(data)
+    bio.name = name
+    return bio
+
+
+def _save_results(data):
+    """Keep a results CSV on disk; returns its path"""
+    os.makedirs(IMPORT_RESULTS_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_RESULTS_DIR, f"import_results_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv")
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def deliver_results(chat_id, results, summary):
+    """Send the results CSV, falling back to a file on the server when Telegram refuses it"""
+    data = build_results_csv(results)
+    try:
+        bot.send_document(
+            chat_id, _named_file(data, 'import_results.csv'),
+            caption=summary, reply_markup=create_main_markup(is_admin=True)
+        )
+        return
+    except Exception as e:
+        print(f"Error sending import results: {str(e)}")
+    try:
+        path = _save_results(data)
+    except Exception as e:
+        print(f"Error saving import results: {str(e)}")
+        path = None
+    try:
+        note = f"The results file is saved at {path}" if path else "The results file could not be saved either, see the log"
+        bot.send_message(chat_id, f"{summary}\n\n⚠️ Could not send the results file. {note}",
+                         reply_markup=create_main_markup(is_admin=True))
+    except Exception as e:
+        print(f"Error reporting import results: {str(e)}")
+    if path is None:
+        # Last resort: the log gets one line per row
+        print(data.decode('utf-8'))
+
+
+def run_import(chat_id, rows, rejected):
+    results, elapsed = import_users(rows) if rows else ([], 0.0)
+    counts = {status: sum(1 for result in results if result['status'] == status) for status in ('added', 'failed', 'unknown')}
+    rate = len(rows) / elapsed if elapsed > 0 else 0.0
+    summary = (
+        "📥 Import finished\n\n"
+        f"✅ Added: {counts['added']}\n"
+        f"❌ Failed: {counts['failed']}\n"
+        f"⚠️ Invalid rows: {len(rejected)}\n"
+    )
+    if counts['unknown']:
+        summary += f"❓ Unknown (import stopped early): {counts['unknown']}\n"
+    summary += f"⏱ {elapsed:.1f}s ({rate:.1f} users/s)"
+    deliver_results(chat_id, results + rejected, summary)
+    if not any(result.get('subscription_url') for result in results):
+        return
+    try:
+        bot.send_document(chat_id, _named_file(build_qr_zip(results), 'subscription_qr_codes.zip'))
+    except Exception as e:
+        # The results CSV already carries every subscription link
+        print(f"Error sending import QR codes: {str(e)}")
+
+
+@router.text('📥 Import Users', role=ADMIN)
+def start_import(message):
+    if not SUB_URL:
+        bot.reply_to(message, "SUB_URL is not set in .env, so subscription links cannot be made. Set it and try again.")
+        return
+    msg = bot.reply_to(
+        message,
+        "Send a CSV file with the columns:\n"
+        "`username,traffic_limit,expiration_days,password`\n\n"
+        "Traffic is in GB; password may be left empty to have one generated.",
+        parse_mode="Markdown",
+        reply_markup=create_cancel_markup()
+    )
+    bot.register_next_step_handler(msg, process_import_file)
+
+
+def process_import_file(message):
+    if message.text == "❌ Cancel":
+        bot.reply_to(message, "Process canceled.", reply_markup=create_main_markup(is_admin=True))
+        return
+    if message.content_type != 'document':
+        bot.reply_to(message, "Please send the users as a CSV file.", reply_markup=create_cancel_markup())
+        bot.register_next_step_handler(message, process_import_file)
+        return
+    if message.document.file_size and message.document.file_size > BULK_ADD_MAX_FILE_SIZE:
+        bot.reply_to(message, "The file is too large.", reply_markup=create_main_markup(is_admin=True))
+        return
+
+    try:
+        file_info = bot.get_file(message.document.file_id)
+        text = bot.download_file(file_info.file_path).decode('utf-8-sig')
+        rows, rejected = parse_import_csv(text)
+    except (UnicodeDecodeError, csv.Error) as e:
+        bot.reply_to(message, f"Could not read the CSV file: {str(e)}", reply_markup=create_main_markup(is_admin=True))
+        return
+
+    if len(rows) + len(rejected) > BULK_ADD_MAX_ROWS:
+        bot.reply_to(
+            message,
+            f"The file has more than {BULK_ADD_MAX_ROWS} rows, please split it.",
+            reply_markup=create_main_markup(is_admin=True)
+        )
+        return
+    if not rows and not rejected:
+        bot.reply_to(message, "The file has no users.", reply_markup=create_main_markup(is_admin=True))
+        return
+
+    bot.reply_to(
+        message,
+        f"Importing {len(rows)} users ({len(rejected)} invalid rows skipped)... "
+        "The results will be sent when it is done.",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+    threading.Thread(target=run_import, args=(message.chat.id, rows, rejected), name='user-import', daemon=True).start()
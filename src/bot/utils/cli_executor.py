@@ -0,0 +1,62 @@
+"""
+Bounded execution pool for CLI commands.
+
+Commands are queued onto a fixed number of threads so a burst of clicks
+cannot start an unbounded number of cli.py processes, and callers get a
+Future back so independent commands can overlap.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class CliExecutor:
+    def __init__(self, max_workers):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cli')
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+
+    def submit(self, func, *args):
+        """Queue func(*args) and return a Future; runs inline when called from a pool thread"""
+        if getattr(self._local, 'inside', False):
+            # A task submitting to its own bounded pool could deadlock, run it directly
+            future = Future()
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+
+        with self._lock:
+            self._queued += 1
+        future = self._pool.submit(self._run, func, args)
+        future.add_done_callback(self._forget_if_cancelled)
+        return future
+
+    def _run(self, func, args):
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        self._local.inside = True
+        try:
+            return func(*args)
+        finally:
+            self._local.inside = False
+            with self._lock:
+                self._running -= 1
+
+    def _forget_if_cancelled(self, future):
+        if future.cancelled():
+            with self._lock:
+                self._queued -= 1
+
+    def queue_depth(self):
+        """Number of commands waiting for a free slot"""
+        with self._lock:
+            return self._queued
+
+    def running(self):
+        """Number of commands currently executing"""
+        with self._lock:
+            return self._running
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Warm worker pool for the Hysteria CLI.
+
+The server preloads cli.py once and then forks a short-lived child per
+request, so every command runs against already-imported modules instead of
+paying a fresh interpreter start. Requests and responses are single JSON
+lines exchanged over a local unix socket.
+"""
+import argparse
+import atexit
+import json
+import os
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+BATCH_PARALLELISM = 8
+
+
+class WorkerUnavailable(ConnectionError):
+    """The pool's socket could not be reached, so nothing was sent to it"""
+
+
+def _preload(cli_path):
+    """Import cli.py and its dependencies without running the CLI"""
+    sys.path.insert(0, os.path.dirname(cli_path))
+    try:
+        runpy.run_path(cli_path, run_name='__cli_worker_preload__')
+    except BaseException as e:
+        print(f"CLI worker preload failed, commands will import on demand: {str(e)}")
+
+
+def _start(cli_path, args):
+    """Fork a child that runs one CLI invocation with its output in a temp file"""
+    output = tempfile.TemporaryFile()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.dup2(output.fileno(), 1)
+            os.dup2(output.fileno(), 2)
+            sys.argv = [cli_path] + list(args)
+            runpy.run_path(cli_path, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+    return pid, output
+
+
+def _collect(output, status, timed_out):
+    with output:
+        output.seek(0)
+        text = output.read().decode('utf-8', errors='replace')
+    if timed_out:
+        return {'returncode': -signal.SIGKILL, 'output': text, 'timed_out': True}
+    return {'returncode': os.waitstatus_to_exitcode(status), 'output': text, 'timed_out': False}
+
+
+def _execute_batch(cli_path, batch, timeout=None):
+    """Run several CLI invocations, up to BATCH_PARALLELISM at a time, in request order"""
+    responses = [None] * len(batch)
+    pending = list(enumerate(batch))
+    running = {}  # pid -> (index, output, deadline)
+    delay = 0.001
+    while pending or running:
+        while pending and len(running) < BATCH_PARALLELISM:
+            index, args = pending.pop(0)
+            pid, output = _start(cli_path, args)
+            running[pid] = (index, output, time.monotonic() + timeout if timeout else None)
+            delay = 0.001
+
+        for pid, (index, output, deadline) in list(running.items()):
+            waited_pid, status = os.waitpid(pid, os.WNOHANG)
+            timed_out = False
+            if not waited_pid:
+                if not deadline or time.monotonic() < deadline:
+                    continue
+                os.kill(pid, signal.SIGKILL)
+                _, status = os.waitpid(pid, 0)
+                timed_out = True
+            del running[pid]
+            responses[index] = _collect(output, status, timed_out)
+            delay = 0.001
+
+        if running:
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+    return responses
+
+
+def _execute(cli_path, args, timeout=None):
+    """Run one CLI invocation in a forked child and capture its output"""
+    return _execute_batch(cli_path, [args], timeout)[0]
+
+
+def _read_line(conn):
+    chunks = []
+    size = 0
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        newline = chunk.find(b'\n')
+        if newline != -1:
+            chunks.append(chunk[:newline])
+            break
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > MAX_MESSAGE_SIZE:
+            raise ValueError("CLI worker message too large")
+    return b''.join(chunks)
+
+
+def _handle_connection(conn, cli_path):
+    with conn:
+        line = _read_line(conn)
+        if not line:
+            return  # Health probe or client gone
+        try:
+            request = json.loads(line)
+            batch = request['batch'] if 'batch' in request else [request['args']]
+            for args in batch:
+                if not isinstance(args, list) or not all(isinstance(arg, str) for arg in args):
+                    raise ValueError("args must be a list of strings")
+            responses = _execute_batch(cli_path, batch, request.get('timeout'))
+            response = {'batch': responses} if 'batch' in request else responses[0]
+        except Exception as e:
+            response = {'returncode': 1, 'output': f"CLI worker error: {str(e)}", 'timed_out': False}
+        conn.sendall(json.dumps(response).encode('utf-8') + b'\n')
+
+
+def _worker_loop(listener, cli_path):
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    while True:
+        conn, _ = listener.accept()
+        try:
+            _handle_connection(conn, cli_path)
+        except Exception as e:
+            print(f"CLI worker request failed: {str(e)}")
+
+
+def _spawn_worker(listener, cli_path):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _worker_loop(listener, cli_path)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def serve(socket_path, cli_path, workers):
+    """Listen on socket_path and keep `workers` warm processes accepting requests"""
+    _preload(cli_path)
+
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(socket_path)
+    os.chmod(socket_path, 0o600)
+    listener.listen(128)
+
+    children = {_spawn_worker(listener, cli_path) for _ in range(workers)}
+
+    def shutdown(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    # Supervise: replace any worker that dies
+    while True:
+        pid, _ = os.wait()
+        if pid in children:
+            children.discard(pid)
+            children.add(_spawn_worker(listener, cli_path))
+
+
+def call_worker(socket_path, args, timeout=None):
+    """
+    Send a CLI invocation to the pool.
+
+    Raises WorkerUnavailable if the pool is down. Any other OSError means the
+    request may already have reached a worker.
+    """
+    return _call(socket_path, {'args': list(args), 'timeout': timeout}, timeout)
+
+
+def call_worker_batch(socket_path, batch, timeout=None):
+    """Run several CLI invocations in one round trip; responses keep the request order"""
+    request = {'batch': [list(args) for args in batch], 'timeout': timeout}
+    # Allow for the batch running in waves of BATCH_PARALLELISM
+    waves = -(-len(batch) // BATCH_PARALLELISM) if batch else 1
+    response = _call(socket_path, request, timeout * waves if timeout else None)
+    if 'batch' not in response:
+        raise ValueError(response.get('output', 'CLI worker rejected the batch'))
+    return response['batch']
+
+
+def _call(socket_path, request, timeout):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.settimeout(timeout + 5 if timeout else None)
+        try:
+            conn.connect(socket_path)
+        except OSError as e:
+            raise WorkerUnavailable(str(e)) from e
+        conn.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = _read_line(conn)
+    if not line:
+        raise ConnectionError("CLI worker closed the connection")
+    return json.loads(line)
+
+
+def start_worker_pool(socket_path, cli_path, workers, wait=5.0):
+    """Launch the pool as a child process of the bot and wait for its socket"""
+    process = subprocess.Popen([
+        sys.executable, os.path.abspath(__file__),
+        '--socket', socket_path,
+        '--cli', cli_path,
+        '--workers', str(workers)
+    ])
+    atexit.register(process.terminate)
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.connect(socket_path)
+            return process
+        except OSError:
+            time.sleep(0.05)
+    print("CLI worker pool did not come up, falling back to one process per command")
+    return process
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Warm worker pool for the Hysteria CLI")
+    parser.add_argument('--socket', required=True)
+    parser.add_argument('--cli', required=True)
+    parser.add_argument('--workers', type=int, default=2)
+    options = parser.parse_args()
+    serve(options.socket, options.cli, max(1, options.workers))
@@ -1,255 +1,389 @@
 from telebot import types
 from utils.command import *
 from utils.common import create_main_markup, create_purchase_markup, create_downloads_markup
-from utils.payments import CryptomusPayment
+from utils.payments import CryptomusPayment, PAYMENT_LIFETIME
+from utils.payment_scheduler import PaymentScheduler, PAYMENT_FALLBACK_POLL_INTERVAL
+from utils.payment_webhook import PaymentWebhookServer, PAYMENT_WEBHOOK_URL, PAYMENT_WEBHOOK_HOST, PAYMENT_WEBHOOK_PORT
+from urllib.parse import urlparse
 from utils.admin_plans import load_plans
 from datetime import datetime
-from utils.payment_records import add_payment_record, update_payment_status
-import threading
+import hashlib
+from utils.payment_records import add_payment_record, update_payment_status, transition_payment_status, get_payment_record
 import time
 from utils.test_mode import load_test_mode
 from utils.test_config import has_used_test_config, mark_test_config_used
-import qrcode
-import io
 from utils.admin_support import get_support_text
+from utils.user_directory import get_users, user_directory
+from utils.uris import get_user_uri
+from utils.qr import send_qr_photo, edit_qr_photo
+from telebot.apihelper import ApiTelegramException
 
 # Initialize payment processor
 payment_processor = CryptomusPayment()
 
-# Store payment sessions
-payment_sessions = {}
+# Texts and decisions shared with the asyncio engine, which only does the I/O differently
+TEST_CONFIG_USED_TEXT = "❌ You have already used your test config. Please purchase a plan to get a new config."
+CONFIG_ERROR_TEXT = "Error generating config. Please try again later."
+CONFIGS_ERROR_TEXT = "Error retrieving configs. Please try again later."
+NO_CONFIGS_TEXT = "You don't have any active configs. Use the Purchase Plan option to get started!"
+NO_CONFIGS_SHORT_TEXT = "You don't have any active configs."
+INVALID_PLAN_TEXT = "Invalid plan selected"
+PURCHASE_TEXT = "Select a plan to purchase:"
+DOWNLOADS_TEXT = "Download our apps:"
 
-@bot.message_handler(func=lambda message: message.text == '🎁 Test Config')
-def handle_test_config(message):
-    if has_used_test_config(message.from_user.id):
-        bot.reply_to(
-            message,
-            "❌ You have already used your test config. Please purchase a plan to get a new config.",
-            reply_markup=create_main_markup(is_admin=False)
-        )
-        return
+# 1GB traffic limit and 30 days expiration
+TEST_CONFIG_GB = 1
+TEST_CONFIG_DAYS = 30
 
-    # Create test config
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    username = f"{message.from_user.id}d{timestamp}"
-    
-    # 1GB traffic limit and 30 days expiration
-    command = f"python3 {CLI_PATH} add-user -u {username} -t 1 -e 30"
-    result = run_cli_command(command)
-    
-    # Get IPv4 config and clean up the warning message
-    command = f"python3 {CLI_PATH} show-user-uri -u {username} -ip 4"
-    config_v4 = run_cli_command(command)
-    config_v4 = config_v4.replace("Warning: IP4 or IP6 is not set in configs.env. Fetching from ip.gs...\n", "")
-    config_v4 = config_v4.replace("IPv4:\n", "").strip()
-    
-    # Create QR code
-    qr = qrcode.make(config_v4)
-    bio = io.BytesIO()
-    qr.save(bio, 'PNG')
-    bio.seek(0)
-    
-    caption = (
+def new_config_username(telegram_id):
+    return f"{telegram_id}d{datetime.now().strftime('%Y%m%d%H%M%S')}"
+
+def add_user_command(username, plan_gb, plan_days):
+    return f"python3 {CLI_PATH} add-user -u {username} -t {plan_gb} -e {plan_days}"
+
+def format_new_config(username, plan_gb, plan_days, config_v4):
+    """Caption of a config that was just created"""
+    return (
         f"📱 Config: {username}\n"
-        f"📊 Traffic: 0.00/1.00 GB\n"
-        f"📅 Days: 0/30\n\n"
+        f"📊 Traffic: 0.00/{plan_gb:.2f} GB\n"
+        f"📅 Days: 0/{plan_days}\n\n"
         f"📝 Config Text:\n"
         f"`{config_v4}`"
     )
+
+def handle_test_config(message):
+    if has_used_test_config(message.from_user.id):
+        bot.reply_to(message, TEST_CONFIG_USED_TEXT, reply_markup=create_main_markup(is_admin=False))
+        return
+
+    username = new_config_username(message.from_user.id)
+    run_cli_command(add_user_command(username, TEST_CONFIG_GB, TEST_CONFIG_DAYS))
+    
+    # Get IPv4 config
+    config_v4 = get_user_uri(username)['uri']
+    if not config_v4:
+        bot.reply_to(message, CONFIG_ERROR_TEXT)
+        return
     
     # Mark test config as used
     mark_test_config_used(message.from_user.id)
     
-    bot.send_photo(
+    send_qr_photo(
         message.chat.id,
-        photo=bio,
-        caption=caption,
+        config_v4,
+        owner=username,
+        caption=format_new_config(username, TEST_CONFIG_GB, TEST_CONFIG_DAYS, config_v4),
         parse_mode="Markdown",
         reply_markup=create_main_markup(is_admin=False)
     )
 
-@bot.message_handler(func=lambda message: message.text == '📱 My Configs')
+# Lines of the all-configs summary shown under each page
+SUMMARY_LINES = 10
+
+def get_active_configs(telegram_id):
+    """Sorted usernames of a client's configs that are not blocked"""
+    return sorted(
+        username for username, status in user_directory.configs_for(telegram_id).items()
+        if not status['blocked']
+    )
+
+def format_configs_summary(usernames, users, current):
+    # Keep the summary short enough for a photo caption, centred on the current page
+    first = max(0, min(current - SUMMARY_LINES // 2, len(usernames) - SUMMARY_LINES))
+    lines = []
+    for index in range(first, min(first + SUMMARY_LINES, len(usernames))):
+        details = users.get(usernames[index], {})
+        marker = "▶️" if index == current else f"{index + 1}."
+        lines.append(
+            f"{marker} {details.get('used_download_bytes', 0) / (1024**3):.2f}/{details.get('max_download_bytes', 0) / (1024**3):.2f} GB, "
+            f"{details.get('remaining_days', 0)}/{details.get('expiration_days', 0)} days"
+        )
+    hidden = len(usernames) - len(lines)
+    if hidden:
+        lines.append(f"… +{hidden} more")
+    return "\n".join(lines)
+
+def format_config_page(usernames, users, page, config_v4):
+    """Return (caption, markup) for one page of the My Configs carousel"""
+    username = usernames[page]
+    details = users.get(username, {})
+
+    # Format message with the exact style requested
+    caption = (
+        f"📱 Config: {username} ({page + 1}/{len(usernames)})\n"
+        f"📊 Traffic: {details.get('used_download_bytes', 0) / (1024**3):.2f}/{details.get('max_download_bytes', 0) / (1024**3):.2f} GB\n"
+        f"📅 Days: {details.get('remaining_days', 0)}/{details.get('expiration_days', 0)}\n\n"
+        f"📝 Config Text:\n"
+        f"`{config_v4}`"
+    )
+    if len(usernames) > 1:
+        caption += f"\n\n📋 All configs:\n{format_configs_summary(usernames, users, page)}"
+
+    markup = None
+    if len(usernames) > 1:
+        markup = types.InlineKeyboardMarkup()
+        buttons = []
+        if page > 0:
+            buttons.append(types.InlineKeyboardButton("⬅️ Prev", callback_data=f"myconfigs:{page - 1}"))
+        if page < len(usernames) - 1:
+            buttons.append(types.InlineKeyboardButton("Next ➡️", callback_data=f"myconfigs:{page + 1}"))
+        markup.row(*buttons)
+    return caption, markup
+
+def clamp_page(usernames, page):
+    return min(max(page, 0), len(usernames) - 1)
+
+def build_config_page(usernames, page):
+    """Return (uri, caption, markup) for one page of the My Configs carousel"""
+    config_v4 = get_user_uri(usernames[page])['uri']
+    if not config_v4:
+        return None, None, None
+    caption, markup = format_config_page(usernames, get_users(), page, config_v4)
+    return config_v4, caption, markup
+
 def show_my_configs(message):
-    command = f"python3 {CLI_PATH} list-users"
-    result = run_cli_command(command)
-    
     try:
-        users = json.loads(result)
-        found = False
-        
-        for username, details in users.items():
-            # Check if config belongs to user and is not blocked
-            if username.startswith(f"{message.from_user.id}d") and not details.get('blocked', False):
-                found = True
-                
-                # Get IPv4 config and clean up the warning message
-                command = f"python3 {CLI_PATH} show-user-uri -u {username} -ip 4"
-                config_v4 = run_cli_command(command)
-                # Remove the warning message and clean up the text
-                config_v4 = config_v4.replace("Warning: IP4 or IP6 is not set in configs.env. Fetching from ip.gs...\n", "")
-                config_v4 = config_v4.replace("IPv4:\n", "").strip()
-                
-                # Create QR code
-                qr = qrcode.make(config_v4)
-                bio = io.BytesIO()
-                qr.save(bio, 'PNG')
-                bio.seek(0)
-                
-                # Format message with the exact style requested
-                caption = (
-                    f"📱 Config: {username}\n"
-                    f"📊 Traffic: {details.get('used_download_bytes', 0) / (1024**3):.2f}/{details.get('max_download_bytes', 0) / (1024**3):.2f} GB\n"
-                    f"📅 Days: {details.get('remaining_days', 0)}/{details.get('expiration_days', 0)}\n\n"
-                    f"📝 Config Text:\n"
-                    f"`{config_v4}`"
-                )
-                
-                bot.send_photo(
-                    message.chat.id,
-                    photo=bio,
-                    caption=caption,
-                    parse_mode="Markdown"
-                )
-        
-        if not found:
-            bot.reply_to(message, "You don't have any active configs. Use the Purchase Plan option to get started!")
-            
+        usernames = get_active_configs(message.from_user.id)
+        if not usernames:
+            bot.reply_to(message, NO_CONFIGS_TEXT)
+            return
+
+        # Only the first config is rendered now, the rest when the client pages to them
+        config_v4, caption, markup = build_config_page(usernames, 0)
+        if not config_v4:
+            bot.reply_to(message, CONFIG_ERROR_TEXT)
+            return
+
+        send_qr_photo(
+            message.chat.id,
+            config_v4,
+            owner=usernames[0],
+            caption=caption,
+            parse_mode="Markdown",
+            reply_markup=markup
+        )
     except json.JSONDecodeError:
-        bot.reply_to(message, "Error retrieving configs. Please try again later.")
+        bot.reply_to(message, CONFIGS_ERROR_TEXT)
 
-def send_new_config(chat_id, username, plan_gb, plan_days, result_text):
+@bot.callback_query_handler(func=lambda call: call.data.startswith('myconfigs:'))
+def handle_my_configs_page(call):
     try:
-        # Get IPv4 config and clean up the warning message
-        command = f"python3 {CLI_PATH} show-user-uri -u {username} -ip 4"
-        config_v4 = run_cli_command(command)
-        config_v4 = config_v4.replace("Warning: IP4 or IP6 is not set in configs.env. Fetching from ip.gs...\n", "")
-        config_v4 = config_v4.replace("IPv4:\n", "").strip()
-        
-        # Create QR code
-        qr = qrcode.make(config_v4)
-        bio = io.BytesIO()
-        qr.save(bio, 'PNG')
-        bio.seek(0)
-        
-        caption = (
-            f"📱 Config: {username}\n"
-            f"📊 Traffic: 0.00/{plan_gb:.2f} GB\n"
-            f"📅 Days: 0/{plan_days}\n\n"
-            f"📝 Config Text:\n"
-            f"`{config_v4}`"
+        usernames = get_active_configs(call.from_user.id)
+        if not usernames:
+            bot.answer_callback_query(call.id, NO_CONFIGS_SHORT_TEXT)
+            return
+        page = clamp_page(usernames, int(call.data.split(':')[1]))
+
+        config_v4, caption, markup = build_config_page(usernames, page)
+        if not config_v4:
+            bot.answer_callback_query(call.id, CONFIG_ERROR_TEXT)
+            return
+
+        edit_qr_photo(
+            call.message.chat.id,
+            call.message.message_id,
+            config_v4,
+            caption=caption,
+            parse_mode="Markdown",
+            reply_markup=markup,
+            owner=usernames[page]
         )
+        bot.answer_callback_query(call.id)
+    except (ValueError, json.JSONDecodeError):
+        bot.answer_callback_query(call.id, CONFIGS_ERROR_TEXT)
+    except ApiTelegramException as e:
+        # Double taps land on the page already shown
+        if 'not modified' not in e.description:
+            raise
+        bot.answer_callback_query(call.id)
+
+def send_new_config(chat_id, username, plan_gb, plan_days, result_text):
+    try:
+        # Get IPv4 config
+        config_v4 = get_user_uri(username)['uri']
+        if not config_v4:
+            raise ValueError(f"no URI returned for {username}")
         
-        bot.send_photo(
+        send_qr_photo(
             chat_id,
-            photo=bio,
-            caption=caption,
+            config_v4,
+            owner=username,
+            caption=format_new_config(username, plan_gb, plan_days, config_v4),
             parse_mode="Markdown",
             reply_markup=create_main_markup(is_admin=False)
         )
     except Exception as e:
         bot.send_message(chat_id, f"Error generating config: {str(e)}")
 
-def check_payment_status(payment_id, chat_id, plan_gb):
-    while True:
-        status = payment_processor.check_payment_status(payment_id)
-        
-        # First check if there's an error in the response
-        if "error" in status:
-            bot.send_message(
-                chat_id,
-                f"❌ Error checking payment status: {status['error']}\nPlease contact support."
-            )
-            del payment_sessions[payment_id]
-            break
+def paid_config_username(payment_id, chat_id):
+    """Config username of a payment; the same on every attempt, so a retry finds what an earlier one created"""
+    digits = int(hashlib.sha256(payment_id.encode('utf-8')).hexdigest(), 16) % 10**14
+    return f"{chat_id}d{digits:014d}"
+
+def create_paid_config(payment_id, chat_id, plan_gb, status):
+    plans = load_plans()
+    plan_days = plans[str(plan_gb)]['days']
+    username = paid_config_username(payment_id, chat_id)
+
+    if username in get_users(max_age=0):
+        result = ""  # Created by an attempt that failed or died before marking the payment
+    else:
+        result = run_cli_command(add_user_command(username, plan_gb, plan_days))
+        # A timed out add-user may still have finished
+        if "Error" in result and username not in get_users(max_age=0):
+            raise RuntimeError(f"add-user failed: {result.strip()}")
+
+    update_payment_status(payment_id, status)
+    send_new_config(chat_id, username, plan_gb, plan_days, result)
+
+def process_payment_result(payment_id, chat_id, plan_gb, result):
+    """Act on a Cryptomus payment result; returns True once the payment is settled or expired"""
+    payment_status = result.get('status', '')
 
-        # Check if we have a valid result
-        if not status or 'result' not in status:
+    try:
+        amount_paid = float(result.get('amount_paid_usd', 0))
+        amount_required = float(result.get('amount_usd', 0))
+    except (ValueError, TypeError):
+        amount_paid = 0
+        amount_required = 0
+
+    if payment_status in ('paid', 'paid_over'):
+        if amount_paid < amount_required:
+            # Underpaid
+            if not transition_payment_status(payment_id, 'pending', 'underpaid'):
+                return True  # Already handled through another channel
             bot.send_message(
                 chat_id,
-                "❌ Invalid payment status response. Please contact support."
+                f"⚠️ Payment underpaid (${amount_paid:.2f} of ${amount_required:.2f})\n"
+                "Please contact support."
             )
-            del payment_sessions[payment_id]
-            break
+            return True
 
-        result = status['result']
-        payment_status = result.get('status', '')
-        
+        # Claim the payment so a webhook and a poll cannot both create a config
+        if not transition_payment_status(payment_id, 'pending', 'processing'):
+            return True
         try:
-            amount_paid = float(result.get('amount_paid_usd', 0))
-            amount_required = float(result.get('amount_usd', 0))
-        except (ValueError, TypeError):
-            amount_paid = 0
-            amount_required = 0
-
-        # Check payment status
-        if payment_status == 'paid':
-            if amount_paid < amount_required:
-                # Underpaid
-                bot.send_message(
-                    chat_id,
-                    f"⚠️ Payment underpaid (${amount_paid:.2f} of ${amount_required:.2f})\n"
-                    "Please contact support."
-                )
-                update_payment_status(payment_id, 'underpaid')
-                del payment_sessions[payment_id]
-                break
-            elif amount_paid > amount_required:
-                # Overpaid but process anyway
-                plans = load_plans()
-                plan_days = plans[str(plan_gb)]['days']
-                
-                timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-                username = f"{chat_id}d{timestamp}"
-                
-                command = f"python3 {CLI_PATH} add-user -u {username} -t {plan_gb} -e {plan_days}"
-                result = run_cli_command(command)
-                
-                update_payment_status(payment_id, 'completed_overpaid')
-                send_new_config(chat_id, username, plan_gb, plan_days, result)
-                
-                bot.send_message(
-                    chat_id,
-                    f"⚠️ Note: Payment was overpaid (${amount_paid:.2f} of ${amount_required:.2f})\n"
-                    "Please contact support for a refund."
-                )
-                
-                del payment_sessions[payment_id]
-                break
-            else:
-                # Exact payment
-                plans = load_plans()
-                plan_days = plans[str(plan_gb)]['days']
-                
-                timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-                username = f"{chat_id}d{timestamp}"
-                
-                command = f"python3 {CLI_PATH} add-user -u {username} -t {plan_gb} -e {plan_days}"
-                result = run_cli_command(command)
-                
-                update_payment_status(payment_id, 'completed')
-                send_new_config(chat_id, username, plan_gb, plan_days, result)
-                
-                del payment_sessions[payment_id]
-                break
-            
-        elif payment_status == 'expired':
-            # Payment expired
+            create_paid_config(
+                payment_id, chat_id, plan_gb, 'completed_overpaid' if amount_paid > amount_required else 'completed'
+            )
+        except Exception as e:
+            # Release the claim so the next poll or reconciliation pass tries again
+            print(f"Error provisioning payment {payment_id}: {str(e)}")
+            transition_payment_status(payment_id, 'processing', 'pending')
+            raise
+        if amount_paid > amount_required:
+            # Overpaid but processed anyway
             bot.send_message(
                 chat_id,
-                "❌ Payment session expired. Please try again."
+                f"⚠️ Note: Payment was overpaid (${amount_paid:.2f} of ${amount_required:.2f})\n"
+                "Please contact support for a refund."
             )
-            update_payment_status(payment_id, 'expired')
-            del payment_sessions[payment_id]
-            break
-            
-        # If still pending, wait and check again
-        time.sleep(30)
-
-@bot.message_handler(func=lambda message: message.text == '💰 Purchase Plan')
+        return True
+
+    if payment_status == 'expired':
+        handle_payment_expired(payment_id, {'chat_id': chat_id})
+        return True
+
+    return False
+
+def handle_payment_status(payment_id, session, status):
+    """Scheduler callback for one Cryptomus status check"""
+    chat_id = session['chat_id']
+
+    # First check if there's an error in the response
+    if "error" in status:
+        bot.send_message(
+            chat_id,
+            f"❌ Error checking payment status: {status['error']}\nPlease contact support."
+        )
+        return True
+
+    # Check if we have a valid result
+    if not status or 'result' not in status:
+        bot.send_message(
+            chat_id,
+            "❌ Invalid payment status response. Please contact support."
+        )
+        return True
+
+    return process_payment_result(payment_id, chat_id, session['plan_gb'], status['result'])
+
+def handle_payment_expired(payment_id, session):
+    if not transition_payment_status(payment_id, 'pending', 'expired'):
+        return
+    bot.send_message(
+        session['chat_id'],
+        "❌ Payment session expired. Please try again."
+    )
+
+def handle_payment_webhook(data):
+    """Process a verified Cryptomus payment notification"""
+    if data.get('type', 'payment') != 'payment':
+        return
+    payment_id = data.get('uuid')
+    record = get_payment_record(payment_id)
+    if record is None:
+        print(f"Payment webhook for unknown payment {payment_id}")
+        return
+
+    if process_payment_result(payment_id, record['user_id'], record['plan_gb'], normalize_payment_result(data)):
+        get_payment_poller().cancel(payment_id)
+
+def normalize_payment_result(data):
+    """Webhook and payment list entries name the amounts differently from /payment/info"""
+    result = dict(data)
+    result.setdefault('amount_usd', data.get('amount', 0))
+    result.setdefault('amount_paid_usd', data.get('payment_amount_usd', 0))
+    result.setdefault('status', data.get('payment_status', ''))
+    return result
+
+# Polls every open invoice from one thread instead of a thread per payment;
+# with the webhook enabled polling only catches notifications that never arrived
+if PAYMENT_WEBHOOK_URL:
+    payment_scheduler = PaymentScheduler(
+        payment_processor.check_payment_status,
+        handle_payment_status,
+        handle_payment_expired,
+        PAYMENT_LIFETIME,
+        interval=PAYMENT_FALLBACK_POLL_INTERVAL,
+        max_interval=PAYMENT_FALLBACK_POLL_INTERVAL
+    )
+else:
+    payment_scheduler = PaymentScheduler(
+        payment_processor.check_payment_status,
+        handle_payment_status,
+        handle_payment_expired,
+        PAYMENT_LIFETIME
+    )
+_payment_poller = payment_scheduler
+
+def set_payment_poller(poller):
+    """Hand open invoices to another poller with add, cancel and is_polling, e.g. the asyncio engine's"""
+    global _payment_poller
+    _payment_poller = poller
+
+def get_payment_poller():
+    """The poller of the running engine; purchases, the webhook and reconciliation all go through it"""
+    return _payment_poller
+
+def start_payment_webhook():
+    """Start the Cryptomus notification endpoint when PAYMENT_WEBHOOK_URL is set"""
+    if not PAYMENT_WEBHOOK_URL:
+        return None
+    server = PaymentWebhookServer(
+        PAYMENT_WEBHOOK_HOST,
+        PAYMENT_WEBHOOK_PORT,
+        urlparse(PAYMENT_WEBHOOK_URL).path or '/',
+        payment_processor.verify_webhook,
+        handle_payment_webhook
+    )
+    server.start()
+    return server
+
 def show_purchase_options(message):
     bot.reply_to(
         message,
-        "Select a plan to purchase:",
+        PURCHASE_TEXT,
         reply_markup=create_purchase_markup()
     )
 
@@ -258,6 +392,60 @@ def extract_config_from_result(result):
     # This depends on your CLI output format
     return result
 
+def test_payment_record(chat_id, plan_gb, amount):
+    """(payment_id, record) of a purchase made in test mode"""
+    return f"test_{int(time.time())}", {
+        'user_id': chat_id,
+        'plan_gb': plan_gb,
+        'amount': amount,
+        'status': 'test_mode',
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'payment_url': 'N/A',
+        'is_test': True
+    }
+
+def format_test_purchase(username, plan_gb, plan_days, result):
+    return (
+        "✅ Test Mode: Config created successfully!\n\n"
+        f"Username: {username}\n"
+        f"Traffic: {plan_gb}GB\n"
+        f"Duration: {plan_days} days\n\n"
+        f"Config:\n{extract_config_from_result(result)}"
+    )
+
+def payment_error_text(payment):
+    """Message for a create_payment response that has no invoice, or None when it has one"""
+    if "error" in payment:
+        if "credentials not configured" in payment["error"]:
+            return "❌ Payment system is not configured yet. Please contact support."
+        return f"❌ Payment Error: {payment['error']}\nPlease try again later or contact support."
+    if not payment or 'result' not in payment:
+        return "❌ Failed to create payment. Please try again later or contact support."
+    return None
+
+def pending_payment_record(chat_id, plan_gb, amount, payment_url):
+    return {
+        'user_id': chat_id,
+        'plan_gb': plan_gb,
+        'amount': amount,
+        'status': 'pending',
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'payment_url': payment_url
+    }
+
+def format_invoice(plan_gb, amount, payment_id, payment_url):
+    """(text, markup) of the message that links to an invoice"""
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("💳 Pay Now", url=payment_url))
+    text = (
+        f"💰 Payment for {plan_gb}GB Plan\n\n"
+        f"Amount: ${amount:.2f}\n"
+        f"Payment ID: {payment_id}\n\n"
+        "Click the button below to proceed with payment.\n"
+        "The config will be created automatically after payment is confirmed."
+    )
+    return text, markup
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith('purchase:'))
 def handle_purchase(call):
     plan_gb = int(call.data.split(':')[1])
@@ -266,131 +454,61 @@ def handle_purchase(call):
     plans = load_plans()
     
     if str(plan_gb) not in plans:
-        bot.answer_callback_query(call.id, "Invalid plan selected")
+        bot.answer_callback_query(call.id, INVALID_PLAN_TEXT)
         return
 
+    chat_id = call.message.chat.id
     amount = plans[str(plan_gb)]['price']
     
     # Check if test mode is enabled
     if load_test_mode():
-        # Create test payment record
-        payment_id = f"test_{int(time.time())}"
-        payment_record = {
-            'user_id': call.message.chat.id,
-            'plan_gb': plan_gb,
-            'amount': amount,
-            'status': 'test_mode',
-            'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'payment_url': 'N/A',
-            'is_test': True
-        }
+        payment_id, payment_record = test_payment_record(chat_id, plan_gb, amount)
         add_payment_record(payment_id, payment_record)
         
         # Create user config immediately
         plan_days = plans[str(plan_gb)]['days']
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        username = f"{call.message.chat.id}d{timestamp}"
-        
-        command = f"python3 {CLI_PATH} add-user -u {username} -t {plan_gb} -e {plan_days}"
-        result = run_cli_command(command)
+        username = new_config_username(chat_id)
+        result = run_cli_command(add_user_command(username, plan_gb, plan_days))
         
         # Update payment record
         update_payment_status(payment_id, 'completed')
         
-        # Extract config from result
-        config_text = extract_config_from_result(result)
-        
         bot.edit_message_text(
-            chat_id=call.message.chat.id,
+            chat_id=chat_id,
             message_id=call.message.message_id,
-            text=(
-                "✅ Test Mode: Config created successfully!\n\n"
-                f"Username: {username}\n"
-                f"Traffic: {plan_gb}GB\n"
-                f"Duration: {plan_days} days\n\n"
-                f"Config:\n{config_text}"
-            )
+            text=format_test_purchase(username, plan_gb, plan_days, result)
         )
         return
     
     # Normal payment flow continues here...
     payment = payment_processor.create_payment(amount, plan_gb)
-    
-    if "error" in payment:
-        error_message = payment["error"]
-        if "credentials not configured" in error_message:
-            bot.reply_to(
-                call.message,
-                "❌ Payment system is not configured yet. Please contact support.",
-                reply_markup=create_main_markup(is_admin=False)
-            )
-        else:
-            bot.reply_to(
-                call.message,
-                f"❌ Payment Error: {error_message}\nPlease try again later or contact support.",
-                reply_markup=create_main_markup(is_admin=False)
-            )
-        return
-
-    if not payment or 'result' not in payment:
-        bot.reply_to(
-            call.message,
-            "❌ Failed to create payment. Please try again later or contact support.",
-            reply_markup=create_main_markup(is_admin=False)
-        )
+    error_text = payment_error_text(payment)
+    if error_text:
+        bot.reply_to(call.message, error_text, reply_markup=create_main_markup(is_admin=False))
         return
 
     payment_id = payment['result']['uuid']
     payment_url = payment['result']['url']
+    add_payment_record(payment_id, pending_payment_record(chat_id, plan_gb, amount, payment_url))
     
-    # Store payment session
-    payment_sessions[payment_id] = {
-        'chat_id': call.message.chat.id,
-        'plan_gb': plan_gb
-    }
-    
-    # Record payment information
-    payment_record = {
-        'user_id': call.message.chat.id,
-        'plan_gb': plan_gb,
-        'amount': amount,
-        'status': 'pending',
-        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-        'payment_url': payment_url
-    }
-    add_payment_record(payment_id, payment_record)
-    
-    # Start payment checking thread
-    threading.Thread(
-        target=check_payment_status,
-        args=(payment_id, call.message.chat.id, plan_gb)
-    ).start()
+    # Poll the invoice until it is paid or expires
+    get_payment_poller().add(payment_id, chat_id, plan_gb)
 
-    markup = types.InlineKeyboardMarkup()
-    markup.add(types.InlineKeyboardButton("💳 Pay Now", url=payment_url))
-    
+    text, markup = format_invoice(plan_gb, amount, payment_id, payment_url)
     bot.edit_message_text(
-        chat_id=call.message.chat.id,
+        chat_id=chat_id,
         message_id=call.message.message_id,
-        text=(
-            f"💰 Payment for {plan_gb}GB Plan\n\n"
-            f"Amount: ${amount:.2f}\n"
-            f"Payment ID: {payment_id}\n\n"
-            "Click the button below to proceed with payment.\n"
-            "The config will be created automatically after payment is confirmed."
-        ),
+        text=text,
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: message.text == '⬇️ Downloads')
 def show_downloads(message):
     markup = create_downloads_markup()  # Get the markup first
     bot.reply_to(
         message,
-        "Download our apps:",
+        DOWNLOADS_TEXT,
         reply_markup=markup
     )
 
-@bot.message_handler(func=lambda message: message.text == '📞 Support')
 def show_support(message):
     bot.reply_to(message, get_support_text()) 
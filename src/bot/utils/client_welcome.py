@@ -1,31 +1,34 @@
 from telebot import types
-from utils.command import bot, is_admin
+from utils.command import bot, is_admin, router, CLIENT
 from utils.languages import LanguageManager, LANGUAGES, TRANSLATIONS
-from utils.client import show_my_configs, show_purchase_options, show_downloads, show_support
+from utils.client import show_my_configs, show_purchase_options, show_downloads, show_support, handle_test_config
 
 # Initialize language manager
 lang_manager = LanguageManager()
 
-def handle_start(message):
-    """Handle /start command for regular users"""
-    if str(message.from_user.id) not in lang_manager.user_languages:
-        markup = lang_manager.create_language_markup()
-        bot.reply_to(
-            message,
-            "Please select your language:\n\nلطفاً زبان خود را انتخاب کنید:\nDiliňizi saýlaň:\nالرجاء اختيار لغتك:\nПожалуйста, выберите ваш язык:",
-            reply_markup=markup
-        )
-        return
+LANGUAGE_PROMPT = "Please select your language:\n\nلطفاً زبان خود را انتخاب کنید:\nDiliňizi saýlaň:\nالرجاء اختيار لغتك:\nПожалуйста, выберите ваш язык:"
 
-    # If language is already set, show the main menu
-    lang_code = lang_manager.get_user_language(message.from_user.id)
-    markup = lang_manager.create_menu_markup(lang_code)
-    bot.reply_to(
-        message,
-        lang_manager.get_text(lang_code, 'welcome'),
-        reply_markup=markup
+def start_screen(user_id):
+    """(text, markup) answering /start: the language picker, or the main menu once a language is set"""
+    if not lang_manager.has_user_language(user_id):
+        return LANGUAGE_PROMPT, lang_manager.create_language_markup()
+    lang_code = lang_manager.get_user_language(user_id)
+    return lang_manager.get_text(lang_code, 'welcome'), lang_manager.create_menu_markup(lang_code)
+
+def select_language(user_id, lang_code):
+    """Store the language; returns (confirmation, markup, welcome) to send back"""
+    lang_manager.set_user_language(user_id, lang_code)
+    return (
+        lang_manager.get_text(lang_code, 'language_selected'),
+        lang_manager.create_menu_markup(lang_code),
+        lang_manager.get_text(lang_code, 'welcome')
     )
 
+def handle_start(message):
+    """Handle /start command for regular users"""
+    text, markup = start_screen(message.from_user.id)
+    bot.reply_to(message, text, reply_markup=markup)
+
 def handle_language_selection(message):
     """Handle language selection from the language menu"""
     if is_admin(message.from_user.id):
@@ -35,65 +38,45 @@ def handle_language_selection(message):
     if not lang_code:
         return
 
-    lang_manager.set_user_language(message.from_user.id, lang_code)
-    
-    # Show confirmation and main menu
-    markup = lang_manager.create_menu_markup(lang_code)
-    bot.reply_to(
-        message,
-        lang_manager.get_text(lang_code, 'language_selected'),
-        reply_markup=markup
-    )
-    
-    # Send welcome message
-    bot.send_message(
-        message.chat.id,
-        lang_manager.get_text(lang_code, 'welcome')
-    )
+    # Show confirmation and main menu, then the welcome message
+    confirmation, markup, welcome = select_language(message.from_user.id, lang_code)
+    bot.reply_to(message, confirmation, reply_markup=markup)
+    bot.send_message(message.chat.id, welcome)
+
+# Button label in any language -> (action, language), built once at import
+MENU_ACTIONS = {
+    'my_configs': show_my_configs,
+    'purchase_plan': show_purchase_options,
+    'downloads': show_downloads,
+    'support': show_support,
+    'test_config': handle_test_config
+}
+MENU_DISPATCH = {
+    translations[action]: (action, lang_code)
+    for lang_code, translations in TRANSLATIONS.items()
+    for action in MENU_ACTIONS
+}
+
+def menu_action(message):
+    """The action of a menu button press"""
+    action, lang_code = MENU_DISPATCH[message.text]
+
+    # A button press tells us the user's language if it was never stored
+    if not lang_manager.has_user_language(message.from_user.id):
+        lang_manager.set_user_language(message.from_user.id, lang_code)
+    return action
 
 def handle_client_menu(message):
     """Handle client menu button clicks"""
-    user_lang = lang_manager.get_user_language(message.from_user.id)
-    
-    # Get all possible menu items for all languages
-    menu_items = {
-        'my_configs': [lang['my_configs'] for lang in TRANSLATIONS.values()],
-        'purchase_plan': [lang['purchase_plan'] for lang in TRANSLATIONS.values()],
-        'downloads': [lang['downloads'] for lang in TRANSLATIONS.values()],
-        'support': [lang['support'] for lang in TRANSLATIONS.values()]
-    }
-    
-    # Check which menu item was clicked
-    if message.text in menu_items['my_configs']:
-        show_my_configs(message)
-    elif message.text in menu_items['purchase_plan']:
-        show_purchase_options(message)
-    elif message.text in menu_items['downloads']:
-        show_downloads(message)
-    elif message.text in menu_items['support']:
-        show_support(message)
+    MENU_ACTIONS[menu_action(message)](message)
 
 def register_handlers():
     """Register all client-related message handlers"""
     
     # Language selection handler
-    bot.register_message_handler(
-        handle_language_selection,
-        func=lambda message: not is_admin(message.from_user.id) and message.text in LANGUAGES.keys()
-    )
-    
-    # Client menu handlers - collect all possible menu items in all languages
-    all_menu_items = []
-    for lang in TRANSLATIONS.values():
-        all_menu_items.extend([
-            lang['my_configs'],
-            lang['purchase_plan'],
-            lang['downloads'],
-            lang['support']
-        ])
+    for language_label in LANGUAGES:
+        router.add(language_label, handle_language_selection, role=CLIENT)
     
-    # Register the menu handler
-    bot.register_message_handler(
-        handle_client_menu,
-        func=lambda message: not is_admin(message.from_user.id) and message.text in all_menu_items
-    ) 
+    # Client menu handler for the buttons of every language
+    for label in MENU_DISPATCH:
+        router.add(label, handle_client_menu)
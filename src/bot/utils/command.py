@@ -5,24 +5,187 @@ import os
 import shlex
 from dotenv import load_dotenv
 from telebot import types
+from utils.cli_worker import call_worker, call_worker_batch, start_worker_pool, WorkerUnavailable
+from utils.cli_executor import CliExecutor
+from utils.router import MessageRouter, ADMIN, CLIENT, ANY
+from utils.outbound import OutboundLimiter, RateLimitedBot, OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE
 
 load_dotenv()
 
 # Fix the environment variable name to match what's in the .env file
 API_TOKEN = os.getenv('TELEGRAM_TOKEN')  # Changed from API_TOKEN to TELEGRAM_TOKEN
-ADMIN_USER_IDS = json.loads(os.getenv('ADMIN_USER_IDS', '[]'))  # This is already correct
+ADMIN_USER_IDS = os.getenv('ADMIN_USER_IDS', '[]')
+try:
+    ADMIN_USER_IDS = json.loads(ADMIN_USER_IDS)
+except json.JSONDecodeError:
+    ADMIN_USER_IDS = [user_id for user_id in ADMIN_USER_IDS.split(',') if user_id.strip()]  # 123,456 as in .env.example
+if not isinstance(ADMIN_USER_IDS, list):
+    ADMIN_USER_IDS = [ADMIN_USER_IDS]
+# IDs from the .env might be numbers or strings, compare as strings
+ADMIN_IDS = frozenset(str(user_id).strip() for user_id in ADMIN_USER_IDS)
 CLI_PATH = '/etc/hysteria/core/cli.py'
 BACKUP_DIRECTORY = '/opt/hysbackup'
-bot = telebot.TeleBot(API_TOKEN)
+CLI_WORKER_SOCKET = os.getenv('CLI_WORKER_SOCKET', '/run/dijiq2/cli-worker.sock')
+CLI_WORKERS = int(os.getenv('CLI_WORKERS', '2'))  # 0 disables the warm worker pool
+CLI_MAX_CONCURRENCY = int(os.getenv('CLI_MAX_CONCURRENCY', '4'))
+CLI_TIMEOUT = int(os.getenv('CLI_TIMEOUT', '60'))
+# Per-subcommand timeouts in seconds, everything else uses CLI_TIMEOUT
+CLI_TIMEOUTS = {
+    'backup-hysteria': 300,
+    'server-info': 30,
+    'show-user-uri': 30,
+    'list-users': 30,
+}
+# Subcommands that change the user database; caches listen for these
+CLI_WRITE_COMMANDS = {'add-user', 'edit-user', 'remove-user', 'reset-user'}
+# polling or webhook; handlers run on BOT_WORKERS threads in either mode
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', '8'))
+# Webhook mode: public URL Telegram posts to, local listen address, and updates queued before 503s
+BOT_WEBHOOK_URL = os.getenv('BOT_WEBHOOK_URL')
+BOT_WEBHOOK_HOST = os.getenv('BOT_WEBHOOK_HOST', '127.0.0.1')
+BOT_WEBHOOK_PORT = int(os.getenv('BOT_WEBHOOK_PORT', '8090'))
+BOT_WEBHOOK_SECRET = os.getenv('BOT_WEBHOOK_SECRET')
+BOT_QUEUE_SIZE = int(os.getenv('BOT_QUEUE_SIZE', '1000'))
+# sync, or async: client handlers run on an AsyncTeleBot event loop (polling only)
+BOT_ENGINE = os.getenv('BOT_ENGINE', 'sync')
+# Webhook mode and the async engine run handlers on their own workers, so telebot calls them inline
+telegram_bot = telebot.TeleBot(
+    API_TOKEN, threaded=BOT_MODE != 'webhook' and BOT_ENGINE != 'async', num_threads=BOT_WORKERS
+)
+# Shared by both engines so all sends from this token draw on one budget
+outbound_limiter = OutboundLimiter(OUTBOUND_GLOBAL_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_GROUP_RATE)
+# Sends and edits wait for a slot and retry 429s; everything else goes straight to telegram_bot
+bot = RateLimitedBot(telegram_bot, outbound_limiter)
+cli_executor = CliExecutor(CLI_MAX_CONCURRENCY)
+_write_listeners = []
 
-def run_cli_command(command):
+def on_user_write(listener):
+    """
+    Register listener(args, ok) to be called after a user-modifying command.
+
+    ok is False when the command reported an error; it may still have
+    changed the user, e.g. when it timed out.
+    """
+    _write_listeners.append(listener)
+    return listener
+
+def cli_option(args, flag):
+    """Value following flag in a CLI argument list, or None"""
+    if flag in args:
+        index = args.index(flag)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return None
+
+def notify_user_write(args, ok=True):
+    """Tell caches that a user changed; args use the CLI form, e.g. ['remove-user', '-u', name]"""
+    for listener in _write_listeners:
+        try:
+            listener(args, ok)
+        except Exception as e:
+            print(f"Error in user write listener: {str(e)}")
+
+def start_cli_workers():
+    if CLI_WORKERS > 0:
+        return start_worker_pool(CLI_WORKER_SOCKET, CLI_PATH, CLI_WORKERS)
+
+def _cli_timeout(args):
+    if _is_cli(args):
+        return CLI_TIMEOUTS.get(args[2], CLI_TIMEOUT)
+    return CLI_TIMEOUT
+
+def _is_cli(args):
+    return args[:2] == ['python3', CLI_PATH] and len(args) > 2
+
+def _notify_if_write(args, output):
+    """output is None when running the command raised"""
+    if _is_cli(args) and args[2] in CLI_WRITE_COMMANDS:
+        notify_user_write(args[2:], ok=output is not None and "Error" not in output)
+
+def _format_response(response, timeout):
+    if response.get('timed_out'):
+        return f'Error: Command timed out after {timeout} seconds'
+    if response['returncode'] == 0:
+        return response['output'].strip()
+    return f'Error: {response["output"]}'
+
+def _execute_cli(args, timeout):
+    output = None
+    try:
+        output = _spawn_cli(args, timeout)
+        return output
+    finally:
+        _notify_if_write(args, output)
+
+def _execute_cli_batch(batch, timeout):
     try:
-        args = shlex.split(command)
-        result = subprocess.check_output(args, stderr=subprocess.STDOUT)
-        return result.decode('utf-8').strip()
+        responses = call_worker_batch(CLI_WORKER_SOCKET, [args[2:] for args in batch], timeout)
+    except WorkerUnavailable:
+        # Pool is down, spawn the commands one by one
+        return [_execute_cli(args, timeout) for args in batch]
+    except (OSError, ValueError) as e:
+        # The batch may have run already, so it is not retried
+        responses = [{'returncode': 1, 'output': f"CLI worker failed: {str(e)}"}] * len(batch)
+    outputs = [_format_response(response, timeout) for response in responses]
+    for args, output in zip(batch, outputs):
+        _notify_if_write(args, output)
+    return outputs
+
+def _spawn_cli(args, timeout):
+    if CLI_WORKERS > 0 and args[:2] == ['python3', CLI_PATH]:
+        try:
+            response = call_worker(CLI_WORKER_SOCKET, args[2:], timeout)
+        except WorkerUnavailable:
+            pass  # Pool is down, spawn the CLI directly below
+        except (OSError, ValueError) as e:
+            # The worker may already have run it; spawning it again could apply a write twice
+            return f'Error: CLI worker failed: {str(e)}'
+        else:
+            return _format_response(response, timeout)
+
+    try:
+        # subprocess.run kills the child when the timeout expires
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, check=True)
+        return result.stdout.decode('utf-8').strip()
+    except subprocess.TimeoutExpired:
+        return f'Error: Command timed out after {timeout} seconds'
     except subprocess.CalledProcessError as e:
         return f'Error: {e.output.decode("utf-8")}'
 
+def submit_cli_command(command, timeout=None):
+    """Queue a CLI command on the bounded pool and return a Future with its output"""
+    args = shlex.split(command)
+    return cli_executor.submit(_execute_cli, args, timeout or _cli_timeout(args))
+
+def run_cli_command(command, timeout=None):
+    return submit_cli_command(command, timeout).result()
+
+def run_cli_batch(commands, timeout=None):
+    """
+    Run several CLI commands and return their outputs in order.
+
+    With the worker pool up the whole batch is one round trip and one pool
+    slot; otherwise the commands are queued individually and overlap.
+    """
+    batch = [shlex.split(command) for command in commands]
+    if not batch:
+        return []
+    timeout = timeout or max(_cli_timeout(args) for args in batch)
+    if CLI_WORKERS > 0 and all(_is_cli(args) for args in batch):
+        return cli_executor.submit(_execute_cli_batch, batch, timeout).result()
+    futures = [cli_executor.submit(_execute_cli, args, timeout) for args in batch]
+    return [future.result() for future in futures]
+
+def cli_queue_depth():
+    return cli_executor.queue_depth()
+
+def outbound_queue_depth():
+    return outbound_limiter.queue_depth()
+
 def is_admin(user_id):
-    # Convert user_id to string for comparison since IDs from the .env might be strings
-    return str(user_id) in map(str, ADMIN_USER_IDS)
+    return str(user_id) in ADMIN_IDS
+
+# Exact button text handlers; attached first so telebot consults it before any predicate handler
+router = MessageRouter(is_admin)
+router.attach(bot)
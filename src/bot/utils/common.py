@@ -11,6 +11,7 @@ def create_main_markup(is_admin=False):
         markup.row('💾 Backup Server', '💳 Payment Settings')
         markup.row('📝 Edit Plans', '🔧 Payment Test')
         markup.row('📞 Edit Support', '📢 Broadcast Message')
+        markup.row('📥 Import Users')
     else:
         # Client menu
         markup.row('📱 My Configs', '💰 Purchase Plan')
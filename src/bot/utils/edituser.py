@@ -1,11 +1,12 @@
 #show and edituser file
 
-import qrcode
-import io
 import json
 from telebot import types
 from utils.command import *
 from utils.common import *
+from utils.user_directory import get_users
+from utils.uris import get_user_uri
+from utils.qr import send_qr_photo
 
 
 @bot.callback_query_handler(func=lambda call: call.data == "cancel_show_user")
@@ -13,7 +14,7 @@ def handle_cancel_show_user(call):
     bot.edit_message_text("Operation canceled.", chat_id=call.message.chat.id, message_id=call.message.message_id)
     create_main_markup(call.message)
 
-@bot.message_handler(func=lambda message: is_admin(message.from_user.id) and message.text == '👤 Show User')
+@router.text('👤 Show User', role=ADMIN)
 def show_user(message):
     markup = types.InlineKeyboardMarkup()
     cancel_button = types.InlineKeyboardButton("❌ Cancel", callback_data="cancel_show_user")
@@ -25,13 +26,16 @@ def show_user(message):
 def process_show_user(message):
     username = message.text.strip().lower()
     bot.send_chat_action(message.chat.id, 'typing')
-    command = f"python3 {CLI_PATH} list-users"
-    result = run_cli_command(command)
 
     try:
-        users = json.loads(result)
+        users = get_users()
         existing_users = {user.lower(): user for user in users.keys()}
 
+        if username not in existing_users:
+            # The cached list may predate a user created outside the bot
+            users = get_users(max_age=0)
+            existing_users = {user.lower(): user for user in users.keys()}
+
         if username not in existing_users:
             bot.reply_to(message, f"Username '{message.text.strip()}' does not exist. Please enter a valid username.")
             return
@@ -41,8 +45,10 @@ def process_show_user(message):
         bot.reply_to(message, "Error retrieving user list. Please try again later.")
         return
 
-    command = f"python3 {CLI_PATH} get-user -u {actual_username}"
-    user_result = run_cli_command(command)
+    # Details and URIs are independent, fetch them concurrently
+    user_future = submit_cli_command(f"python3 {CLI_PATH} get-user -u {actual_username}")
+    uri_info = get_user_uri(actual_username, sublinks=True)
+    user_result = user_future.result()
 
     try:
         user_details = json.loads(user_result)
@@ -77,37 +83,18 @@ def process_show_user(message):
         f"{traffic_message}"
     )
 
-    combined_command = f"python3 {CLI_PATH} show-user-uri -u {actual_username} -ip 4 -s -n"
-    combined_result = run_cli_command(combined_command)
-
-    if "Error" in combined_result or "Invalid" in combined_result:
-        bot.reply_to(message, combined_result)
+    if uri_info['error']:
+        bot.reply_to(message, uri_info['error'])
         return
 
-    result_lines = combined_result.strip().split('\n')
-    
-    uri_v4 = ""
-    singbox_sublink = ""
-    normal_sub_sublink = ""
-
-    for line in result_lines:
-        line = line.strip()
-        if line.startswith("hy2://"):
-            uri_v4 = line
-        elif line.startswith("Singbox Sublink:"):
-            singbox_sublink = result_lines[result_lines.index(line) + 1].strip()
-        elif line.startswith("Normal-SUB Sublink:"):
-            normal_sub_sublink = result_lines[result_lines.index(line) + 1].strip()
+    uri_v4 = uri_info['uri']
+    singbox_sublink = uri_info['singbox_sublink']
+    normal_sub_sublink = uri_info['normal_sub_sublink']
 
     if not uri_v4:
         bot.reply_to(message, "No valid URI found.")
         return
 
-    qr_v4 = qrcode.make(uri_v4)
-    bio_v4 = io.BytesIO()
-    qr_v4.save(bio_v4, 'PNG')
-    bio_v4.seek(0)
-
     markup = types.InlineKeyboardMarkup(row_width=3)
     markup.add(types.InlineKeyboardButton("Reset User", callback_data=f"reset_user:{actual_username}"),
                types.InlineKeyboardButton("IPv6-URI", callback_data=f"ipv6_uri:{actual_username}"))
@@ -124,9 +111,10 @@ def process_show_user(message):
     if normal_sub_sublink:
         caption += f"\n\n**Normal SUB:**\n{normal_sub_sublink}"
 
-    bot.send_photo(
+    send_qr_photo(
         message.chat.id,
-        bio_v4,
+        uri_v4,
+        owner=username,
         caption=caption,
         reply_markup=markup,
         parse_mode="Markdown"
@@ -162,21 +150,16 @@ def handle_edit_callback(call):
         result = run_cli_command(command)
         bot.send_message(call.message.chat.id, result)
     elif action == 'ipv6_uri':
-        command = f"python3 {CLI_PATH} show-user-uri -u {username} -ip 6"
-        result = run_cli_command(command)
-        if "Error" in result or "Invalid" in result:
-            bot.send_message(call.message.chat.id, result)
+        uri_info = get_user_uri(username, ip_version=6)
+        if uri_info['error'] or not uri_info['uri']:
+            bot.send_message(call.message.chat.id, uri_info['error'] or "No valid URI found.")
             return
         
-        uri_v6 = result.split('\n')[-1].strip()
-        qr_v6 = qrcode.make(uri_v6)
-        bio_v6 = io.BytesIO()
-        qr_v6.save(bio_v6, 'PNG')
-        bio_v6.seek(0)
-        
-        bot.send_photo(
+        uri_v6 = uri_info['uri']
+        send_qr_photo(
             call.message.chat.id,
-            bio_v6,
+            uri_v6,
+            owner=username,
             caption=f"**IPv6 URI for {username}:**\n\n`{uri_v6}`",
             parse_mode="Markdown"
         )
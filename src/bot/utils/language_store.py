@@ -0,0 +1,104 @@
+"""
+Write-behind storage for user language preferences.
+
+Preferences are served from memory. A selection is queued and written,
+together with whatever else arrived in the meantime, as lines appended to
+a log after LANGUAGE_FLUSH_INTERVAL seconds, so a selection costs one short
+append rather than a rewrite of every user's preference. Once the log
+holds more lines than there are users (or LANGUAGE_COMPACT_LINES), it is
+folded back into the JSON snapshot and truncated. Pending selections are
+flushed at exit.
+"""
+import atexit
+import json
+import os
+import threading
+from utils.settings_store import JsonDocument
+
+LANGUAGE_FLUSH_INTERVAL = float(os.getenv('LANGUAGE_FLUSH_INTERVAL', '2'))
+LANGUAGE_COMPACT_LINES = 50000
+
+
+class LanguageStore:
+    def __init__(self, snapshot_path, log_path):
+        self.log_path = log_path
+        self._snapshot = JsonDocument(snapshot_path, default={})
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._pending = []
+        self._timer = None
+        self._log_lines = 0
+        self._languages = self._load()
+        atexit.register(self.flush)
+
+    def _load(self):
+        languages = self._snapshot.load()
+        try:
+            if os.path.exists(self.log_path):
+                with open(self.log_path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # Torn last line after a crash
+                        languages[entry['user_id']] = entry['lang']
+                        self._log_lines += 1
+        except Exception as e:
+            print(f"Error loading language preferences log: {str(e)}")
+        return languages
+
+    def get(self, user_id, default=None):
+        with self._lock:
+            return self._languages.get(str(user_id), default)
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return str(user_id) in self._languages
+
+    def all(self):
+        with self._lock:
+            return dict(self._languages)
+
+    def set(self, user_id, lang_code):
+        with self._lock:
+            if self._languages.get(str(user_id)) == lang_code:
+                return
+            self._languages[str(user_id)] = lang_code
+            self._pending.append({'user_id': str(user_id), 'lang': lang_code})
+            if self._timer is None:
+                self._timer = threading.Timer(LANGUAGE_FLUSH_INTERVAL, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Append pending selections to the log, compacting it when it has grown too long"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+                self._timer = None
+            if not pending:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+                with open(self.log_path, 'a') as f:
+                    f.write(''.join(json.dumps(entry) + '\n' for entry in pending))
+                self._log_lines += len(pending)
+            except Exception as e:
+                print(f"Error saving language preferences: {str(e)}")
+                with self._lock:
+                    self._pending[:0] = pending  # Retry with the next flush
+                return
+            if self._log_lines > min(len(self._languages), LANGUAGE_COMPACT_LINES):
+                self.compact()
+
+    def compact(self):
+        """Write all preferences to the snapshot and empty the log"""
+        with self._flush_lock:
+            try:
+                # The log is only emptied once the snapshot holding its entries is in place
+                self._snapshot.save(self.all())
+                with open(self.log_path, 'w'):
+                    pass
+                self._log_lines = 0
+            except Exception as e:
+                print(f"Error compacting language preferences: {str(e)}")
@@ -1,6 +1,7 @@
+import threading
 from telebot import types
-import json
-import os
+from utils.language_store import LanguageStore
+from utils.audience import audience_segments
 
 # Language settings
 LANGUAGES = {
@@ -64,40 +65,50 @@ TRANSLATIONS = {
     }
 }
 
-# File to store user language preferences
+# Files to store user language preferences: a snapshot plus a log of later selections
 LANGUAGE_FILE = '/etc/hysteria/core/scripts/telegrambot/user_languages.json'
+LANGUAGE_LOG_FILE = '/etc/hysteria/core/scripts/telegrambot/user_languages.log'
+
+_language_store = None
+_language_store_lock = threading.Lock()
+
+def get_language_store():
+    """The process-wide LanguageStore, loaded on first use"""
+    global _language_store
+    if _language_store is None:
+        # Handler threads race here on the first updates; two stores would both append to the log
+        with _language_store_lock:
+            if _language_store is None:
+                store = LanguageStore(LANGUAGE_FILE, LANGUAGE_LOG_FILE)
+                audience_segments.add_bot_users(store.all())
+                _language_store = store
+    return _language_store
 
 class LanguageManager:
     def __init__(self):
-        self.user_languages = self.load_user_languages()
+        self._store = get_language_store()
+
+    @property
+    def user_languages(self):
+        """Copy of all user language preferences"""
+        return self.load_user_languages()
 
     def load_user_languages(self):
-        """Load user language preferences from file"""
-        if os.path.exists(LANGUAGE_FILE):
-            try:
-                with open(LANGUAGE_FILE, 'r') as f:
-                    return json.load(f)
-            except:
-                return {}
-        return {}
+        """Load user language preferences"""
+        return self._store.all()
 
-    def save_user_languages(self):
-        """Save user language preferences to file"""
-        try:
-            os.makedirs(os.path.dirname(LANGUAGE_FILE), exist_ok=True)
-            with open(LANGUAGE_FILE, 'w') as f:
-                json.dump(self.user_languages, f)
-        except Exception as e:
-            print(f"Error saving language preferences: {str(e)}")
+    def has_user_language(self, user_id):
+        """Whether a user has picked a language yet"""
+        return user_id in self._store
 
     def get_user_language(self, user_id):
         """Get language for a user"""
-        return self.user_languages.get(str(user_id), 'en')
+        return self._store.get(user_id, 'en')
 
     def set_user_language(self, user_id, lang_code):
-        """Set language for a user"""
-        self.user_languages[str(user_id)] = lang_code
-        self.save_user_languages()
+        """Set language for a user; written to disk shortly after"""
+        self._store.set(user_id, lang_code)
+        audience_segments.add_bot_users([user_id])
 
     def get_text(self, lang_code, key):
         """Get translated text"""
@@ -0,0 +1,241 @@
+"""
+Pacing of outgoing Bot API calls.
+
+Telegram allows about 30 messages a second per bot, about one a second in
+a private chat and 20 a minute in a group, and answers 429 with a
+retry_after when those limits are exceeded. Every send and edit goes
+through OutboundLimiter: it hands out slots against a global and a
+per-chat bucket, so callers wait their turn instead of being refused. A
+429 pauses all sending for retry_after seconds, and the call is retried.
+
+The buckets use virtual scheduling (GCRA). A reservation is a point in
+time rather than a blocked thread, so the threaded handlers (sleep) and the
+asyncio engine (await asyncio.sleep) share one budget. A call first waits
+for its chat's slot and only then books a global one, so a backlog in one
+chat never pushes back the sends to other chats.
+"""
+import asyncio
+import os
+import threading
+import time
+
+OUTBOUND_GLOBAL_RATE = float(os.getenv('OUTBOUND_GLOBAL_RATE', '30'))
+OUTBOUND_CHAT_RATE = float(os.getenv('OUTBOUND_CHAT_RATE', '1'))
+OUTBOUND_GROUP_RATE = float(os.getenv('OUTBOUND_GROUP_RATE', str(20 / 60)))
+OUTBOUND_CHAT_BURST = 3
+OUTBOUND_MAX_RETRIES = int(os.getenv('OUTBOUND_MAX_RETRIES', '3'))
+CHAT_BUCKET_LIMIT = 10000
+
+# Bot API calls that count against the limits -> position of chat_id in their arguments
+LIMITED_METHODS = {
+    'send_message': 0,
+    'send_photo': 0,
+    'send_document': 0,
+    'send_video': 0,
+    'send_audio': 0,
+    'send_voice': 0,
+    'send_animation': 0,
+    'send_sticker': 0,
+    'send_media_group': 0,
+    'send_location': 0,
+    'copy_message': 0,
+    'forward_message': 0,
+    'edit_message_text': 1,
+    'edit_message_caption': 1,
+    'edit_message_media': 1,
+    'edit_message_reply_markup': 0,
+}
+
+
+class RateBucket:
+    """Token bucket of `rate` calls per second with `burst` calls of slack"""
+
+    def __init__(self, rate, burst):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0  # Theoretical arrival time of the next call
+
+    def available_at(self, now):
+        return max(now, self.tat - self.tolerance)
+
+    def commit(self, at):
+        self.tat = max(self.tat, at) + self.interval
+
+    def block_until(self, until):
+        self.tat = max(self.tat, until + self.tolerance)
+
+    def idle(self, now):
+        return self.tat <= now
+
+
+class OutboundLimiter:
+    def __init__(self, global_rate, chat_rate, group_rate, chat_burst=OUTBOUND_CHAT_BURST):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self._global = RateBucket(global_rate, max(1, int(global_rate)))
+        self._chats = {}
+        self._lock = threading.Lock()
+        self._waiting = 0
+
+    def _chat_bucket(self, chat_id):
+        # Called with the lock held
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= CHAT_BUCKET_LIMIT:
+                now = time.monotonic()
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            # Negative ids are groups and channels
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = RateBucket(rate, self.chat_burst)
+        return bucket
+
+    def reserve_chat(self, chat_id):
+        """Book the next slot in chat_id's bucket and return the seconds to wait for it"""
+        with self._lock:
+            now = time.monotonic()
+            chat = self._chat_bucket(chat_id)
+            at = chat.available_at(now)
+            chat.commit(at)
+            return at - now
+
+    def reserve_global(self):
+        """Book the next slot in the bot-wide bucket; taken once the chat slot is due"""
+        with self._lock:
+            now = time.monotonic()
+            at = self._global.available_at(now)
+            self._global.commit(at)
+            return at - now
+
+    def pause(self, seconds):
+        """Hold every call back for seconds, after Telegram answered 429"""
+        with self._lock:
+            self._global.block_until(time.monotonic() + seconds)
+
+    def wait(self, chat_id=None):
+        if chat_id is not None:
+            self._sleep(self.reserve_chat(chat_id))
+        self._sleep(self.reserve_global())
+
+    async def wait_async(self, chat_id=None):
+        if chat_id is not None:
+            await self._sleep_async(self.reserve_chat(chat_id))
+        await self._sleep_async(self.reserve_global())
+
+    def _sleep(self, delay):
+        if delay > 0:
+            self._track(1)
+            try:
+                time.sleep(delay)
+            finally:
+                self._track(-1)
+
+    async def _sleep_async(self, delay):
+        if delay > 0:
+            self._track(1)
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self._track(-1)
+
+    def _track(self, change):
+        with self._lock:
+            self._waiting += change
+
+    def queue_depth(self):
+        """Calls currently waiting for their slot"""
+        return self._waiting
+
+
+def _chat_id(name, args, kwargs):
+    if 'chat_id' in kwargs:
+        return kwargs['chat_id']
+    position = LIMITED_METHODS[name]
+    return args[position] if len(args) > position else None
+
+
+def _retry_after(error):
+    """Seconds Telegram asked to wait, or None when error is not a 429"""
+    if getattr(error, 'error_code', None) != 429:
+        return None
+    parameters = (getattr(error, 'result_json', None) or {}).get('parameters') or {}
+    return parameters.get('retry_after', 1)
+
+
+def _rewind(args, kwargs):
+    """Seek file arguments back to the start; the failed attempt read them to EOF"""
+    values = list(args) + list(kwargs.values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (list, tuple)):
+            values.extend(value)  # send_media_group
+        elif hasattr(value, 'media'):
+            values.append(value.media)  # InputMedia* for edit_message_media
+        elif callable(getattr(value, 'read', None)) and callable(getattr(value, 'seek', None)):
+            if getattr(value, 'seekable', lambda: True)():
+                value.seek(0)
+
+
+class RateLimitedBot:
+    """
+    Wraps a TeleBot so sends and edits go through an OutboundLimiter.
+
+    Everything else (handler registration, polling, callback answers) is
+    passed through to the wrapped bot unchanged.
+    """
+
+    def __init__(self, bot, limiter, max_retries=OUTBOUND_MAX_RETRIES):
+        self.wrapped = bot
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    def __getattr__(self, name):
+        attr = getattr(self.wrapped, name)
+        if name in LIMITED_METHODS:
+            return lambda *args, **kwargs: self._call(name, attr, args, kwargs)
+        return attr
+
+    def _call(self, name, method, args, kwargs):
+        chat_id = _chat_id(name, args, kwargs)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.wait(chat_id)
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                print(f"Telegram rate limit on {name}, retrying after {retry_after}s")
+                self.limiter.pause(retry_after)
+                _rewind(args, kwargs)
+
+    def reply_to(self, message, text, **kwargs):
+        # TeleBot.reply_to would call the unwrapped send_message
+        return self.send_message(message.chat.id, text, reply_to_message_id=message.message_id, **kwargs)
+
+
+class AsyncRateLimitedBot(RateLimitedBot):
+    """RateLimitedBot for an AsyncTeleBot"""
+
+    def __getattr__(self, name):
+        attr = getattr(self.wrapped, name)
+        if name in LIMITED_METHODS:
+            return lambda *args, **kwargs: self._call_async(name, attr, args, kwargs)
+        return attr
+
+    async def _call_async(self, name, method, args, kwargs):
+        chat_id = _chat_id(name, args, kwargs)
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.wait_async(chat_id)
+            try:
+                return await method(*args, **kwargs)
+            except Exception as e:
+                retry_after = _retry_after(e)
+                if retry_after is None or attempt == self.max_retries:
+                    raise
+                print(f"Telegram rate limit on {name}, retrying after {retry_after}s")
+                self.limiter.pause(retry_after)
+                _rewind(args, kwargs)
+
+    async def reply_to(self, message, text, **kwargs):
+        return await self.send_message(message.chat.id, text, reply_to_message_id=message.message_id, **kwargs)
@@ -0,0 +1,169 @@
+"""
+Reconciliation of pending payments with Cryptomus.
+
+Polling sessions live in memory, so after a restart pending invoices would
+otherwise never be looked at again. At startup and then on a timer, every
+pending record is matched against the merchant's payment history, fetched
+a page at a time from /payment/list, and the statuses found go through the
+normal provisioning path. Payments whose provisioning was interrupted are
+picked up again once PAYMENT_PROCESSING_TIMEOUT has passed. Invoices that
+are still payable are handed back to the polling scheduler for their
+remaining lifetime.
+
+Pending records created more than PAYMENT_LIFETIME +
+PAYMENT_RECONCILE_INTERVAL ago were left behind by earlier versions or a
+long outage. They are looked up once, in the first pass after startup,
+and expired without messaging the user when they are not found, so later
+passes neither page through weeks of history for them nor tell users about
+invoices from long ago.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from utils.client import (
+    payment_processor, get_payment_poller, process_payment_result,
+    normalize_payment_result, handle_payment_expired
+)
+from utils.payment_records import get_open_payments, transition_payment_status
+from utils.payments import PAYMENT_LIFETIME
+
+PAYMENT_RECONCILE_INTERVAL = int(os.getenv('PAYMENT_RECONCILE_INTERVAL', '600'))
+# A payment claimed for provisioning this long ago without finishing is retried
+PAYMENT_PROCESSING_TIMEOUT = int(os.getenv('PAYMENT_PROCESSING_TIMEOUT', '600'))
+RECONCILE_MAX_PAGES = 100
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Records and Cryptomus timestamps may be in different time zones
+DATE_MARGIN = timedelta(days=1)
+
+_reconcile_lock = threading.Lock()
+_stale_scanned = False  # Whether a pass has looked up the stale records since startup
+
+
+def _created_at(record):
+    try:
+        return datetime.strptime(record.get('created_at', ''), DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def fetch_payment_statuses(payment_ids, date_from):
+    """
+    Page through the payment history until every id is found.
+
+    Returns ({uuid: item}, pages, complete); complete is False when a page
+    could not be fetched, so missing ids say nothing about those payments.
+    """
+    wanted = set(payment_ids)
+    found = {}
+    cursor = None
+    pages = 0
+    while wanted and pages < RECONCILE_MAX_PAGES:
+        response = payment_processor.list_payments(date_from=date_from.strftime(DATE_FORMAT), cursor=cursor)
+        pages += 1
+        if "error" in response or 'result' not in response:
+            print(f"Error listing payments: {response.get('error', response)}")
+            return found, pages, False
+        for item in response['result'].get('items', []):
+            if item.get('uuid') in wanted:
+                wanted.discard(item['uuid'])
+                found[item['uuid']] = item
+        cursor = response['result'].get('paginate', {}).get('nextCursor')
+        if not cursor:
+            return found, pages, True
+    return found, pages, not wanted
+
+
+def reconcile_payments():
+    """Settle pending records from one pass over the payment history; returns a summary dict"""
+    global _stale_scanned
+    summary = {'pending': 0, 'pages': 0, 'settled': 0, 'expired': 0, 'resumed': 0}
+    if not _reconcile_lock.acquire(blocking=False):
+        return summary  # A pass is already running
+    try:
+        processing_before = datetime.now() - timedelta(seconds=PAYMENT_PROCESSING_TIMEOUT)
+        records = get_open_payments(processing_before.strftime(DATE_FORMAT))
+        released = set()
+        for payment_id, record in list(records.items()):
+            if record.get('status') != 'processing':
+                continue
+            # Provisioning was interrupted; release the claim so it runs again below
+            if transition_payment_status(payment_id, 'processing', 'pending'):
+                released.add(payment_id)
+            else:
+                del records[payment_id]
+        summary['pending'] = len(records)
+        if not records:
+            return summary
+
+        now = datetime.now()
+        created = {payment_id: _created_at(record) or now for payment_id, record in records.items()}
+        stale_before = now - timedelta(seconds=PAYMENT_LIFETIME + PAYMENT_RECONCILE_INTERVAL)
+        # Released claims were paid, so they are always looked up however old they are
+        stale = {
+            payment_id for payment_id in records
+            if created[payment_id] < stale_before and payment_id not in released
+        }
+        scan_stale = not _stale_scanned
+        lookup = [payment_id for payment_id in records if scan_stale or payment_id not in stale]
+        found, complete = {}, True
+        if lookup:
+            found, summary['pages'], complete = fetch_payment_statuses(
+                lookup, min(created[payment_id] for payment_id in lookup) - DATE_MARGIN
+            )
+        _stale_scanned = True  # One attempt per run; a failed one leaves them to be closed next pass
+
+        for payment_id, record in records.items():
+            try:
+                item = found.get(payment_id)
+                if item is not None and process_payment_result(
+                    payment_id, record['user_id'], record['plan_gb'], normalize_payment_result(item)
+                ):
+                    get_payment_poller().cancel(payment_id)
+                    summary['settled'] += 1
+                    continue
+
+                if payment_id in stale:
+                    if item is not None or (scan_stale and not complete):
+                        continue  # Found but not settled, or the lookup was cut short; next pass decides
+                    # Long past its lifetime and not in the history: close it without messaging the user
+                    get_payment_poller().cancel(payment_id)
+                    if transition_payment_status(payment_id, 'pending', 'expired'):
+                        summary['expired'] += 1
+                    continue
+
+                remaining = PAYMENT_LIFETIME - (now - created[payment_id]).total_seconds()
+                if remaining <= 0:
+                    if not complete or (item is not None and not item.get('is_final', True)):
+                        continue  # It may have been paid or still be confirming, look again next pass
+                    # Past its lifetime and not paid, it never will be
+                    get_payment_poller().cancel(payment_id)
+                    handle_payment_expired(payment_id, {'chat_id': record['user_id']})
+                    summary['expired'] += 1
+                elif not get_payment_poller().is_polling(payment_id):
+                    # Lost its polling session in a restart
+                    get_payment_poller().add(payment_id, record['user_id'], record['plan_gb'], remaining)
+                    summary['resumed'] += 1
+            except Exception as e:
+                print(f"Error reconciling payment {payment_id}: {str(e)}")
+        return summary
+    finally:
+        _reconcile_lock.release()
+
+
+def _reconcile_loop():
+    while True:
+        try:
+            summary = reconcile_payments()
+            if summary['pending']:
+                print(f"Payment reconciliation: {summary}")
+        except Exception as e:
+            print(f"Error reconciling payments: {str(e)}")
+        time.sleep(PAYMENT_RECONCILE_INTERVAL)
+
+
+def start_payment_reconciler():
+    """Reconcile now and then every PAYMENT_RECONCILE_INTERVAL seconds in the background"""
+    if PAYMENT_RECONCILE_INTERVAL <= 0:
+        return
+    threading.Thread(target=_reconcile_loop, name='payment-reconcile', daemon=True).start()
@@ -1,44 +1,252 @@
+"""
+Payment ledger.
+
+Records live in an SQLite database indexed by payment ID, user ID, status
+and creation time, so adding a payment or changing its status touches one
+row instead of rewriting every sale. Status history is kept in its own
+table. A payments.json written by earlier versions is imported once, the
+first time the database is created, and renamed to payments.json.imported.
+"""
 import json
 import os
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 
-PAYMENTS_FILE = '/etc/hysteria/core/scripts/telegrambot/payments.json'
+PAYMENTS_DB = '/etc/hysteria/core/scripts/telegrambot/payments.db'
+PAYMENTS_FILE = '/etc/hysteria/core/scripts/telegrambot/payments.json'  # Legacy ledger, imported once
 
-def load_payments():
+# Fields with their own column; anything else in a record is kept in `extra`
+_COLUMNS = ('user_id', 'plan_gb', 'amount', 'status', 'created_at', 'updated_at', 'payment_url', 'is_test')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payments (
+    payment_id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    plan_gb INTEGER,
+    amount REAL,
+    status TEXT,
+    created_at TEXT,
+    updated_at TEXT,
+    payment_url TEXT,
+    is_test INTEGER NOT NULL DEFAULT 0,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS payments_user_id ON payments (user_id);
+CREATE INDEX IF NOT EXISTS payments_status ON payments (status);
+CREATE INDEX IF NOT EXISTS payments_created_at ON payments (created_at);
+CREATE TABLE IF NOT EXISTS payment_updates (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payment_id TEXT NOT NULL,
+    status TEXT,
+    previous_status TEXT,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS payment_updates_payment_id ON payment_updates (payment_id);
+"""
+
+_lock = threading.RLock()
+_conn = None
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _db():
+    """Shared connection, created (and the legacy JSON imported) on first use"""
+    global _conn
+    with _lock:
+        if _conn is None:
+            os.makedirs(os.path.dirname(PAYMENTS_DB), exist_ok=True)
+            conn = sqlite3.connect(PAYMENTS_DB, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+                try:
+                    _import_json(conn, PAYMENTS_FILE)
+                except Exception:
+                    conn.close()  # Not marked as imported, so the next call tries again
+                    raise
+            _conn = conn
+        return _conn
+
+
+@contextmanager
+def _transaction(conn, mode=''):
+    conn.execute(f"BEGIN {mode}")
     try:
-        if os.path.exists(PAYMENTS_FILE):
-            with open(PAYMENTS_FILE, 'r') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {}
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def _import_json(conn, path):
+    """
+    Import the legacy ledger and mark the database as imported.
+
+    A file that exists but cannot be read raises, rather than being
+    skipped for good; single records that cannot be written are logged
+    and left out.
+    """
+    payments = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r') as f:
+                payments = json.load(f)
+            if not isinstance(payments, dict):
+                raise ValueError("expected an object of payment records")
+        except Exception as e:
+            raise RuntimeError(f"Cannot import the legacy payment ledger {path}: {str(e)}") from e
+
+    skipped = 0
+    with _transaction(conn):
+        for payment_id, record in payments.items():
+            conn.execute("SAVEPOINT record")
+            try:
+                _write_record(conn, payment_id, record)
+            except Exception as e:
+                conn.execute("ROLLBACK TO record")
+                skipped += 1
+                print(f"Error importing payment record {payment_id}: {str(e)}")
+            conn.execute("RELEASE record")
+        conn.execute("PRAGMA user_version = 1")
+
+    if payments:
+        print(f"Imported {len(payments) - skipped} payment records from {path}, skipped {skipped}")
+    if os.path.exists(path):
+        try:
+            os.replace(path, path + '.imported')
+        except OSError as e:
+            print(f"Error renaming {path} after import: {str(e)}")
+
+
+def _write_record(conn, payment_id, data):
+    """Insert or replace one record, including its status history"""
+    row = {column: data.get(column) for column in _COLUMNS}
+    row['is_test'] = 1 if data.get('is_test') else 0
+    extra = {key: value for key, value in data.items() if key not in _COLUMNS and key != 'updates'}
+    conn.execute(
+        "INSERT OR REPLACE INTO payments (payment_id, user_id, plan_gb, amount, status, created_at, "
+        "updated_at, payment_url, is_test, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (payment_id, *(row[column] for column in _COLUMNS), json.dumps(extra))
+    )
+    conn.execute("DELETE FROM payment_updates WHERE payment_id = ?", (payment_id,))
+    conn.executemany(
+        "INSERT INTO payment_updates (payment_id, status, previous_status, timestamp) VALUES (?, ?, ?, ?)",
+        [
+            (payment_id, update.get('status'), update.get('previous_status'), update.get('timestamp'))
+            for update in data.get('updates', [])
+        ]
+    )
+
+
+def _to_record(conn, row, with_updates=True):
+    record = json.loads(row['extra'])
+    for column in _COLUMNS:
+        if row[column] is not None:
+            record[column] = row[column]
+    record['is_test'] = bool(row['is_test'])
+    if not record['is_test']:
+        del record['is_test']  # Only test mode records carried the flag before
+    if with_updates:
+        record['updates'] = [
+            {'status': update['status'], 'timestamp': update['timestamp'], 'previous_status': update['previous_status']}
+            for update in conn.execute(
+                "SELECT status, timestamp, previous_status FROM payment_updates WHERE payment_id = ? ORDER BY id",
+                (row['payment_id'],)
+            )
+        ]
+    return record
+
+
+def load_payments():
+    """Every record as {payment_id: record}; prefer the targeted queries below"""
+    with _lock:
+        conn = _db()
+        rows = conn.execute("SELECT * FROM payments ORDER BY created_at").fetchall()
+        return {row['payment_id']: _to_record(conn, row) for row in rows}
+
 
 def save_payments(payments):
-    os.makedirs(os.path.dirname(PAYMENTS_FILE), exist_ok=True)
-    with open(PAYMENTS_FILE, 'w') as f:
-        json.dump(payments, f, indent=4)
+    with _lock, _transaction(_db()) as conn:
+        for payment_id, record in payments.items():
+            _write_record(conn, payment_id, record)
+
 
 def add_payment_record(payment_id, data):
-    payments = load_payments()
-    data['created_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    data['created_at'] = _now()
     data['updates'] = []  # Add history tracking
-    payments[payment_id] = data
-    save_payments(payments)
+    with _lock, _transaction(_db()) as conn:
+        _write_record(conn, payment_id, data)
+
+
+def get_payment_record(payment_id):
+    with _lock:
+        conn = _db()
+        row = conn.execute("SELECT * FROM payments WHERE payment_id = ?", (payment_id,)).fetchone()
+        return _to_record(conn, row) if row is not None else None
+
+
+def get_user_payments(user_id):
+    """Records of one Telegram user, newest first"""
+    with _lock:
+        conn = _db()
+        rows = conn.execute(
+            "SELECT * FROM payments WHERE user_id = ? ORDER BY created_at DESC", (user_id,)
+        ).fetchall()
+        return {row['payment_id']: _to_record(conn, row) for row in rows}
+
+
+def get_open_payments(processing_before=None):
+    """
+    Real (non test mode) payments still waiting for a final status.
+
+    With processing_before (a '%Y-%m-%d %H:%M:%S' timestamp), payments whose
+    provisioning claim has not changed since then are included too, so a
+    claim left behind by a crash is not stuck forever.
+    """
+    with _lock:
+        conn = _db()
+        rows = conn.execute(
+            "SELECT * FROM payments WHERE is_test = 0 AND "
+            "(status = 'pending' OR (status = 'processing' AND updated_at < ?)) ORDER BY created_at",
+            (processing_before or '',)
+        ).fetchall()
+        return {row['payment_id']: _to_record(conn, row, with_updates=False) for row in rows}
+
 
 def update_payment_status(payment_id, status):
-    payments = load_payments()
-    if payment_id in payments:
-        current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        
+    transition_payment_status(payment_id, None, status)
+
+
+def transition_payment_status(payment_id, expected, status):
+    """
+    Set status only if the payment is currently in one of the expected statuses.
+
+    Returns True when this call made the change, so of several sources
+    reporting the same payment (polling, webhook) only one acts on it.
+    expected=None changes the status whatever it is.
+    """
+    if isinstance(expected, str):
+        expected = (expected,)
+    current_time = _now()
+    with _lock, _transaction(_db(), 'IMMEDIATE') as conn:
+        row = conn.execute("SELECT status FROM payments WHERE payment_id = ?", (payment_id,)).fetchone()
+        if row is None or (expected is not None and row['status'] not in expected):
+            return False
+        conn.execute(
+            "UPDATE payments SET status = ?, updated_at = ? WHERE payment_id = ?",
+            (status, current_time, payment_id)
+        )
         # Add update to history
-        update = {
-            'status': status,
-            'timestamp': current_time,
-            'previous_status': payments[payment_id].get('status', 'unknown')
-        }
-        
-        payments[payment_id]['status'] = status
-        payments[payment_id]['updated_at'] = current_time
-        payments[payment_id]['updates'].append(update)
-        
-        save_payments(payments) 
+        conn.execute(
+            "INSERT INTO payment_updates (payment_id, status, previous_status, timestamp) VALUES (?, ?, ?, ?)",
+            (payment_id, status, row['status'] or 'unknown', current_time)
+        )
+        return True
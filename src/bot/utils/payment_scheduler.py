@@ -0,0 +1,182 @@
+"""
+Central polling of pending Cryptomus invoices.
+
+One scheduler thread keeps pending payments in a heap ordered by their next
+check time and hands due checks to a small pool, so the number of threads
+and concurrent Cryptomus requests stays fixed however many invoices are
+open. Each payment is checked with a growing interval and dropped once its
+invoice lifetime has passed.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+PAYMENT_POLL_CONCURRENCY = int(os.getenv('PAYMENT_POLL_CONCURRENCY', '4'))
+PAYMENT_POLL_INTERVAL = float(os.getenv('PAYMENT_POLL_INTERVAL', '15'))
+PAYMENT_POLL_BACKOFF = float(os.getenv('PAYMENT_POLL_BACKOFF', '1.5'))
+PAYMENT_POLL_MAX_INTERVAL = float(os.getenv('PAYMENT_POLL_MAX_INTERVAL', '60'))
+# Used instead when the webhook delivers status changes
+PAYMENT_FALLBACK_POLL_INTERVAL = float(os.getenv('PAYMENT_FALLBACK_POLL_INTERVAL', '300'))
+PAYMENT_SESSION_LIMIT = 10000
+PAYMENT_SESSION_GRACE = 300  # Keep finished-polling sessions around a little past their invoice
+# A payment whose check or handler keeps raising is left to reconciliation after this many errors
+PAYMENT_POLL_MAX_ERRORS = 5
+
+
+class PaymentSessions:
+    """payment_id -> session dict, bounded in size and evicted after a TTL"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()  # payment_id -> (expires_at, session)
+
+    def _evict(self, now):
+        # Called with the lock held; entries are in insertion order, so expired ones lead
+        while self._sessions:
+            payment_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now and len(self._sessions) <= self.max_size:
+                break
+            del self._sessions[payment_id]
+            if expires_at > now:
+                print(f"Payment session limit reached, dropped {payment_id}")
+
+    def add(self, payment_id, session):
+        now = time.monotonic()
+        with self._lock:
+            self._sessions.pop(payment_id, None)
+            self._sessions[payment_id] = (now + self.ttl, session)
+            self._evict(now)
+
+    def get(self, payment_id):
+        with self._lock:
+            item = self._sessions.get(payment_id)
+            if item is None or item[0] <= time.monotonic():
+                return None
+            return item[1]
+
+    def pop(self, payment_id):
+        with self._lock:
+            item = self._sessions.pop(payment_id, None)
+            if item is None or item[0] <= time.monotonic():
+                return None
+            return item[1]
+
+    def __contains__(self, payment_id):
+        return self.get(payment_id) is not None
+
+    def __len__(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return len(self._sessions)
+
+
+class PaymentScheduler:
+    """
+    Poll pending payments until they resolve or their invoice expires.
+
+    check_status(payment_id) returns the Cryptomus response.
+    handle_status(payment_id, session, status) acts on it and returns True
+    once the payment needs no more polling. handle_expired(payment_id,
+    session) runs when the invoice lifetime passes while still pending.
+    A handler may raise after it has already told the user something, so
+    a payment that errors PAYMENT_POLL_MAX_ERRORS times, or errors when its
+    lifetime is up, stops being polled instead of being expired.
+    """
+
+    def __init__(self, check_status, handle_status, handle_expired, lifetime, concurrency=PAYMENT_POLL_CONCURRENCY,
+                 interval=PAYMENT_POLL_INTERVAL, backoff=PAYMENT_POLL_BACKOFF, max_interval=PAYMENT_POLL_MAX_INTERVAL):
+        self.check_status = check_status
+        self.handle_status = handle_status
+        self.handle_expired = handle_expired
+        self.lifetime = lifetime
+        self.concurrency = concurrency
+        self.interval = interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        self.sessions = PaymentSessions(PAYMENT_SESSION_LIMIT, lifetime + PAYMENT_SESSION_GRACE)
+        self._heap = []  # (due, seq, payment_id)
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition()
+        self._pool = None
+        self._thread = None
+
+    def start(self):
+        with self._wakeup:
+            if self._thread is not None:
+                return
+            self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='payment-poll')
+            self._thread = threading.Thread(target=self._run, name='payment-scheduler', daemon=True)
+            self._thread.start()
+
+    def add(self, payment_id, chat_id, plan_gb, lifetime=None):
+        """Start polling an invoice; lifetime is what remains of it, the full lifetime by default"""
+        now = time.monotonic()
+        self.sessions.add(payment_id, {
+            'chat_id': chat_id,
+            'plan_gb': plan_gb,
+            'expires_at': now + (self.lifetime if lifetime is None else lifetime),
+            'interval': self.interval,
+            'errors': 0
+        })
+        self.start()
+        self._schedule(payment_id, now + self.interval)
+
+    def cancel(self, payment_id):
+        """Stop polling a payment, e.g. when it was settled some other way"""
+        return self.sessions.pop(payment_id)
+
+    def is_polling(self, payment_id):
+        """Whether payment_id has a session, including one that stopped after errors"""
+        return payment_id in self.sessions
+
+    def pending(self):
+        return len(self.sessions)
+
+    def _schedule(self, payment_id, due):
+        with self._wakeup:
+            heapq.heappush(self._heap, (due, next(self._seq), payment_id))
+            self._wakeup.notify()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._wakeup.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, payment_id = heapq.heappop(self._heap)
+            # Cancelled and finished payments leave stale heap entries behind
+            if payment_id in self.sessions:
+                self._pool.submit(self._poll, payment_id)
+
+    def _poll(self, payment_id):
+        session = self.sessions.get(payment_id)
+        if session is None:
+            return
+        try:
+            status = self.check_status(payment_id)
+            if self.handle_status(payment_id, session, status):
+                self.sessions.pop(payment_id)
+                return
+        except Exception as e:
+            print(f"Error polling payment {payment_id}: {str(e)}")
+            session['errors'] += 1
+            if session['errors'] >= PAYMENT_POLL_MAX_ERRORS or time.monotonic() >= session['expires_at']:
+                # Stop scheduling it but keep the session, so reconciliation settles or expires
+                # the record from Cryptomus' history instead of handing it back to the poller
+                print(f"Stopped polling payment {payment_id} after {session['errors']} errors")
+                return
+
+        if time.monotonic() >= session['expires_at']:
+            # The invoice can no longer be paid, no need to wait for Cryptomus to say so
+            if self.sessions.pop(payment_id) is not None:
+                self.handle_expired(payment_id, session)
+            return
+
+        # Still pending: back off, but always get one last look at the expiry time
+        session['interval'] = min(session['interval'] * self.backoff, self.max_interval)
+        self._schedule(payment_id, min(time.monotonic() + session['interval'], session['expires_at']))
@@ -0,0 +1,110 @@
+"""
+Embedded HTTP endpoint for Cryptomus payment notifications.
+
+Cryptomus posts a signed JSON body to the invoice's url_callback whenever
+its status changes. Verified notifications are handed to a small pool so
+the request is acknowledged immediately; repeats of a notification that
+was already accepted are acknowledged without being processed again.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+PAYMENT_WEBHOOK_URL = os.getenv('PAYMENT_WEBHOOK_URL')
+PAYMENT_WEBHOOK_HOST = os.getenv('PAYMENT_WEBHOOK_HOST', '0.0.0.0')
+PAYMENT_WEBHOOK_PORT = int(os.getenv('PAYMENT_WEBHOOK_PORT', '8089'))
+MAX_BODY_SIZE = 64 * 1024
+SEEN_LIMIT = 4096
+
+
+class PaymentWebhookServer:
+    """
+    verify(data) checks the signature of a decoded notification and
+    handle(data) processes it; both are supplied by the payment code.
+    """
+
+    def __init__(self, host, port, path, verify, handle, workers=2):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.verify = verify
+        self.handle = handle
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payment-webhook')
+        self._seen = OrderedDict()
+        self._seen_lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                webhook._receive(self)
+
+            def log_message(self, format, *args):
+                pass  # Cryptomus retries are noisy, errors are printed by _receive
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='payment-webhook-server', daemon=True).start()
+        print(f"Payment webhook listening on {self.host}:{self.port}{self.path}")
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _first_time(self, key):
+        with self._seen_lock:
+            if key in self._seen:
+                return False
+            self._seen[key] = True
+            while len(self._seen) > SEEN_LIMIT:
+                self._seen.popitem(last=False)
+            return True
+
+    def _reply(self, request, code, text):
+        body = text.encode('utf-8')
+        request.send_response(code)
+        request.send_header('Content-Type', 'text/plain')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _receive(self, request):
+        if urlparse(request.path).path != self.path:
+            self._reply(request, 404, 'not found')
+            return
+        try:
+            length = int(request.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length <= 0 or length > MAX_BODY_SIZE:
+            self._reply(request, 400, 'bad request')
+            return
+        try:
+            data = json.loads(request.rfile.read(length))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            self._reply(request, 400, 'bad request')
+            return
+
+        if not self.verify(data):
+            print(f"Rejected payment webhook with a bad signature from {request.client_address[0]}")
+            self._reply(request, 403, 'invalid sign')
+            return
+
+        # Cryptomus resends until it gets a 200, the same notification is processed once
+        if self._first_time((data.get('uuid'), data.get('status'), data.get('sign'))):
+            self._pool.submit(self._process, data)
+        self._reply(request, 200, 'ok')
+
+    def _process(self, data):
+        try:
+            self.handle(data)
+        except Exception as e:
+            print(f"Error processing payment webhook for {data.get('uuid')}: {str(e)}")
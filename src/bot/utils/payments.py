@@ -1,54 +1,91 @@
 import base64
+import hmac
 import json
+import sys
 import uuid
 from hashlib import md5
-import requests
 import os
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../../..')))
+from src.api.http_session import get_session, IDEMPOTENT_METHODS
+
 load_dotenv()
 
+PAYMENT_LIFETIME = 3600  # Seconds an invoice stays payable
+
 class CryptomusPayment:
     def __init__(self):
         self.merchant_id = os.getenv('CRYPTOMUS_MERCHANT_ID')
         self.payment_api_key = os.getenv('CRYPTOMUS_API_KEY')
         self.base_url = "https://api.cryptomus.com/v1"
+        self.webhook_url = os.getenv('PAYMENT_WEBHOOK_URL')
+        # Creating an invoice is only retried when the request never reached Cryptomus;
+        # the read-only endpoints are POSTs too and are retried like GETs
+        self.session = get_session('cryptomus')
+        self.query_session = get_session('cryptomus-query', IDEMPOTENT_METHODS | {'POST'})
 
     def _check_credentials(self):
         if not self.merchant_id or not self.payment_api_key:
             return False
         return True
 
-    def _generate_sign(self, payload):
-        encoded_data = base64.b64encode(
-            json.dumps(payload).encode("utf-8")
-        ).decode("utf-8")
+    def _sign_text(self, text):
+        encoded_data = base64.b64encode(text.encode("utf-8")).decode("utf-8")
         return md5(f"{encoded_data}{self.payment_api_key}".encode("utf-8")).hexdigest()
 
-    def create_payment(self, amount, plan_gb):
-        if not self._check_credentials():
-            return {"error": "Payment credentials not configured"}
+    def _generate_sign(self, payload):
+        return self._sign_text(json.dumps(payload))
+
+    def verify_webhook(self, data):
+        """
+        Check the sign field of a webhook notification.
+
+        Cryptomus signs the body as PHP's json_encode writes it (compact,
+        unescaped unicode, escaped slashes); the _generate_sign encoding is
+        accepted as well.
+        """
+        if not self._check_credentials() or not isinstance(data, dict):
+            return False
+        sign = data.get('sign')
+        if not isinstance(sign, str):
+            return False
+        unsigned = {key: value for key, value in data.items() if key != 'sign'}
+        candidates = (
+            json.dumps(unsigned, ensure_ascii=False, separators=(',', ':')).replace('/', '\\/'),
+            json.dumps(unsigned)
+        )
+        return any(hmac.compare_digest(self._sign_text(text), sign) for text in candidates)
 
+    def _invoice_payload(self, amount, plan_gb):
         payment_id = str(uuid.uuid4())
         payload = {
             "amount": str(amount),
             "currency": "USD",
             "order_id": payment_id,
             "is_payment_multiple": False,
-            "lifetime": 3600,
+            "lifetime": PAYMENT_LIFETIME,
             "additional_data": json.dumps({
                 "plan_gb": plan_gb,
                 "payment_id": payment_id
             })
         }
+        if self.webhook_url:
+            payload["url_callback"] = self.webhook_url
+        return payload
 
+    def create_payment(self, amount, plan_gb):
+        if not self._check_credentials():
+            return {"error": "Payment credentials not configured"}
+
+        payload = self._invoice_payload(amount, plan_gb)
         try:
             headers = {
                 "merchant": self.merchant_id,
                 "sign": self._generate_sign(payload)
             }
 
-            response = requests.post(
+            response = self.session.post(
                 f"{self.base_url}/payment",
                 json=payload,
                 headers=headers
@@ -74,7 +111,7 @@ class CryptomusPayment:
                 "sign": self._generate_sign(payload)
             }
 
-            response = requests.post(
+            response = self.query_session.post(
                 f"{self.base_url}/payment/info",
                 json=payload,
                 headers=headers
@@ -85,3 +122,33 @@ class CryptomusPayment:
             return {"error": f"API Error: {response.text}"}
         except Exception as e:
             return {"error": f"Request Error: {str(e)}"} 
+
+    def list_payments(self, date_from=None, date_to=None, cursor=None):
+        """One page of the merchant's payment history, newest first"""
+        if not self._check_credentials():
+            return {"error": "Payment credentials not configured"}
+
+        payload = {}
+        if date_from:
+            payload["date_from"] = date_from
+        if date_to:
+            payload["date_to"] = date_to
+
+        try:
+            headers = {
+                "merchant": self.merchant_id,
+                "sign": self._generate_sign(payload)
+            }
+
+            response = self.query_session.post(
+                f"{self.base_url}/payment/list",
+                params={"cursor": cursor} if cursor else None,
+                json=payload,
+                headers=headers
+            )
+
+            if response.status_code == 200:
+                return response.json()
+            return {"error": f"API Error: {response.text}"}
+        except Exception as e:
+            return {"error": f"Request Error: {str(e)}"}
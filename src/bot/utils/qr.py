@@ -0,0 +1,262 @@
+"""
+QR code rendering and sending.
+
+Rendered PNGs are kept in an LRU cache keyed by the encoded text, and the
+Telegram file_id returned by the first upload of each code is remembered
+on disk so later sends reference it instead of uploading the image again.
+File ids are tagged with the config they belong to and dropped when that
+user is removed or gets a new password or name.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+from functools import lru_cache
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+from utils.command import bot, on_user_write, cli_option
+from utils.qr_render import qr_render_service
+
+QR_FILE_IDS_FILE = '/etc/hysteria/core/scripts/telegrambot/qr_file_ids.jsonl'
+QR_CACHE_SIZE = 512
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr(data):
+    """Return the PNG bytes of a QR code for data"""
+    return qr_render_service.render(data)
+
+
+def qr_key(data):
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class FileIdStore:
+    """
+    QR hash -> Telegram file_id, persisted as an append-only JSON lines file.
+
+    The log is rewritten with only the live entries when it is loaded and
+    whenever its superseded lines outnumber them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._owners = {}  # owner -> keys of its file ids
+        self._lines = 0
+        self._file_ids = self._load()
+        if self._lines > len(self._file_ids):
+            with self._lock:
+                self._compact()
+
+    def _load(self):
+        file_ids = {}
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue  # Torn last line after a crash
+                        self._lines += 1
+                        if entry.get('file_id'):
+                            file_ids[entry['key']] = (entry['file_id'], entry.get('owner'))
+                        else:
+                            file_ids.pop(entry.get('key'), None)
+        except Exception as e:
+            print(f"Error loading QR file ids: {str(e)}")
+        for key, (_, owner) in file_ids.items():
+            if owner:
+                self._owners.setdefault(owner, set()).add(key)
+        return file_ids
+
+    def _append(self, entry):
+        # Called with the lock held
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+            self._lines += 1
+        except Exception as e:
+            print(f"Error saving QR file id: {str(e)}")
+            return
+        if self._lines > 2 * len(self._file_ids):
+            self._compact()
+
+    def _compact(self):
+        # Called with the lock held
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                for key, (file_id, owner) in self._file_ids.items():
+                    f.write(json.dumps({'key': key, 'file_id': file_id, 'owner': owner}) + '\n')
+            os.replace(tmp_path, self.path)
+            self._lines = len(self._file_ids)
+        except Exception as e:
+            print(f"Error compacting QR file ids: {str(e)}")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._file_ids.get(key)
+            return entry[0] if entry else None
+
+    def put(self, key, file_id, owner=None):
+        with self._lock:
+            if self._file_ids.get(key) == (file_id, owner):
+                return
+            self._file_ids[key] = (file_id, owner)
+            if owner:
+                self._owners.setdefault(owner, set()).add(key)
+            self._append({'key': key, 'file_id': file_id, 'owner': owner})
+
+    def discard(self, key):
+        with self._lock:
+            entry = self._file_ids.pop(key, None)
+            if entry is None:
+                return
+            keys = self._owners.get(entry[1])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._owners[entry[1]]
+            self._append({'key': key, 'file_id': None})
+
+    def discard_owner(self, owner):
+        """Drop every file id of one config"""
+        with self._lock:
+            keys = self._owners.pop(owner, set())
+            for key in keys:
+                if self._file_ids.pop(key, None) is not None:
+                    self._append({'key': key, 'file_id': None})
+
+
+qr_file_ids = FileIdStore(QR_FILE_IDS_FILE)
+
+
+@on_user_write
+def _discard_on_write(args, ok):
+    # Their URIs no longer work, so neither do the QR codes uploaded for them
+    command, username = args[0], cli_option(args, '-u')
+    if not username:
+        return
+    if command in ('remove-user', 'reset-user') or (command == 'edit-user' and ('-rp' in args or '-nu' in args)):
+        qr_file_ids.discard_owner(username)
+
+# Telegram descriptions of a 400 caused by the file_id itself, e.g. "wrong file
+# identifier/HTTP URL specified" or "FILE_REFERENCE_EXPIRED"
+STALE_FILE_ID_ERRORS = ('file identifier', 'file reference', 'file_reference')
+
+
+def _stale_file_id(error):
+    """Whether a Bot API error means the cached file_id is no longer accepted"""
+    description = (error.description or '').lower()
+    return error.error_code == 400 and any(marker in description for marker in STALE_FILE_ID_ERRORS)
+
+
+def send_qr_photo(chat_id, data, owner=None, **kwargs):
+    """
+    send_photo with a QR code for data, reusing an earlier upload when possible.
+
+    owner is the username the code belongs to; its upload is forgotten once
+    that user is removed or its URI changes.
+    """
+    key = qr_key(data)
+    file_id = qr_file_ids.get(key)
+    if file_id:
+        try:
+            return bot.send_photo(chat_id, file_id, **kwargs)
+        except ApiTelegramException as e:
+            if not _stale_file_id(e):
+                raise
+            # The stored file_id is no longer accepted, upload again
+            qr_file_ids.discard(key)
+
+    bio = io.BytesIO(render_qr(data))
+    bio.name = 'qr.png'
+    message = bot.send_photo(chat_id, bio, **kwargs)
+    if message is not None and message.photo:
+        qr_file_ids.put(key, message.photo[-1].file_id, owner)
+    return message
+
+
+def edit_qr_photo(chat_id, message_id, data, caption=None, parse_mode=None, reply_markup=None, owner=None):
+    """Swap the photo of an existing message for a QR code of data, reusing uploads like send_qr_photo"""
+    key = qr_key(data)
+    file_id = qr_file_ids.get(key)
+    if file_id:
+        try:
+            return bot.edit_message_media(
+                types.InputMediaPhoto(file_id, caption=caption, parse_mode=parse_mode),
+                chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+            )
+        except ApiTelegramException as e:
+            if not _stale_file_id(e):
+                raise
+            qr_file_ids.discard(key)
+
+    bio = io.BytesIO(render_qr(data))
+    bio.name = 'qr.png'
+    message = bot.edit_message_media(
+        types.InputMediaPhoto(bio, caption=caption, parse_mode=parse_mode),
+        chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+    )
+    if isinstance(message, types.Message) and message.photo:
+        qr_file_ids.put(key, message.photo[-1].file_id, owner)
+    return message
+
+
+async def _render_qr_file(data):
+    # Rendering is CPU work for the render pool, keep it off the event loop
+    bio = io.BytesIO(await asyncio.get_running_loop().run_in_executor(None, render_qr, data))
+    bio.name = 'qr.png'
+    return bio
+
+
+async def send_qr_photo_async(async_bot, chat_id, data, owner=None, **kwargs):
+    """send_qr_photo for an AsyncTeleBot"""
+    from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException  # Needs aiohttp
+
+    key = qr_key(data)
+    file_id = qr_file_ids.get(key)
+    if file_id:
+        try:
+            return await async_bot.send_photo(chat_id, file_id, **kwargs)
+        except AsyncApiTelegramException as e:
+            if not _stale_file_id(e):
+                raise
+            qr_file_ids.discard(key)
+
+    message = await async_bot.send_photo(chat_id, await _render_qr_file(data), **kwargs)
+    if message is not None and message.photo:
+        qr_file_ids.put(key, message.photo[-1].file_id, owner)
+    return message
+
+
+async def edit_qr_photo_async(async_bot, chat_id, message_id, data, caption=None, parse_mode=None, reply_markup=None,
+                              owner=None):
+    """edit_qr_photo for an AsyncTeleBot"""
+    from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException  # Needs aiohttp
+
+    key = qr_key(data)
+    file_id = qr_file_ids.get(key)
+    if file_id:
+        try:
+            return await async_bot.edit_message_media(
+                types.InputMediaPhoto(file_id, caption=caption, parse_mode=parse_mode),
+                chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+            )
+        except AsyncApiTelegramException as e:
+            if not _stale_file_id(e):
+                raise
+            qr_file_ids.discard(key)
+
+    message = await async_bot.edit_message_media(
+        types.InputMediaPhoto(await _render_qr_file(data), caption=caption, parse_mode=parse_mode),
+        chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+    )
+    if isinstance(message, types.Message) and message.photo:
+        qr_file_ids.put(key, message.photo[-1].file_id, owner)
+    return message
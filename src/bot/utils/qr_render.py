@@ -0,0 +1,109 @@
+"""
+QR code rendering backends and the process pool that runs them.
+
+Rendering is CPU-bound pure Python, so it runs in worker processes to keep
+it from holding the GIL while handler threads serve other chats. Images
+are 1-bit PNGs with a smaller module size and low error correction, which
+is plenty for a code shown on a screen and cuts both render time and
+upload size. segno is used when installed; it encodes the same data at
+the same error correction level and writes smaller PNGs than qrcode.
+"""
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import qrcode
+
+try:
+    import segno
+except ImportError:
+    segno = None
+
+QR_BACKEND = os.getenv('QR_BACKEND', 'auto')  # auto, segno or qrcode
+QR_WORKERS = int(os.getenv('QR_WORKERS', '2'))  # 0 renders in the calling thread
+QR_ERROR_CORRECTION = os.getenv('QR_ERROR_CORRECTION', 'L')
+QR_BOX_SIZE = int(os.getenv('QR_BOX_SIZE', '8'))
+QR_BORDER = 4  # Quiet zone required by the QR spec
+QR_RENDER_TIMEOUT = 10
+
+_QRCODE_ERROR_LEVELS = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+
+def resolve_backend(backend=QR_BACKEND):
+    if backend == 'auto':
+        return 'segno' if segno is not None else 'qrcode'
+    if backend == 'segno' and segno is None:
+        print("QR_BACKEND=segno but segno is not installed, using qrcode")
+        return 'qrcode'
+    return backend
+
+
+def render_png(data, backend='qrcode', error=QR_ERROR_CORRECTION, box_size=QR_BOX_SIZE, border=QR_BORDER):
+    """Render data as a 1-bit PNG and return the bytes"""
+    bio = io.BytesIO()
+    if backend == 'segno':
+        segno.make_qr(data, error=error.lower(), boost_error=False).save(
+            bio, kind='png', scale=box_size, border=border
+        )
+    else:
+        qr = qrcode.QRCode(
+            error_correction=_QRCODE_ERROR_LEVELS[error.upper()],
+            box_size=box_size,
+            border=border
+        )
+        qr.add_data(data)
+        qr.make(fit=True)
+        # PilImage renders mode "1", so this is already a 1-bit PNG
+        qr.make_image().save(bio, 'PNG', optimize=True)
+    return bio.getvalue()
+
+
+class QrRenderService:
+    def __init__(self, workers, backend):
+        self.workers = workers
+        self.backend = resolve_backend(backend)
+        self._pool = None
+
+    def start(self):
+        """
+        Fork the render processes.
+
+        tbot calls this before anything constructs the TeleBot, whose worker
+        threads would otherwise be running (and maybe holding locks) at fork.
+        """
+        if self.workers <= 0 or self._pool is not None:
+            return
+        if threading.active_count() > 1:
+            print("Warning: forking QR render workers while other threads are running")
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('fork')
+        )
+        # With fork every worker is created on the first submit, i.e. right here
+        self._pool.submit(render_png, 'warmup', self.backend).result()
+
+    def render(self, data):
+        if self._pool is not None:
+            try:
+                return self._pool.submit(render_png, data, self.backend).result(QR_RENDER_TIMEOUT)
+            except BrokenProcessPool as e:
+                print(f"QR render pool died, rendering inline from now on: {str(e)}")
+                self._pool = None
+            except Exception as e:
+                print(f"QR render pool failed, rendering inline: {str(e)}")
+        return render_png(data, self.backend)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+qr_render_service = QrRenderService(QR_WORKERS, QR_BACKEND)
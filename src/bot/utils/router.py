@@ -0,0 +1,54 @@
+"""
+Exact-text message routing.
+
+Nearly every handler is "this role pressed the button with this label". The
+router keeps those in a dict keyed by label, so a message is matched with
+one lookup and one admin check. telebot evaluates handlers one after
+another, so this one handler has to be registered first. Handlers that need
+anything more than an exact label are still registered with telebot and
+are evaluated after the router.
+"""
+
+ADMIN = 'admin'
+CLIENT = 'client'
+ANY = 'any'
+
+
+class MessageRouter:
+    def __init__(self, is_admin):
+        self.is_admin = is_admin
+        self._routes = {}  # text -> {role: handler}
+
+    def add(self, text, handler, role=ANY):
+        routes = self._routes.setdefault(text, {})
+        if role in routes:
+            raise ValueError(f"{role} handler for {text!r} registered twice")
+        routes[role] = handler
+
+    def text(self, text, role=ANY):
+        """Decorator registering handler(message) for messages whose text is exactly `text`"""
+        def decorator(handler):
+            self.add(text, handler, role)
+            return handler
+        return decorator
+
+    def resolve(self, message):
+        """The handler for message, or None to leave it to the other telebot handlers"""
+        routes = self._routes.get(message.text)
+        if routes is None:
+            return None
+        if self.is_admin(message.from_user.id):
+            return routes.get(ADMIN) or routes.get(ANY)
+        return routes.get(CLIENT) or routes.get(ANY)
+
+    def dispatch(self, message):
+        handler = self.resolve(message)
+        if handler is not None:
+            handler(message)
+
+    def attach(self, bot):
+        """Register the router as a telebot message handler; call before any other registration"""
+        bot.register_message_handler(
+            self.dispatch,
+            func=lambda message: self.resolve(message) is not None
+        )
@@ -1,34 +1,48 @@
 from telebot import types
 from utils.command import *
+from utils.user_directory import get_users
+from utils.user_search import user_search_index
+
+# Telegram accepts at most 50 results per inline answer
+INLINE_PAGE_SIZE = 50
 
 
 @bot.inline_handler(lambda query: is_admin(query.from_user.id))
 def handle_inline_query(query):
-    command = f"python3 {CLI_PATH} list-users"
-    result = run_cli_command(command)
     try:
-        users = json.loads(result)
+        users = get_users()
     except json.JSONDecodeError:
         bot.answer_inline_query(query.id, results=[], switch_pm_text="Error retrieving users.", switch_pm_user_id=query.from_user.id)
         return
 
-    query_text = query.query.lower()
+    try:
+        offset = int(query.offset or 0)
+    except ValueError:
+        offset = 0
+
+    usernames, has_more = user_search_index.search(users, query.query, offset, INLINE_PAGE_SIZE)
     results = []
-    for username, details in users.items():
-        if query_text in username.lower():
-            title = f"{username}"
-            description = f"Traffic Limit: {details['max_download_bytes'] / (1024 ** 3):.2f} GB, Expiration Days: {details['expiration_days']}"
-            results.append(types.InlineQueryResultArticle(
-                id=username,
-                title=title,
-                description=description,
-                input_message_content=types.InputTextMessageContent(
-                    message_text=f"Name: {username}\n"
-                                 f"Traffic limit: {details['max_download_bytes'] / (1024 ** 3):.2f} GB\n"
-                                 f"Days: {details['expiration_days']}\n"
-                                 f"Account Creation: {details['account_creation_date']}\n"
-                                 f"Blocked: {details['blocked']}"
-                )
-            ))
+    for username in usernames:
+        details = users[username]
+        title = f"{username}"
+        description = f"Traffic Limit: {details['max_download_bytes'] / (1024 ** 3):.2f} GB, Expiration Days: {details['expiration_days']}"
+        results.append(types.InlineQueryResultArticle(
+            id=username,
+            title=title,
+            description=description,
+            input_message_content=types.InputTextMessageContent(
+                message_text=f"Name: {username}\n"
+                             f"Traffic limit: {details['max_download_bytes'] / (1024 ** 3):.2f} GB\n"
+                             f"Days: {details['expiration_days']}\n"
+                             f"Account Creation: {details['account_creation_date']}\n"
+                             f"Blocked: {details['blocked']}"
+            )
+        ))
 
-    bot.answer_inline_query(query.id, results, cache_time=0)
+    bot.answer_inline_query(
+        query.id,
+        results,
+        cache_time=5,
+        is_personal=True,
+        next_offset=str(offset + INLINE_PAGE_SIZE) if has_more else ''
+    )
@@ -1,10 +1,18 @@
 from dotenv import load_dotenv
 from telebot import types
 from utils.command import *
+from utils.user_directory import user_directory
 
-@bot.message_handler(func=lambda message: is_admin(message.from_user.id) and message.text == '📊 Server Info')
+@router.text('📊 Server Info', role=ADMIN)
 def server_info(message):
     command = f"python3 {CLI_PATH} server-info"
     result = run_cli_command(command)
     bot.send_chat_action(message.chat.id, 'typing')
-    bot.reply_to(message, result)
+    cache = user_directory.stats()
+    bot.reply_to(
+        message,
+        f"{result}\n\n"
+        f"⚙️ CLI queue: {cli_queue_depth()} waiting, {cli_executor.running()} running\n"
+        f"📤 Outgoing messages waiting: {outbound_queue_depth()}\n"
+        f"🗂 User cache: {cache['hit_ratio']:.0%} hits ({cache['hits']}/{cache['hits'] + cache['misses']})"
+    )
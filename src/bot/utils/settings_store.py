@@ -0,0 +1,117 @@
+"""
+Cached, atomically written JSON documents for the bot's settings files.
+
+Each file is parsed once and served from memory. It is re-read only when a
+stat, done at most once per STAT_INTERVAL, shows it was replaced or
+modified by something else. Writes go to a temp file in the same directory
+that is renamed over the original, one writer per file at a time, so
+readers never see a half-written document.
+"""
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+STAT_INTERVAL = 1.0
+
+_documents = {}
+_documents_lock = threading.Lock()
+
+
+class JsonDocument:
+    def __init__(self, path, default=None, indent=None):
+        self.path = path
+        self.default = default
+        self.indent = indent
+        self._lock = threading.RLock()
+        self._data = None
+        self._signature = None
+        self._checked_at = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _current(self):
+        # Called with the lock held; returns the cached document, reloading it if the file changed
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < STAT_INTERVAL:
+            return self._data
+        self._checked_at = now
+        signature = self._stat()
+        if signature != self._signature or self._data is None:
+            self._signature = signature
+            self._data = self._read() if signature is not None else None
+            if self._data is None:
+                self._data = copy.deepcopy(self.default)
+        return self._data
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading {self.path}: {str(e)}")
+            return None
+
+    def load(self):
+        """Return a deep copy of the document that the caller may modify"""
+        with self._lock:
+            return copy.deepcopy(self._current())
+
+    def read(self, func):
+        """Return func(document) without copying; func must not modify or keep the document"""
+        with self._lock:
+            return func(self._current())
+
+    def save(self, data):
+        """Replace the document on disk and in memory"""
+        with self._lock:
+            self._write(data)
+            self._data = copy.deepcopy(data)
+
+    def update(self, func):
+        """Apply func to a copy of the document and save it, as one step; returns what func returns"""
+        with self._lock:
+            data = copy.deepcopy(self._current())
+            result = func(data)
+            self.save(data)
+            return result
+
+    def _write(self, data):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        try:
+            mode = os.stat(self.path).st_mode & 0o777
+        except OSError:
+            mode = 0o644
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path) + '.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f, indent=self.indent)
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(temp_path, mode)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        self._signature = self._stat()
+        self._checked_at = time.monotonic()
+
+
+def json_document(path, default=None, indent=None):
+    """Shared JsonDocument for path, so every user of a file goes through the same lock and cache"""
+    with _documents_lock:
+        document = _documents.get(path)
+        if document is None:
+            document = _documents[path] = JsonDocument(path, default, indent)
+        return document
@@ -1,24 +1,17 @@
-import json
-import os
+from utils.settings_store import json_document
 
 TEST_MODE_FILE = '/etc/hysteria/core/scripts/telegrambot/test_mode.json'
 
+_test_mode = json_document(TEST_MODE_FILE, default={})
+
 def load_test_mode():
-    try:
-        if os.path.exists(TEST_MODE_FILE):
-            with open(TEST_MODE_FILE, 'r') as f:
-                data = json.load(f)
-                return data.get('enabled', False)
-    except Exception:
-        pass
-    return False
+    return _test_mode.read(lambda data: data.get('enabled', False))
 
 def save_test_mode(enabled):
-    os.makedirs(os.path.dirname(TEST_MODE_FILE), exist_ok=True)
-    with open(TEST_MODE_FILE, 'w') as f:
-        json.dump({'enabled': enabled}, f)
+    _test_mode.save({'enabled': enabled})
 
 def toggle_test_mode():
-    current = load_test_mode()
-    save_test_mode(not current)
-    return not current 
+    def toggle(data):
+        data['enabled'] = not data.get('enabled', False)
+        return data['enabled']
+    return _test_mode.update(toggle)
@@ -0,0 +1,185 @@
+"""
+Config URI and subscription link retrieval.
+
+All show-user-uri calls go through here so that views showing several
+configs fetch them in one batch and every caller parses the output the
+same way. Results are cached per (username, IP family) until the user's
+password or name changes, the user is reset or removed, or the server
+configuration files change.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from utils.command import CLI_PATH, run_cli_batch, on_user_write, cli_option
+from utils.async_cli import run_cli_command_async
+
+URI_CACHE_TTL = int(os.getenv('URI_CACHE_TTL', str(24 * 3600)))
+URI_CACHE_SIZE = 20000
+# Files the URI is derived from besides the user itself (endpoint, ports, obfs, SNI)
+URI_SOURCE_FILES = [
+    path for path in os.getenv(
+        'URI_SOURCE_FILES', '/etc/hysteria/config.json,/etc/hysteria/.configs.env'
+    ).split(',') if path
+]
+SOURCE_CHECK_INTERVAL = 5
+
+
+class UriCache:
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (username, ip_version, sublinks) -> (stored_at, entry)
+        self._source_version = None
+        self._source_checked_at = 0.0
+        self.generation = 0  # Bumped on every invalidation so in-flight fetches are not stored
+
+    def _source_signature(self):
+        signature = []
+        for path in URI_SOURCE_FILES:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_ino, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None))
+        return tuple(signature)
+
+    def _check_sources(self):
+        # Called with the lock held; a stat every few seconds is enough to notice config edits
+        now = time.monotonic()
+        if now - self._source_checked_at < SOURCE_CHECK_INTERVAL:
+            return
+        self._source_checked_at = now
+        version = self._source_signature()
+        if version != self._source_version:
+            self._entries.clear()
+            self.generation += 1
+            self._source_version = version
+
+    def get(self, key):
+        with self._lock:
+            self._check_sources()
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            stored_at, entry = item
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry)
+
+    def put(self, key, entry, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic(), dict(entry))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username=None):
+        """Drop the entries of one user, or everything when username is None"""
+        with self._lock:
+            self.generation += 1
+            if username is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == username]:
+                del self._entries[key]
+
+
+uri_cache = UriCache(URI_CACHE_TTL, URI_CACHE_SIZE)
+
+
+@on_user_write
+def _invalidate_on_write(args, ok):
+    # Dropping entries is safe either way, a failed command may still have changed the user
+    command, username = args[0], cli_option(args, '-u')
+    if not username:
+        return
+    if command in ('remove-user', 'reset-user', 'add-user'):
+        uri_cache.invalidate(username)
+    elif command == 'edit-user' and ('-rp' in args or '-nu' in args):
+        uri_cache.invalidate(username)
+        if cli_option(args, '-nu'):
+            uri_cache.invalidate(cli_option(args, '-nu'))
+
+
+def parse_uri_output(output):
+    """Pull the hy2 URI and subscription links out of show-user-uri output"""
+    lines = [line.strip() for line in output.strip().split('\n')]
+    parsed = {'uri': '', 'singbox_sublink': '', 'normal_sub_sublink': ''}
+    for i, line in enumerate(lines):
+        next_line = lines[i + 1] if i + 1 < len(lines) else ''
+        if line.startswith("hy2://") and not parsed['uri']:
+            parsed['uri'] = line
+        elif line.startswith("Singbox Sublink:"):
+            parsed['singbox_sublink'] = next_line
+        elif line.startswith("Normal-SUB Sublink:"):
+            parsed['normal_sub_sublink'] = next_line
+    return parsed
+
+
+def _cached_uris(usernames, ip_version, sublinks):
+    """Split usernames into ({username: cached entry}, [usernames to fetch])"""
+    uris = {}
+    missing = []
+    for username in usernames:
+        cached = uri_cache.get((username, ip_version, sublinks))
+        if cached is not None:
+            uris[username] = cached
+        else:
+            missing.append(username)
+    return uris, missing
+
+
+def _uri_commands(usernames, ip_version, sublinks):
+    flags = f"-ip {ip_version}" + (" -s -n" if sublinks else "")
+    return [f"python3 {CLI_PATH} show-user-uri -u {username} {flags}" for username in usernames]
+
+
+def _store_uris(uris, missing, outputs, ip_version, sublinks, generation):
+    for username, output in zip(missing, outputs):
+        entry = parse_uri_output(output)
+        entry['error'] = output if "Error" in output or "Invalid" in output else ''
+        if entry['uri'] and not entry['error']:
+            uri_cache.put((username, ip_version, sublinks), entry, generation)
+        uris[username] = entry
+    return uris
+
+
+def get_user_uris(usernames, ip_version=4, sublinks=False):
+    """
+    Return {username: {'uri', 'singbox_sublink', 'normal_sub_sublink', 'error'}}.
+
+    'error' holds the CLI output when it reported a problem, otherwise ''.
+    """
+    uris, missing = _cached_uris(list(usernames), ip_version, sublinks)
+    if not missing:
+        return uris
+    generation = uri_cache.generation
+    outputs = run_cli_batch(_uri_commands(missing, ip_version, sublinks))
+    return _store_uris(uris, missing, outputs, ip_version, sublinks, generation)
+
+
+def get_user_uri(username, ip_version=4, sublinks=False):
+    return get_user_uris([username], ip_version, sublinks)[username]
+
+
+async def get_user_uris_async(usernames, ip_version=4, sublinks=False):
+    """get_user_uris for the asyncio engine; the CLI calls overlap instead of batching"""
+    uris, missing = _cached_uris(list(usernames), ip_version, sublinks)
+    if not missing:
+        return uris
+    generation = uri_cache.generation
+    outputs = await asyncio.gather(
+        *(run_cli_command_async(command) for command in _uri_commands(missing, ip_version, sublinks))
+    )
+    return _store_uris(uris, missing, outputs, ip_version, sublinks, generation)
+
+
+async def get_user_uri_async(username, ip_version=4, sublinks=False):
+    return (await get_user_uris_async([username], ip_version, sublinks))[username]
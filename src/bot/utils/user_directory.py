@@ -0,0 +1,201 @@
+"""
+Shared in-process cache of the `list-users` output.
+
+Every reader gets the same parsed snapshot. It is refreshed after
+USER_CACHE_TTL seconds and dropped whenever the bot changes a user.
+Alongside it the directory keeps a Telegram ID -> configs index so a
+client's configs can be found without scanning every username.
+"""
+import json
+import os
+import re
+import threading
+import time
+from utils.command import CLI_PATH, run_cli_command, on_user_write, cli_option
+from utils.audience import audience_segments
+from utils.languages import get_language_store
+
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '30'))
+
+# Usernames created by the bot look like {telegram_id}d{timestamp}
+CONFIG_USERNAME = re.compile(r'^(\d+)d(\d+)$')
+
+
+def telegram_id_of(username):
+    """Return the Telegram ID encoded in a bot-created username, or None"""
+    match = CONFIG_USERNAME.match(username)
+    return match.group(1) if match else None
+
+
+class UserDirectory:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._users = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._by_telegram_id = None  # {telegram_id: {username: {'blocked': bool}}}
+        self._indexed_at = 0.0
+        self._hits = 0
+        self._misses = 0
+
+    def _fresh(self, max_age):
+        return self._users is not None and time.monotonic() - self._loaded_at <= max_age
+
+    def get_users(self, max_age=None):
+        """
+        Return the {username: details} dict from list-users.
+
+        The dict is shared between callers and must not be modified.
+        Raises json.JSONDecodeError when the CLI output is not JSON.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            if self._fresh(max_age):
+                self._hits += 1
+                return self._users
+
+        # Only one thread refreshes; the others wait and reuse its result
+        with self._refresh_lock:
+            with self._lock:
+                if self._fresh(max_age):
+                    self._hits += 1
+                    return self._users
+                self._misses += 1
+                generation = self._generation
+
+            users = json.loads(run_cli_command(f"python3 {CLI_PATH} list-users"))
+
+            with self._lock:
+                # Keep the result unless a write invalidated it while we were fetching
+                if generation == self._generation:
+                    self._users = users
+                    self._loaded_at = time.monotonic()
+                    self._rebuild_index(users)
+                elif self._by_telegram_id is None:
+                    self._rebuild_index(users)
+            return users
+
+    def invalidate(self, index=False):
+        """Drop the snapshot; with index, also rebuild the Telegram ID index on its next use"""
+        with self._lock:
+            self._users = None
+            self._generation += 1
+            if index:
+                self._indexed_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / total if total else 0.0
+            }
+
+    def _rebuild_index(self, users):
+        index = {}
+        for username, details in users.items():
+            telegram_id = telegram_id_of(username)
+            if telegram_id:
+                index.setdefault(telegram_id, {})[username] = {'blocked': bool(details.get('blocked', False))}
+        self._by_telegram_id = index
+        self._indexed_at = time.monotonic()
+        audience_segments.load_owners(index)
+
+    def _ensure_index(self):
+        # Writes made by the bot are patched in, but blocks and expiries done on
+        # the server only show up in a fresh list-users, so rebuild after the TTL
+        with self._lock:
+            if self._by_telegram_id is not None and time.monotonic() - self._indexed_at <= self.ttl:
+                return
+        self.get_users()
+
+    def configs_for(self, telegram_id):
+        """Return {username: {'blocked': bool}} for the configs owned by telegram_id"""
+        self._ensure_index()
+        with self._lock:
+            return {
+                username: dict(status)
+                for username, status in self._by_telegram_id.get(str(telegram_id), {}).items()
+            }
+
+    def telegram_ids(self):
+        """Return {telegram_id: {username: {'blocked': bool}}} for every config owner"""
+        self._ensure_index()
+        with self._lock:
+            return {
+                telegram_id: {username: dict(status) for username, status in configs.items()}
+                for telegram_id, configs in self._by_telegram_id.items()
+            }
+
+    def apply_write(self, args):
+        """Patch the index for a user-modifying command and drop the snapshot"""
+        self.invalidate()
+        if not args:
+            return
+        command, username = args[0], cli_option(args, '-u')
+        if not username:
+            return
+
+        with self._lock:
+            index = self._by_telegram_id
+            if index is None:
+                return
+
+            old_owner = telegram_id_of(username)
+            status = index.get(old_owner, {}).get(username) if old_owner else None
+
+            if command == 'add-user':
+                if old_owner:
+                    index.setdefault(old_owner, {})[username] = {'blocked': False}
+            elif command == 'remove-user':
+                if status is not None:
+                    del index[old_owner][username]
+                    if not index[old_owner]:
+                        del index[old_owner]
+            elif command == 'edit-user' and status is not None:
+                status = dict(status)
+                if '-b' in args or len(args) == 3:
+                    # The block confirmation sends `-u name -b` to block and just `-u name` to unblock
+                    status['blocked'] = '-b' in args
+                del index[old_owner][username]
+                if not index[old_owner]:
+                    del index[old_owner]
+                new_username = cli_option(args, '-nu') or username
+                new_owner = telegram_id_of(new_username)
+                if new_owner:
+                    index.setdefault(new_owner, {})[new_username] = status
+                    if new_owner != old_owner:
+                        audience_segments.update_owner(new_owner, index.get(new_owner))
+            if old_owner:
+                audience_segments.update_owner(old_owner, index.get(old_owner))
+
+    def audience(self, segment):
+        """Telegram IDs (as strings) in a broadcast segment: 'all', 'active' or 'expired'"""
+        self._ensure_index()
+        get_language_store()  # Loading the store registers its users
+        return audience_segments.members(segment)
+
+    def audience_sizes(self, max_age=None):
+        """{segment: size}; refreshes a stale snapshot first so configs that expired are counted"""
+        self.get_users(max_age)
+        get_language_store()
+        return audience_segments.sizes()
+
+
+user_directory = UserDirectory(USER_CACHE_TTL)
+
+
+@on_user_write
+def _apply_user_write(args, ok):
+    if ok:
+        user_directory.apply_write(args)
+    else:
+        # The command may or may not have changed the user; rebuild from list-users instead of guessing
+        user_directory.invalidate(index=True)
+
+
+def get_users(max_age=None):
+    return user_directory.get_users(max_age)
@@ -0,0 +1,120 @@
+"""
+Search index over the user directory for the admin inline query.
+
+Prefix matches come from a trie and substring matches from a trigram
+index, so a keystroke costs time proportional to the matches rather than
+to the whole user base. Full result lists are cached briefly so the next
+page and back-to-back keystrokes do not search again.
+"""
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
+
+NGRAM = 3
+TRIE_DEPTH = 6  # Deeper prefixes are resolved by filtering the bucket at this depth
+RESULT_CACHE_TTL = 15
+RESULT_CACHE_SIZE = 256
+
+
+class UserSearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._source = None
+        self._trie = {}
+        self._grams = {}
+        self._sorted = []
+        self._results = OrderedDict()
+
+    def _build(self, users):
+        trie = {}
+        grams = {}
+        ordered = sorted(users, key=str.lower)
+        for username in ordered:
+            key = username.lower()
+            node = trie
+            for char in key[:TRIE_DEPTH]:
+                node = node.setdefault(char, {})
+            node.setdefault('', []).append(username)
+            for gram in {key[i:i + NGRAM] for i in range(len(key) - NGRAM + 1)}:
+                bucket = grams.get(gram)
+                if bucket is None:
+                    grams[gram] = bucket = []
+                bucket.append(username)
+        self._trie = trie
+        self._grams = grams
+        self._sorted = ordered
+        self._results.clear()
+
+    def _sync(self, users):
+        # The directory hands out the same dict until it refreshes
+        if users is not self._source:
+            self._build(users)
+            self._source = users
+
+    def _prefix_matches(self, prefix):
+        node = self._trie
+        for char in prefix[:TRIE_DEPTH]:
+            node = node.get(char)
+            if node is None:
+                return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for name in node.get('', []):
+                if len(prefix) <= TRIE_DEPTH or name.lower().startswith(prefix):
+                    yield name
+            stack.extend(node[char] for char in sorted((c for c in node if c), reverse=True))
+
+    def _substring_matches(self, query):
+        """Usernames containing query but not starting with it"""
+        if len(query) < NGRAM:
+            return (
+                name for name in self._sorted
+                if query in name.lower() and not name.lower().startswith(query)
+            )
+        buckets = sorted(
+            (self._grams.get(query[i:i + NGRAM], []) for i in range(len(query) - NGRAM + 1)),
+            key=len
+        )
+        candidates = set(buckets[0])
+        for bucket in buckets[1:]:
+            candidates.intersection_update(bucket)
+        return sorted(
+            (name for name in candidates if query in name.lower() and not name.lower().startswith(query)),
+            key=str.lower
+        )
+
+    def _all_matches(self, query):
+        if not query:
+            yield from self._sorted
+            return
+        yield from self._prefix_matches(query)
+        yield from self._substring_matches(query)
+
+    def search(self, users, query, offset=0, limit=50):
+        """Return (usernames, has_more) for one page of matches"""
+        query = query.strip().lower()
+        with self._lock:
+            self._sync(users)
+
+            if len(query) < NGRAM:
+                # Short queries match a large share of users, only walk as far as the page needs
+                page = list(islice(self._all_matches(query), offset, offset + limit + 1))
+                return page[:limit], len(page) > limit
+
+            cached = self._results.get(query)
+            if cached and time.monotonic() - cached[0] <= RESULT_CACHE_TTL:
+                self._results.move_to_end(query)
+                matches = cached[1]
+            else:
+                matches = list(self._all_matches(query))
+                self._results[query] = (time.monotonic(), matches)
+                self._results.move_to_end(query)
+                while len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+
+            return matches[offset:offset + limit], offset + limit < len(matches)
+
+
+user_search_index = UserSearchIndex()
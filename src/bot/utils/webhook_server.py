@@ -0,0 +1,134 @@
+"""
+Webhook delivery of Telegram updates.
+
+An embedded HTTP server accepts the updates Telegram posts and queues them
+for a fixed pool of worker threads. Updates are sharded by chat, so each
+chat's updates are handled in order (next-step handlers rely on that) while
+different chats proceed in parallel. Queues are bounded: when they are
+full the server answers 503 and Telegram retries the update later, instead
+of the bot buffering without limit.
+"""
+import hashlib
+import hmac
+import json
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from telebot import types
+
+MAX_UPDATE_SIZE = 1024 * 1024
+
+
+class _HttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Telegram opens up to max_connections at once
+
+
+def webhook_secret(token):
+    """Stable secret_token for setWebhook derived from the bot token"""
+    return hashlib.sha256(f"webhook:{token}".encode('utf-8')).hexdigest()
+
+
+def _shard_key(update):
+    for event in (update.message, update.edited_message, update.callback_query, update.inline_query,
+                  update.chosen_inline_result, update.my_chat_member, update.chat_member):
+        if event is None:
+            continue
+        chat = getattr(event, 'chat', None)
+        if chat is not None:
+            return chat.id
+        if getattr(event, 'message', None) is not None:
+            return event.message.chat.id
+        return event.from_user.id
+    return update.update_id
+
+
+class TelegramWebhookServer:
+    def __init__(self, bot, url, host, port, secret, workers, queue_size):
+        self.bot = bot
+        self.url = url
+        self.host = host
+        self.port = port
+        self.path = urlparse(url).path or '/'
+        self.secret = secret
+        self._queues = [queue.Queue(max(1, queue_size // workers)) for _ in range(workers)]
+        self._server = None
+
+    def queue_depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def start(self, register=True):
+        """Start the workers and the HTTP server; register=True also points Telegram at url"""
+        for index, updates in enumerate(self._queues):
+            threading.Thread(target=self._worker, args=(updates,), name=f'update-worker-{index}', daemon=True).start()
+
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                webhook._receive(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _HttpServer((self.host, self.port), Handler)
+        if register:
+            self.bot.remove_webhook()
+            self.bot.set_webhook(url=self.url, secret_token=self.secret, max_connections=len(self._queues) * 5)
+        print(f"Telegram webhook listening on {self.host}:{self.server_port()}{self.path}")
+
+    def server_port(self):
+        return self._server.server_address[1]
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _reply(self, request, code):
+        request.send_response(code)
+        request.send_header('Content-Length', '0')
+        request.end_headers()
+
+    def _receive(self, request):
+        if urlparse(request.path).path != self.path:
+            self._reply(request, 404)
+            return
+        if self.secret and not hmac.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''), self.secret
+        ):
+            self._reply(request, 403)
+            return
+        try:
+            length = int(request.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length <= 0 or length > MAX_UPDATE_SIZE:
+            self._reply(request, 400)
+            return
+        try:
+            update = types.Update.de_json(json.loads(request.rfile.read(length)))
+        except Exception as e:
+            print(f"Error decoding Telegram update: {str(e)}")
+            self._reply(request, 400)
+            return
+
+        try:
+            self._queues[hash(_shard_key(update)) % len(self._queues)].put_nowait(update)
+        except queue.Full:
+            self._reply(request, 503)  # Telegram redelivers it later
+            return
+        self._reply(request, 200)
+
+    def _worker(self, updates):
+        while True:
+            update = updates.get()
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f"Error handling update {update.update_id}: {str(e)}")
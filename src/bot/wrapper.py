@@ -53,6 +53,9 @@ def check_environment():
         'SUB_URL'
     ]
     
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        required_vars.append('BOT_WEBHOOK_URL')
+    
     missing = []
     for var in required_vars:
         if not os.getenv(var):
@@ -78,7 +81,9 @@ def run_bot():
         # Import the bot module only after environment check
         import tbot
         
-        # The bot should start polling in the tbot module
+        # Blocks while the bot polls or serves the webhook
+        logger.info(f"Running in {tbot.BOT_MODE} mode with the {tbot.BOT_ENGINE} engine")
+        tbot.main()
         
     except Exception as e:
         logger.error(f"Failed to start bot: {str(e)}")
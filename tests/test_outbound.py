@@ -0,0 +1,38 @@
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src', 'bot'))
+
+from utils.outbound import OutboundLimiter
+
+
+def test_chat_backlog_does_not_delay_other_chats():
+    limiter = OutboundLimiter(global_rate=30, chat_rate=1, group_rate=1 / 3)
+    delays = [limiter.reserve_chat(111) for _ in range(8)]
+    assert delays[-1] > 4  # The chat itself is paced to one message a second after its burst
+
+    assert limiter.reserve_chat(222) == 0
+    assert limiter.reserve_chat(333) == 0
+
+
+def test_two_chats_send_concurrently():
+    limiter = OutboundLimiter(global_rate=100, chat_rate=10, group_rate=10, chat_burst=1)
+    busy = threading.Thread(target=lambda: [limiter.wait(111) for _ in range(8)])
+    busy.start()
+    time.sleep(0.05)
+
+    started = time.monotonic()
+    limiter.wait(222)
+    assert time.monotonic() - started < 0.1
+    busy.join()
+
+
+def test_global_rate_still_applies_across_chats():
+    limiter = OutboundLimiter(global_rate=10, chat_rate=10, group_rate=10)
+    started = time.monotonic()
+    for chat_id in range(25):
+        limiter.wait(chat_id)
+    # A burst of 10, then 15 more at ten a second
+    assert 1.3 < time.monotonic() - started < 2
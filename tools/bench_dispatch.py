@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Benchmark message dispatch: the handler chain as registered before the
+router (one is_admin + label predicate per button) against the bot as
+registered now, on a mix of admin, client and unmatched messages.
+
+Measures how long telebot takes to find the handler of an update, which is
+the part the router changes; handlers themselves are not run.
+
+Usage: python tools/bench_dispatch.py [--count 20000] [--admins 2]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'bot'))
+
+
+def make_message(text, user_id):
+    from telebot import types
+    return types.Message.de_json({
+        'message_id': 1,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'bench'},
+        'chat': {'id': user_id, 'type': 'private'},
+        'date': 0,
+        'text': text
+    })
+
+
+def legacy_bot(admin_ids):
+    """A TeleBot with handlers registered the way the modules did before the router"""
+    import telebot
+    from utils.languages import LANGUAGES, TRANSLATIONS
+
+    def is_admin(user_id):
+        return str(user_id) in map(str, admin_ids)
+
+    def noop(message):
+        pass
+
+    bot = telebot.TeleBot('1:bench', threaded=False)
+    admin_labels = ['❌ Delete User', '👤 Show User', '➕ Add User', '📝 Edit Plans', '💾 Backup Server']
+    client_labels = ['🎁 Test Config', '📱 My Configs', '💰 Purchase Plan', '⬇️ Downloads', '📞 Support']
+    late_admin_labels = ['📢 Broadcast Message', '📊 Server Info', '📞 Edit Support', '🔧 Payment Test', '💳 Payment Settings']
+    # Module import order in tbot.py: admin user management, then client.py, then the admin_* modules
+    for label in admin_labels:
+        bot.register_message_handler(noop, func=lambda message, label=label: is_admin(message.from_user.id) and message.text == label)
+    for label in client_labels:
+        bot.register_message_handler(noop, func=lambda message, label=label: message.text == label)
+    for label in late_admin_labels:
+        bot.register_message_handler(noop, func=lambda message, label=label: is_admin(message.from_user.id) and message.text == label)
+    bot.register_message_handler(noop, commands=['start'])
+    bot.register_message_handler(
+        noop, func=lambda message: not is_admin(message.from_user.id) and message.text in LANGUAGES.keys()
+    )
+    all_menu_items = []
+    for lang in TRANSLATIONS.values():
+        all_menu_items.extend([lang['my_configs'], lang['purchase_plan'], lang['downloads'], lang['support']])
+    bot.register_message_handler(
+        noop, func=lambda message: not is_admin(message.from_user.id) and message.text in all_menu_items
+    )
+    return bot
+
+
+def current_bot(admin_ids):
+    os.environ.setdefault('TELEGRAM_TOKEN', '1:bench')
+    os.environ['ADMIN_USER_IDS'] = json.dumps(admin_ids)
+    import tbot
+    return tbot.bot
+
+
+def find_handler(bot, message):
+    for handler in bot.message_handlers:
+        if bot._test_message_handler(handler, message):
+            return handler
+    return None
+
+
+def bench(name, bot, messages, count):
+    matched = sum(find_handler(bot, message) is not None for message in messages)
+    rounds = max(1, count // len(messages))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            find_handler(bot, message)
+    elapsed = time.perf_counter() - start
+    per_update = elapsed / (rounds * len(messages)) * 1e6
+    print(f"{name:<22} {per_update:8.2f} us/update   {matched}/{len(messages)} routed   {len(bot.message_handlers)} telebot handlers")
+    return per_update
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark message handler dispatch")
+    parser.add_argument('--count', type=int, default=20000)
+    parser.add_argument('--admins', type=int, default=2, help="number of configured admin IDs")
+    options = parser.parse_args()
+
+    from utils.languages import TRANSLATIONS
+    admin_ids = [1000 + i for i in range(options.admins)]
+    admin, client = admin_ids[-1], 424242
+    mixes = {
+        'admin, last button': [make_message('💳 Payment Settings', admin)],
+        'client, translated': [
+            make_message(TRANSLATIONS['fa']['my_configs'], client),
+            make_message(TRANSLATIONS['ru']['purchase_plan'], client)
+        ],
+        'client, English': [make_message('📞 Support', client)],
+        'unmatched text': [make_message('hello there', client)],
+    }
+
+    legacy = legacy_bot(admin_ids)
+    current = current_bot(admin_ids)
+    for mix, messages in mixes.items():
+        print(f"-- {mix}")
+        before = bench('legacy predicates', legacy, messages, options.count)
+        after = bench('router', current, messages, options.count)
+        print(f"{'speedup':<22} {before / after:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Stand-in for Cryptomus that posts signed payment notifications to the bot's
+webhook endpoint.
+
+Send one notification to a running bot:
+    python tools/fake_cryptomus.py --url http://127.0.0.1:8089/cryptomus \\
+        --key <CRYPTOMUS_API_KEY> --uuid <payment uuid> --status paid --amount 5
+
+Check signature handling and deduplication against a local endpoint:
+    python tools/fake_cryptomus.py --self-test
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from hashlib import md5
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'bot'))
+
+
+def sign(data, key, php_style=True):
+    if php_style:
+        # What Cryptomus itself sends: PHP json_encode output
+        text = json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('/', '\\/')
+    else:
+        text = json.dumps(data)
+    encoded = base64.b64encode(text.encode('utf-8')).decode('utf-8')
+    return md5(f"{encoded}{key}".encode('utf-8')).hexdigest()
+
+
+def notification(payment_id, status, amount, paid=None):
+    paid = amount if paid is None else paid
+    return {
+        'type': 'payment',
+        'uuid': payment_id,
+        'order_id': str(uuid.uuid4()),
+        'amount': f"{amount:.2f}",
+        'payment_amount': f"{paid:.8f}",
+        'payment_amount_usd': f"{paid:.2f}",
+        'merchant_amount': f"{paid * 0.98:.8f}",
+        'commission': f"{paid * 0.02:.8f}",
+        'is_final': status not in ('check', 'process', 'confirm_check'),
+        'status': status,
+        'from': None,
+        'wallet_address_uuid': None,
+        'network': 'tron',
+        'currency': 'USD',
+        'payer_currency': 'USDT',
+        'additional_data': json.dumps({'payment_id': payment_id}),
+        'txid': uuid.uuid4().hex
+    }
+
+
+def post(url, data, key, php_style=True, bad_sign=False):
+    body = dict(data)
+    body['sign'] = '0' * 32 if bad_sign else sign(data, key, php_style)
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, response.read().decode('utf-8')
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode('utf-8')
+
+
+def self_test():
+    key = 'fake-api-key'
+    os.environ['CRYPTOMUS_MERCHANT_ID'] = 'fake-merchant'
+    os.environ['CRYPTOMUS_API_KEY'] = key
+    from utils.payments import CryptomusPayment
+    from utils.payment_webhook import PaymentWebhookServer
+
+    received = []
+    server = PaymentWebhookServer('127.0.0.1', 0, '/cryptomus', CryptomusPayment().verify_webhook, received.append)
+    server.start()
+    url = f"http://127.0.0.1:{server._server.server_address[1]}/cryptomus"
+
+    payment_id = str(uuid.uuid4())
+    paid = notification(payment_id, 'paid', 5, 5)
+    checks = [
+        ('PHP-style signature accepted', post(url, paid, key), 200),
+        ('repeat acknowledged', post(url, paid, key), 200),
+        ('bad signature rejected', post(url, paid, key, bad_sign=True), 403),
+        ('json.dumps signature accepted', post(url, notification(payment_id, 'paid_over', 5, 6), key, php_style=False), 200),
+        ('unknown path rejected', post(url.replace('/cryptomus', '/other'), paid, key), 404),
+    ]
+    time.sleep(0.2)
+    server.stop()
+
+    failed = False
+    for name, (code, _), expected in checks:
+        ok = code == expected
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name}: HTTP {code}")
+    processed = [(data['uuid'], data['status']) for data in received]
+    ok = processed == [(payment_id, 'paid'), (payment_id, 'paid_over')]
+    failed |= not ok
+    print(f"{'ok  ' if ok else 'FAIL'} each notification processed once: {len(processed)} handled")
+    return 1 if failed else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Post signed Cryptomus payment notifications")
+    parser.add_argument('--self-test', action='store_true', help="run against a local endpoint and check the results")
+    parser.add_argument('--url', help="webhook URL of the bot (PAYMENT_WEBHOOK_URL)")
+    parser.add_argument('--key', default=os.getenv('CRYPTOMUS_API_KEY'), help="Cryptomus payment API key")
+    parser.add_argument('--uuid', help="payment uuid as shown to the user")
+    parser.add_argument('--status', default='paid')
+    parser.add_argument('--amount', type=float, default=1.0, help="invoice amount in USD")
+    parser.add_argument('--paid', type=float, help="amount paid in USD, defaults to --amount")
+    parser.add_argument('--repeat', type=int, default=1, help="send the same notification this many times")
+    parser.add_argument('--python-json', action='store_true', help="sign json.dumps output instead of PHP-style JSON")
+    parser.add_argument('--bad-sign', action='store_true')
+    options = parser.parse_args()
+
+    if options.self_test:
+        return self_test()
+    if not options.url or not options.key or not options.uuid:
+        parser.error("--url, --key and --uuid are required")
+
+    data = notification(options.uuid, options.status, options.amount, options.paid)
+    for _ in range(options.repeat):
+        code, text = post(options.url, data, options.key, not options.python_json, options.bad_sign)
+        print(f"HTTP {code}: {text}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Stand-in for Telegram that POSTs updates to the bot's webhook endpoint and
+reports throughput.
+
+Against a running bot in webhook mode (handlers will try to reply through
+the real Bot API, so use a test bot):
+    python tools/fake_telegram.py --url http://127.0.0.1:8090/telegram \\
+        --secret <BOT_WEBHOOK_SECRET> --text '⬇️ Downloads' --count 500
+
+Against a local webhook server whose handler just sleeps, to see how the
+worker and queue settings behave with slow handlers:
+    python tools/fake_telegram.py --self-test --workers 8 --handler-ms 50
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'bot'))
+
+_update_ids = itertools.count(1)
+
+
+def message_update(chat_id, text):
+    update_id = next(_update_ids)
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'fake'},
+            'chat': {'id': chat_id, 'type': 'private'},
+            'date': int(time.time()),
+            'text': text
+        }
+    }
+
+
+def post(url, secret, update):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode('utf-8'),
+        headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret or ''},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 'error'
+
+
+def send(url, secret, updates, concurrency):
+    """
+    POST every update, retrying 503s and failed connections like Telegram
+    does; a chat's updates are sent one after another, in order, while
+    different chats use parallel connections. Returns (status counts, seconds).
+    """
+    statuses = Counter()
+    chats = defaultdict(list)
+    for update in updates:
+        chats[update['message']['chat']['id']].append(update)
+
+    def deliver(chat_updates):
+        for update in chat_updates:
+            delay = 0.05
+            while True:
+                status = post(url, secret, update)
+                statuses[status] += 1
+                if status not in (503, 'error'):
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, 1.0)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(deliver, chats.values()))
+    return statuses, time.perf_counter() - start
+
+
+def self_test(options):
+    import telebot
+    from utils.webhook_server import TelegramWebhookServer
+
+    bot = telebot.TeleBot('1:fake', threaded=False)
+    handled = defaultdict(list)
+    done = threading.Semaphore(0)
+
+    @bot.message_handler(func=lambda message: True)
+    def slow_handler(message):
+        time.sleep(options.handler_ms / 1000)
+        handled[message.chat.id].append(message.message_id)
+        done.release()
+
+    server = TelegramWebhookServer(
+        bot, 'http://127.0.0.1/telegram', '127.0.0.1', 0, 'secret', options.workers, options.queue_size
+    )
+    server.start(register=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port()}/telegram"
+
+    rejected = post(url, 'wrong', message_update(1, 'x'))
+    updates = [message_update(1000 + i % options.chats, 'hello') for i in range(options.count)]
+    start = time.perf_counter()
+    statuses, _ = send(url, 'secret', updates, options.concurrency)
+    for _ in updates:
+        done.acquire()
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    in_order = all(ids == sorted(ids) for ids in handled.values())
+    ideal = options.workers / (options.handler_ms / 1000) if options.handler_ms else float('inf')
+    print(f"bad secret: HTTP {rejected}")
+    print(f"responses: {dict(statuses)}")
+    print(f"handled {sum(map(len, handled.values()))} updates from {len(handled)} chats in {elapsed:.2f}s "
+          f"= {options.count / elapsed:.0f} updates/s (ideal {ideal:.0f}/s)")
+    print(f"per-chat order kept: {in_order}")
+    return 0 if rejected == 403 and in_order else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST fake Telegram updates to a webhook")
+    parser.add_argument('--self-test', action='store_true', help="run against a local server with a sleeping handler")
+    parser.add_argument('--url', help="webhook URL of the bot (BOT_WEBHOOK_URL, or its local address)")
+    parser.add_argument('--secret', help="BOT_WEBHOOK_SECRET, or the one derived from the bot token")
+    parser.add_argument('--text', default='/start', help="message text to send")
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--chats', type=int, default=50, help="distinct chats the updates come from")
+    parser.add_argument('--concurrency', type=int, default=20, help="parallel connections, Telegram uses up to max_connections")
+    parser.add_argument('--workers', type=int, default=8, help="self-test: update workers")
+    parser.add_argument('--queue-size', type=int, default=1000, help="self-test: queued updates before 503")
+    parser.add_argument('--handler-ms', type=float, default=50, help="self-test: time each handler sleeps")
+    options = parser.parse_args()
+
+    if options.self_test:
+        return self_test(options)
+    if not options.url:
+        parser.error("--url is required")
+    if options.secret is None:
+        token = os.getenv('TELEGRAM_TOKEN')
+        if token:
+            from utils.webhook_server import webhook_secret
+            options.secret = webhook_secret(token)
+
+    updates = [message_update(1000 + i % options.chats, options.text) for i in range(options.count)]
+    statuses, elapsed = send(options.url, options.secret, updates, options.concurrency)
+    print(f"responses: {dict(statuses)}")
+    print(f"delivered {options.count} updates in {elapsed:.2f}s = {options.count / elapsed:.0f} updates/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())